@@ -0,0 +1,40 @@
+"""
+Reports the memory used per file system object.
+
+Builds a tree of drives, folders, zips and files through the public API and measures the memory
+allocated while doing so with tracemalloc. Run it with:
+
+    python -m benchmarks.node_memory [--nodes N]
+"""
+import argparse
+import json
+import tracemalloc
+import memfs
+
+
+def measure(fs_type, count):
+    """Returns the number of bytes allocated per object when creating 'count' objects of the given type"""
+    memfs.index._file_system.reset()
+    drive = memfs.create('drive', 'Drive')
+    parent = memfs.create('folder', 'Parent', drive.path)
+    names = ['{}{}'.format(fs_type, i) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for name in names:
+        memfs.create(fs_type, name, parent.path)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    memfs.index._file_system.reset()
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=100000, help='Number of objects created per type')
+    args = parser.parse_args()
+    results = {fs_type: round(measure(fs_type, args.nodes), 1) for fs_type in ('folder', 'zip', 'file')}
+    print(json.dumps({'nodes': args.nodes, 'bytes_per_node': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Times the public file system operations on wide, deep and mixed trees of increasing size.
+
+Each tree is built through the public API beneath 'Drive\\Root'. Then a fixed, seeded sample of its
+objects is used to time lookups, paths, sizes, writes (whole and from buffers), reads (whole, as
+buffers and through streams), moves, snapshots, batches, traversals (walk, glob, find and indexed
+queries), saving and loading, and deletes. Watches and importing or exporting trees are not timed.
+The memory used per object is measured in a separate build with tracemalloc. Results are printed
+(or written) as JSON, so that runs on different releases can be compared. Run it with:
+
+    python -m benchmarks.scale [--sizes 1000 10000 ...] [--shapes wide deep mixed] [--output FILE]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import memfs
+
+SHAPES = ('wide', 'deep', 'mixed')
+# Number of nested folders in each chain of the deep tree
+DEEP_CHAIN_LENGTH = 100
+# Number of children of each container in the mixed tree
+MIXED_FANOUT = 10
+CONTENT = 'x' * 64
+BUFFER = bytearray(b'y' * 64)
+
+
+def build(shape, count):
+    """
+    Builds a tree of the given shape with about 'count' objects, returning its containers and files
+
+    wide:  every object is a file in a single folder
+    deep:  chains of DEEP_CHAIN_LENGTH nested folders, with a file in each folder
+    mixed: containers with MIXED_FANOUT children each (70% files, 20% folders, 10% zips), filled
+           breadth first, with a little content in every file
+    """
+    drive = memfs.create('drive', 'Drive')
+    root = memfs.create('folder', 'Root', drive)
+    containers, files = [root], []
+    if shape == 'wide':
+        for i in range(count - 2):
+            files.append(memfs.create('file', 'File{}'.format(i), root))
+    elif shape == 'deep':
+        parent = root
+        for i in range((count - 2) // 2):
+            if i % DEEP_CHAIN_LENGTH == 0:
+                parent = root
+            parent = memfs.create('folder', 'Folder{}'.format(i), parent)
+            containers.append(parent)
+            files.append(memfs.create('file', 'File{}'.format(i), parent))
+    elif shape == 'mixed':
+        pending = 0
+        for i in range(count - 2):
+            parent = containers[pending]
+            kind = i % 10
+            if kind < 7:
+                files.append(memfs.create('file', 'File{}'.format(i), parent))
+                memfs.write_to_file(files[-1], CONTENT)
+            else:
+                containers.append(memfs.create('folder' if kind < 9 else 'zip', 'Container{}'.format(i), parent))
+            if (i + 1) % MIXED_FANOUT == 0:
+                pending += 1
+    else:
+        raise ValueError('Unknown tree shape: {}'.format(shape))
+    return drive, containers, files
+
+
+def measure_memory(shape, count):
+    """Returns the number of bytes allocated per object while building a tree"""
+    memfs.index._file_system.reset()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    _, containers, files = build(shape, count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = len(containers) + len(files) + 1
+    del containers, files
+    memfs.index._file_system.reset()
+    return (after - before) / nodes
+
+
+def timed(operation, items):
+    """Calls 'operation' on each item and returns the timing of the whole run"""
+    gc.collect()
+    start = time.perf_counter()
+    for item in items:
+        operation(item)
+    return _timing(len(items), time.perf_counter() - start)
+
+
+def _timing(ops, seconds):
+    return {
+        'ops': ops,
+        'seconds': round(seconds, 6),
+        'ops_per_sec': round(ops / seconds, 1) if seconds else None,
+        'us_per_op': round(seconds * 1e6 / ops, 3) if ops else None,
+    }
+
+
+def run(shape, count, samples, seed, memory):
+    """Builds a tree of the given shape and size and times each operation on it"""
+    memfs.index._file_system.reset()
+    gc.collect()
+    start = time.perf_counter()
+    drive, containers, files = build(shape, count)
+    build_seconds = time.perf_counter() - start
+    nodes = len(containers) + len(files) + 1
+
+    rng = random.Random(seed)
+    sample_files = rng.sample(files, min(samples, len(files)))
+    sample_containers = rng.sample(containers, min(samples, len(containers)))
+    sample_sized = rng.choices(containers + [drive], k=samples)
+    sample_paths = [obj.path for obj in sample_files + sample_containers]
+    file_paths = sample_paths[:len(sample_files)]
+    # Both writes change every file's size, so both propagate the change to all of its ancestors
+    operations = {
+        'create': _timing(nodes, build_seconds),
+        'lookup': timed(memfs.index._get_object, sample_paths),
+        'path': timed(lambda obj: obj.path, sample_files),
+        'size': timed(lambda obj: obj.size, sample_sized),
+        'write_to_file': timed(lambda obj: memfs.write_to_file(obj, CONTENT + '!'), sample_files),
+        'write_to_file_by_path': timed(lambda path: memfs.write_to_file(path, CONTENT), file_paths),
+        'read': timed(lambda obj: obj.content, sample_files),
+        'write_from': timed(lambda obj: memfs.write_from(obj, BUFFER), sample_files),
+        'read_buffer': timed(memfs.read_buffer, sample_files),
+        'is_ancestor': timed(lambda obj: memfs.is_ancestor(drive, obj), sample_files),
+    }
+
+    def stream_append(obj):
+        with memfs.open(obj, 'ab') as stream:
+            stream.write(b'!')
+
+    def stream_read(obj):
+        with memfs.open(obj, 'rb') as stream:
+            for _ in stream:
+                pass
+    operations['open_append'] = timed(stream_append, sample_files)
+    operations['open_read'] = timed(stream_read, sample_files)
+
+    # Taking a snapshot is O(1), while the first write to each object beneath a live snapshot copies it
+    operations['snapshot'] = timed(lambda _: memfs.snapshot().release(), range(len(sample_files)))
+    with memfs.snapshot():
+        operations['write_under_snapshot'] = timed(lambda obj: memfs.write_to_file(obj, CONTENT + '?'),
+                                                   sample_files)
+
+    batch_folder = memfs.create('folder', 'Batch', drive)
+    start = time.perf_counter()
+    with memfs.batch() as batch:
+        for i in range(len(sample_files)):
+            batch.create('file', 'File{}'.format(i), batch_folder)
+    operations['batch_create'] = _timing(len(sample_files), time.perf_counter() - start)
+    memfs.delete(batch_folder)
+
+    def move_and_back(obj):
+        original_path = obj.path
+        memfs.move(obj, '{}\\Moved'.format(obj.parent.path))
+        memfs.move(obj, original_path)
+    operations['move'] = timed(move_and_back, sample_files)
+    operations['move']['ops'] *= 2
+
+    # Moving the root of the tree re-indexes every object and invalidates every cached path
+    operations['move_subtree'] = timed(lambda obj: memfs.move(obj, 'Drive\\Moved'), [containers[0]])
+    operations['path_after_move'] = timed(lambda obj: obj.path, sample_files)
+
+    start = time.perf_counter()
+    walked = sum(len(listing[1]) + len(listing[2]) for listing in memfs.walk(drive))
+    operations['walk'] = _timing(walked, time.perf_counter() - start)
+    start = time.perf_counter()
+    globbed = sum(1 for _ in memfs.glob('Drive\\**\\*7'))
+    operations['glob'] = _timing(globbed, time.perf_counter() - start)
+    operations['glob']['matches'] = globbed
+    # find checks every object beneath the drive, so it is timed per object
+    start = time.perf_counter()
+    found = sum(1 for _ in memfs.find(drive, type='file', name='*7'))
+    operations['find'] = _timing(nodes, time.perf_counter() - start)
+    operations['find']['matches'] = found
+
+    start = time.perf_counter()
+    memfs.set_query_indexes(True)
+    operations['query_index_build'] = _timing(nodes, time.perf_counter() - start)
+    operations['query'] = timed(lambda obj: memfs.query(type='file', name=obj.name), sample_files)
+    memfs.set_query_indexes(False)
+
+    # Loading replaces every object, so the sampled files are deleted by path afterwards
+    delete_paths = [obj.path for obj in sample_files]
+    with tempfile.TemporaryDirectory() as directory:
+        saved_path = os.path.join(directory, 'scale.memfs')
+        start = time.perf_counter()
+        memfs.save(saved_path)
+        operations['save'] = _timing(nodes, time.perf_counter() - start)
+        start = time.perf_counter()
+        memfs.load(saved_path)
+        operations['load'] = _timing(nodes, time.perf_counter() - start)
+        operations['delete'] = timed(memfs.delete, delete_paths)
+        # The loaded content is mapped from the saved file, which must be released before it is removed
+        memfs.index._file_system.reset()
+
+    result = {
+        'shape': shape,
+        'nodes': nodes,
+        'samples': len(sample_files),
+        'operations': operations,
+    }
+    del drive, containers, files, sample_files, sample_containers, sample_sized
+    memfs.index._file_system.reset()
+    if memory:
+        result['bytes_per_node'] = round(measure_memory(shape, count), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Tree sizes (number of objects) to benchmark, e.g. 1000 up to 10000000')
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES), help='Tree shapes to benchmark')
+    parser.add_argument('--samples', type=int, default=10000, help='Number of objects each operation is timed on')
+    parser.add_argument('--seed', type=int, default=0, help='Seed used to pick the sampled objects')
+    parser.add_argument('--no-memory', action='store_true', help='Skip measuring the memory used per object')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of printing them')
+    args = parser.parse_args()
+
+    results = [run(shape, size, args.samples, args.seed, not args.no_memory)
+               for size in args.sizes for shape in args.shapes]
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
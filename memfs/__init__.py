@@ -1,4 +1,11 @@
 # Expose file system contract methods
-from .index import create, delete, move, write_to_file
+from .index import (create, delete, move, write_to_file, write_from, read_buffer, open, is_ancestor, snapshot,
+                    save, load, set_thread_safe, set_deduplicated, set_memory_budget, set_query_indexes,
+                    enable_journal, disable_journal)
+from .index import batch, walk, glob, find, query, watch, import_tree, export_tree
+from .index import FileSystem
+from .sharding import ShardedFileSystem
+from .client import Client
+from .metrics import set_metrics, stats, add_hook, remove_hook
 # Expose file system exceptions.py
 from .index import InvalidWriteException, PathNotFoundException, PathAlreadyExistsException, IllegalFileSystemOperation
@@ -0,0 +1,153 @@
+"""
+This file contains the batch API used to apply many file system operations all-or-nothing
+"""
+from . import index
+from . import journal
+from . import watch
+from .metrics import instrumented
+from .spill import spill_store
+
+
+class Batch:
+    """
+    Queues create, delete, move and write_to_file operations and applies them together on commit.
+
+    Operations are validated and applied in the order they were queued, so later operations may
+    depend on earlier ones (e.g. creating a folder and then a file inside it). If any operation
+    fails, every operation already applied by the batch is undone and the error is re-raised,
+    leaving the file system exactly as it was before the commit.
+
+    Parent objects resolved while applying 'create' operations are remembered for the rest of the
+    commit, so that creating many objects in the same folder only looks the folder up once.
+
+    If journaling is enabled, the operations are only journaled once the whole batch has been
+    applied, so a rolled back batch leaves nothing in the journal. Likewise, watches are delivered
+    the events of the whole batch at once after it has been committed, and nothing if it is rolled back.
+    """
+    def __init__(self, fs):
+        self.fs = fs
+        self.operations = []
+        self.committed = False
+
+    def create(self, fs_type, name, parent_path=''):
+        self.operations.append((self._apply_create, (fs_type, name, parent_path)))
+
+    def delete(self, path):
+        self.operations.append((self._apply_delete, (path,)))
+
+    def move(self, src, dest):
+        self.operations.append((self._apply_move, (src, dest)))
+
+    def write_to_file(self, path, content):
+        self.operations.append((self._apply_write_to_file, (path, content)))
+
+    @instrumented('batch')
+    def commit(self):
+        """
+        Apply all queued operations.
+
+        :return: The results of each operation, in the order they were queued
+        :raises: Any exception raised by one of the operations, after rolling the batch back
+        """
+        if self.committed:
+            raise index.IllegalFileSystemOperation('This batch has already been committed')
+        self.committed = True
+        self._parents = {}
+        undo_log = []
+        results = []
+        records = []
+        # A batch may touch any part of the tree, so in thread-safe mode it locks the whole tree
+        with self.fs._locked(lambda: [self.fs.root]):
+            try:
+                for apply, args in self.operations:
+                    result, undo, record = apply(*args)
+                    undo_log.append(undo)
+                    results.append(result)
+                    records.append(record)
+            except Exception:
+                for undo in reversed(undo_log):
+                    undo()
+                if self.fs._watchers is not None:
+                    self.fs._watchers.discard()
+                raise
+            finally:
+                self._parents = None
+            if self.fs._journal is not None:
+                for record in records:
+                    self.fs._record(*record)
+        self.fs._maybe_compact()
+        self.fs._notify()
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Nothing has been applied yet if the block itself failed, so the queue is simply dropped
+        if exc_type is None:
+            self.commit()
+
+    def _apply_create(self, fs_type, name, parent_path):
+        # Drives are always created at the root, so only parents of other objects are cached
+        parent = self._parents.get(parent_path) if fs_type != 'drive' else None
+        if parent is None:
+            parent = self.fs._get_create_parent(fs_type, parent_path)
+            if fs_type != 'drive':
+                self._parents[parent_path] = parent
+        new_path = index._object_path(parent.path, name)
+        if self.fs._get_object(new_path):
+            raise index.PathAlreadyExistsException("The requested path to create already exists")
+        new_object = index._create_object(name, fs_type)
+        self.fs._link(new_object, parent, new_path)
+        self.fs._emit(watch.CREATED, new_path)
+
+        def undo():
+            self.fs._unlink(new_object, new_path)
+            # Undoing a write to the new file restores its empty content, which counts against the budget
+            if new_object.type == 'file':
+                spill_store.discard(new_object)
+        return new_object, undo, (journal.CREATE, fs_type, name, parent.path)
+
+    def _apply_delete(self, path):
+        to_delete, to_delete_path = self.fs._resolve(path)
+        parent = to_delete.parent if to_delete else None
+        # Deleting releases the files' references to shared content, which undoing takes back
+        shared = [(sub_object, sub_object._digest) for _, sub_object in index._iter_subtree(to_delete_path, to_delete)
+                  if sub_object.type == 'file' and sub_object._digest is not None] if to_delete else []
+        path = self.fs._delete(path)
+        # Cached parents may have just been detached along with the deleted subtree
+        self._parents.clear()
+
+        def undo():
+            self.fs._link(to_delete, parent, path)
+            for file, digest in shared:
+                file._restore_content(digest)
+            # Deleting stopped tracking the files' use of memory, so it is tracked again
+            if spill_store.enabled:
+                for _, sub_object in index._iter_subtree(path, to_delete):
+                    if sub_object.type == 'file' and sub_object._chunks:
+                        spill_store.touch(sub_object)
+        return None, undo, (journal.DELETE, path)
+
+    def _apply_move(self, src, dest):
+        src_object = self.fs._resolve(src)[0]
+        src_parent = src_object.parent if src_object else None
+        src_name = src_object.name if src_object else None
+        src_object, src = self.fs._move(src, dest)
+        self._parents.clear()
+
+        def undo():
+            self.fs._unlink(src_object, dest)
+            src_object.name = src_name
+            self.fs._link(src_object, src_parent, src)
+        return src_object, undo, (journal.MOVE, src, dest)
+
+    def _apply_write_to_file(self, path, content):
+        write_object = self.fs._resolve(path)[0]
+        state = write_object._get_state() if write_object and write_object.type == 'file' else None
+        data, is_text = self.fs._write_to_file(path, content)[1:]
+        record = None
+        if self.fs._journal is not None:
+            record = (journal.WRITE, write_object.path, index._TEXT_FLAGS[is_text], data or b'')
+        return write_object, lambda: write_object._set_state(state), record
+
@@ -0,0 +1,292 @@
+"""
+This file contains the client of a file system shared by memfs.server
+"""
+import queue
+import socket
+import threading
+from . import rpc
+from .exceptions import IllegalFileSystemOperation, InvalidWriteException
+from .filesystem import as_bytes
+
+
+class Client:
+    """
+    Uses a file system served by memfs.server, mirroring the module-level functions.
+
+    Objects live in the server, so they are given by path, and operations return the paths of the
+    objects they return in-process. Calls may be made from any number of threads: each call borrows
+    a connection from a pool of up to 'pool_size' connections, opened as needed and kept open for
+    later calls. Many calls can also be sent at once, without waiting for each response, through a
+    pipeline.
+
+    :param address: The path of the server's Unix socket, or its (host, port)
+    :param pool_size: The maximum number of connections opened to the server
+    :param timeout: Seconds to wait for the server before giving up on a call, or None to wait forever
+    """
+    def __init__(self, address, pool_size=4, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._closed = False
+
+    def create(self, fs_type, name, parent_path=''):
+        """Create an object, see memfs.create. Returns the path of the created object"""
+        return self._call(rpc.CREATE, fs_type, name, parent_path)
+
+    def delete(self, path):
+        """Delete an object, see memfs.delete"""
+        return self._call(rpc.DELETE, path)
+
+    def move(self, src, dest):
+        """Move an object, see memfs.move. Returns the path of the moved object"""
+        return self._call(rpc.MOVE, src, dest)
+
+    def write_to_file(self, path, content):
+        """Write new content to a file, see memfs.write_to_file. Returns the path of the file"""
+        return self._call(rpc.WRITE, path, *_content_fields(content))
+
+    def read(self, path):
+        """
+        Read the whole content of a file.
+
+        :param path: The path of the file to read
+        :return: The file's content, as a str or bytes depending on how it was written, or None if
+            nothing was ever written to it
+        """
+        return self._call(rpc.READ, path)
+
+    def size(self, path):
+        """Returns the size of the object at the given path, or of the whole file system for ''"""
+        return self._call(rpc.SIZE, path)
+
+    def children(self, path):
+        """Returns the names of the children of the container at the given path"""
+        return self._call(rpc.CHILDREN, path)
+
+    def glob(self, pattern):
+        """Find the paths of the objects matching the given pattern, see memfs.glob"""
+        return self._call(rpc.GLOB, pattern)
+
+    def exists(self, path):
+        """Returns whether an object exists at the given path"""
+        return self._call(rpc.EXISTS, path)
+
+    def pipeline(self):
+        """
+        Start queueing calls to send to the server at once.
+
+        Use it as a context manager, or call its execute method: the queued calls are sent together
+        over a single connection, and applied by the server in the order they were queued.
+
+            with client.pipeline() as p:
+                for i in range(1000):
+                    p.create('file', 'File{}'.format(i), 'Drive1')
+            paths = p.results
+
+        :return: A new Pipeline
+        """
+        return Pipeline(self)
+
+    def close(self):
+        """Closes the idle connections, and every other one as soon as it is returned to the pool"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _call(self, operation, *fields):
+        return self._send([(operation, fields)])[0].result()
+
+    def _send(self, requests):
+        """Sends the given (operation, fields) requests at once, returning their responses in order"""
+        if self._closed:
+            raise IllegalFileSystemOperation('The client has been closed')
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = _Connection(self.address, self.timeout)
+            try:
+                responses = connection.exchange(requests)
+            except BaseException:
+                # The connection can't be trusted to be in sync with the server any more
+                connection.close()
+                raise
+            if self._closed:
+                connection.close()
+            else:
+                self._idle.put(connection)
+            return responses
+        finally:
+            self._slots.release()
+
+
+class Pipeline:
+    """
+    Queues calls to a Client's server and sends them all at once on execute (see Client.pipeline).
+
+    Every call returns immediately. Once executed, 'results' holds the result of each call in the
+    order they were queued. If calls failed, the first error is raised once every response has been
+    received, and the results of the failed calls are their exceptions.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.results = None
+        self._requests = []
+
+    def create(self, fs_type, name, parent_path=''):
+        self._requests.append((rpc.CREATE, (fs_type, name, parent_path)))
+
+    def delete(self, path):
+        self._requests.append((rpc.DELETE, (path,)))
+
+    def move(self, src, dest):
+        self._requests.append((rpc.MOVE, (src, dest)))
+
+    def write_to_file(self, path, content):
+        self._requests.append((rpc.WRITE, (path,) + _content_fields(content)))
+
+    def read(self, path):
+        self._requests.append((rpc.READ, (path,)))
+
+    def size(self, path):
+        self._requests.append((rpc.SIZE, (path,)))
+
+    def children(self, path):
+        self._requests.append((rpc.CHILDREN, (path,)))
+
+    def glob(self, pattern):
+        self._requests.append((rpc.GLOB, (pattern,)))
+
+    def exists(self, path):
+        self._requests.append((rpc.EXISTS, (path,)))
+
+    def execute(self):
+        """
+        Send the queued calls and wait for their results.
+
+        :return: The results of each call, in the order they were queued
+        :raises: The first error raised by one of the calls, once every call has been applied
+        """
+        requests, self._requests = self._requests, []
+        responses = self.client._send(requests) if requests else []
+        self.results = []
+        error = None
+        for response in responses:
+            try:
+                self.results.append(response.result())
+            except Exception as e:
+                self.results.append(e)
+                error = error or e
+        if error is not None:
+            raise error
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Nothing is sent if the block itself failed
+        if exc_type is None:
+            self.execute()
+
+
+def _content_fields(content):
+    """Returns the fields sending the given file content, as for write_to_file"""
+    if isinstance(content, str):
+        return rpc.encode_flag(True), content
+    data = as_bytes(content)
+    if data is None:
+        raise InvalidWriteException('File content must be a str or a bytes-like object')
+    return rpc.encode_flag(False), data
+
+
+class _Response:
+    __slots__ = ('operation', 'status', 'fields')
+
+    def __init__(self, operation, status, fields):
+        self.operation = operation
+        self.status = status
+        self.fields = fields
+
+    def result(self):
+        """Returns the result of the call, or raises the error it failed with"""
+        fields = self.fields
+        if self.status != rpc.OK:
+            rpc.raise_error(fields)
+        operation = self.operation
+        if operation == rpc.READ:
+            if not fields:
+                return None
+            return rpc.text(fields[1]) if rpc.decode_flag(fields[0]) else bytes(fields[1])
+        if operation == rpc.SIZE:
+            return rpc.decode_number(fields[0])
+        if operation == rpc.EXISTS:
+            return rpc.decode_flag(fields[0])
+        if operation == rpc.CHILDREN or operation == rpc.GLOB:
+            return [rpc.text(field) for field in fields]
+        return rpc.text(fields[0]) if fields else None
+
+
+class _Connection:
+    """A blocking connection to the server, used by one call (or pipeline) at a time"""
+    def __init__(self, address, timeout):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET6 if ':' in address[0] else socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.settimeout(timeout)
+        try:
+            self.socket.connect(address)
+        except BaseException:
+            self.socket.close()
+            raise
+        self.reader = self.socket.makefile('rb')
+        self.next_id = 0
+
+    def exchange(self, requests):
+        """Sends every request, then reads every response"""
+        first_id = self.next_id
+        frames = []
+        for operation, fields in requests:
+            frames.extend(rpc.encode(self.next_id, operation, fields))
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        # A writer thread keeps sending while responses are read, so that neither side's socket
+        # buffers can fill up and block the other while a long pipeline is exchanged
+        sender = threading.Thread(target=self.socket.sendall, args=(b''.join(frames),), daemon=True) \
+            if len(requests) > 1 else None
+        if sender is not None:
+            sender.start()
+        else:
+            self.socket.sendall(b''.join(frames))
+        responses = []
+        for offset, (operation, _) in enumerate(requests):
+            header = self._read(rpc.HEADER.size)
+            length, request_id, status = rpc.HEADER.unpack(header)
+            if request_id != (first_id + offset) & 0xFFFFFFFF:
+                raise IllegalFileSystemOperation('Received a response to the wrong request from the server')
+            responses.append(_Response(operation, status, rpc.decode(self._read(length)) if length else []))
+        if sender is not None:
+            sender.join()
+        return responses
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+    def _read(self, size):
+        data = self.reader.read(size)
+        if len(data) != size:
+            raise ConnectionError('The connection to the server was closed')
+        return data
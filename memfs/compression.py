@@ -0,0 +1,82 @@
+"""
+This file contains the compression helpers used for the content of files stored beneath a Zip
+"""
+import threading
+import zlib
+from collections import OrderedDict
+
+# zlib compression level used for file content stored beneath a Zip
+COMPRESSION_LEVEL = 6
+# Maximum number of decompressed bytes kept around for recently read compressed files
+DECOMPRESSED_CACHE_SIZE = 4 * 1024 * 1024
+# Number of raw bytes compressed together. Each block is decompressed on its own, so that reading
+# part of a large file only decompresses the blocks covering it
+BLOCK_SIZE = 64 * 1024
+
+
+def compress(data):
+    """Compresses a single content chunk. Empty chunks are stored as-is."""
+    return zlib.compress(data, COMPRESSION_LEVEL) if data else b''
+
+
+def decompress(data):
+    return zlib.decompress(data) if data else b''
+
+
+def compress_blocks(data):
+    """
+    Compresses content in blocks of BLOCK_SIZE raw bytes (the last one possibly shorter), each of
+    which can be decompressed on its own. Empty content is stored as a single empty block.
+    """
+    if len(data) <= BLOCK_SIZE:
+        return [compress(data)]
+    view = memoryview(data)
+    return [compress(view[start:start + BLOCK_SIZE]) for start in range(0, len(data), BLOCK_SIZE)]
+
+
+class DecompressedCache:
+    """
+    A small least-recently-used cache of decompressed content chunks, bounded by the total number
+    of decompressed bytes it holds. Files larger than the whole budget are never cached.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+            return None
+
+    def put(self, key, chunks, size):
+        with self._lock:
+            self._discard(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = (chunks, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+decompressed_cache = DecompressedCache(DECOMPRESSED_CACHE_SIZE)
@@ -0,0 +1,89 @@
+"""
+This file contains the content-addressed store used to deduplicate identical file content
+"""
+import hashlib
+import threading
+
+
+class ContentStore:
+    """
+    Keeps a single, reference-counted copy of each distinct file content written while it is
+    enabled. Content is addressed by its hash and by whether it is stored compressed, so identical
+    files inside and outside of a Zip each share their own stored form.
+
+    Files hold the key of the blob they reference, and must release it once their content changes
+    or they are deleted. Blobs are dropped once their last reference is released.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.size = 0  # Total number of stored bytes held in distinct blobs
+        self._blobs = {}  # Maps key -> [stored content, reference count]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def acquire(self, data, compressed, store):
+        """
+        Returns the key and the shared stored form of the given content, adding a reference to it
+
+        :param data: The raw content bytes
+        :param compressed: Whether the content is stored compressed
+        :param store: Callable converting the raw content to the list of chunks it is stored as, only
+            called for content that isn't in the store yet
+        """
+        key = (hashlib.blake2b(data, digest_size=20).digest(), compressed)
+        with self._lock:
+            entry = self._blobs.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return key, entry[0]
+        stored = store(data)
+        with self._lock:
+            entry = self._blobs.get(key)
+            if entry is None:
+                entry = self._blobs[key] = [stored, 0]
+                self.size += sum(len(chunk) for chunk in stored)
+            entry[1] += 1
+            return key, entry[0]
+
+    def restore(self, key, stored):
+        """
+        Adds a reference to the content with the given key again, for a file that released it (e.g.
+        because its deletion was undone). The file's own stored chunks are put back in the store if
+        the content was dropped meanwhile.
+
+        :param key: The key the file held the content under
+        :param stored: The list of chunks the file holds
+        :return: The shared stored form of the content
+        """
+        with self._lock:
+            entry = self._blobs.get(key)
+            if entry is None:
+                entry = self._blobs[key] = [stored, 0]
+                self.size += sum(len(chunk) for chunk in stored)
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, key):
+        with self._lock:
+            entry = self._blobs.get(key)
+            if entry is None:  # The store was cleared since, e.g. by resetting the file system
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._blobs[key]
+                self.size -= sum(len(chunk) for chunk in entry[0])
+
+    def references(self, key):
+        with self._lock:
+            entry = self._blobs.get(key)
+            return entry[1] if entry is not None else 0
+
+    def clear(self):
+        with self._lock:
+            self._blobs.clear()
+            self.size = 0
+
+
+content_store = ContentStore()
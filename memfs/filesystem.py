@@ -1,89 +1,615 @@
 """
 This file contains the file system objects representing things like Zip, File, etc.
 """
-import math
-from .exceptions import IllegalFileSystemOperation
+import bisect
+import sys
+import threading
+from enum import Enum
+from types import MappingProxyType
+from .compression import BLOCK_SIZE, compress_blocks, decompress, decompressed_cache
+from .content_store import content_store
+from .spill import spill_store
+from .exceptions import IllegalFileSystemOperation, InvalidWriteException
+from .snapshot import current_epoch, preserve, _versions
+
+
+class _TreeCounters:
+    """
+    Bookkeeping shared by all file system objects. The lock is only set in thread-safe mode, where
+    it serialises updates to aggregated sizes and to the path version counters.
+    """
+    def __init__(self):
+        self.lock = None
+        self.path_version = 0  # Bumped whenever existing paths start or stop changing
+        self.path_changes = 0  # Number of moves/deletes currently invalidating paths
+        self.thread_safe = 0  # Number of file systems currently in thread-safe mode
+
+
+_counters = _TreeCounters()
+
+
+def _readers_may_cache():
+    """
+    Whether reads may keep what they compute in the file they read (e.g. its collapsed chunks).
+    Readers only hold a shared lock in thread-safe mode, so they must then leave the file unchanged.
+    """
+    return not _counters.thread_safe
+
+
+# Shared, read-only children mapping of every container that has no children
+_NO_CHILDREN = MappingProxyType({})
+
+
+class NodeType(str, Enum):
+    """
+    The type tags of file system objects. They compare equal to the plain type names
+    (e.g. NodeType.FILE == 'file'), and are stored once per class rather than per object.
+    """
+    FILESYSTEM = 'filesystem'
+    DRIVE = 'drive'
+    FOLDER = 'folder'
+    ZIP = 'zip'
+    FILE = 'file'
+
+    def __str__(self):
+        return self.value
 
 
 class Container:
-    """Mixin-style class that makes an object behave as a container for other file system objects"""
-    def __init__(self, name, type):
-        self.name = name
-        self.type = type
+    """
+    Mixin-style class that makes an object behave as a container for other file system objects
+
+    Objects use __slots__ to keep their per-object overhead small, and the children mapping is only
+    allocated once a container gets its first child.
+    """
+    __slots__ = ('name', 'parent', '_children', '_size', '_stored_size', '_path', '_compressed', '_lock',
+                 '_cow_epoch', '_history')
+
+    def __init__(self, name):
+        self.name = sys.intern(name)
         self.parent = None
-        self.children = {}
+        self._children = None
+        self._size = 0  # Aggregated size of all children, maintained incrementally
+        self._stored_size = 0  # Aggregated number of bytes actually stored beneath this container
+        self._path = None  # Cached full path, cleared whenever this object or an ancestor moves
+        self._compressed = False  # Whether file content beneath this container is compressed
+        self._lock = None  # Reader/writer lock, only created in thread-safe mode
+        self._cow_epoch = current_epoch()  # Snapshot epoch in which this object was last preserved
+        self._history = None  # States preserved for live snapshots, see snapshot.preserve
 
     @property
     def size(self):
-        size = 0
-        for _, child in self.children.items():
-            size += child.size
-        return size
+        return self._size
+
+    @property
+    def stored_size(self):
+        """The number of content bytes held in memory for this container's subtree"""
+        return self._stored_size
+
+    def _update_size(self, delta, stored_delta):
+        """
+        Apply a change in the size of one of this container's children, propagating it up the
+        ancestor chain so that sizes are never recomputed by walking the whole subtree.
+        """
+        _propagate_size(self, delta, stored_delta)
+
+    @property
+    def children(self):
+        return self._children if self._children is not None else _NO_CHILDREN
 
     def get(self, name):
-        return self.children.get(name)
+        return self._children.get(name) if self._children is not None else None
 
     @property
     def path(self):
-        if not self.parent:
-            raise IllegalFileSystemOperation('The given file object is not present in the file system hierarchy')
-        if self.parent.path == '':
-            return self.name
-        else:
-            return "{}\\{}".format(self.parent.path, self.name)
+        return _cached_path(self)
+
+    def _add_child(self, child):
+        if self._children is None:
+            self._children = {}
+        self._children[child.name] = child
+
+    def _remove_child(self, child):
+        del self._children[child.name]
+        if not self._children:
+            self._children = None
 
 
 class FileSystem:
+    type = NodeType.FILESYSTEM
+
     def __init__(self):
         self.children = {}
-        self.type = 'filesystem'
+        self.name = ''
         self.path = ''
+        self.parent = None
+        self._size = 0
+        self._stored_size = 0
+        self._compressed = False
+        self._lock = None
+        self._cow_epoch = current_epoch()
+        self._history = None
+        self.index = {}  # Flat mapping of full path -> object for every object in the hierarchy
+        self.query_indexes = None  # Indexes by type and by name, only set while enabled
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def stored_size(self):
+        return self._stored_size
 
     def get(self, name):
         return self.children.get(name)
 
+    def _add_child(self, child):
+        self.children[child.name] = child
+
+    def _remove_child(self, child):
+        del self.children[child.name]
+
     def reset(self):
+        """
+        Removes every object. The removed drives are detached and their cached paths cleared, so that
+        handles to removed objects are reported as deleted, while live snapshots keep seeing them.
+        """
+        preserve(self)
+        index = self.index
+        begin_path_change()
+        for drive in self.children.values():
+            preserve(drive)
+            drive.parent = None
+        for obj in index.values():
+            obj._path = None
+        end_path_change()
         self.children = {}
+        self._size = 0
+        self._stored_size = 0
+        self.index = {}
+        if self.query_indexes is not None:
+            self.query_indexes.clear()
+        decompressed_cache.clear()
+        # The content and spill stores are shared with other file systems, so only release this one's files
+        if len(content_store) or spill_store.enabled:
+            for obj in index.values():
+                if obj.type == 'file':
+                    obj._release_content()
+                    spill_store.discard(obj)
+
+    def _update_size(self, delta, stored_delta):
+        _propagate_size(self, delta, stored_delta)
 
 
 class Drive(Container):
-    def __init__(self, name):
-        super(Drive, self).__init__(name, 'drive')
+    __slots__ = ()
+    type = NodeType.DRIVE
 
 
 class Folder(Container):
-    def __init__(self, name):
-        super(Folder, self).__init__(name, 'folder')
+    __slots__ = ()
+    type = NodeType.FOLDER
 
 
 class Zip(Container):
+    """
+    A container whose files are stored compressed. Its size is the number of compressed bytes
+    actually stored beneath it.
+    """
+    __slots__ = ()
+    type = NodeType.ZIP
+
     def __init__(self, name):
-        super(Zip, self).__init__(name, 'zip')
+        super(Zip, self).__init__(name)
+        self._compressed = True
 
     @property
     def size(self):
-        return math.ceil(super(Zip, self).size / 2)
+        return self._stored_size
 
 
 class File:
+    """
+    A leaf object holding content.
+
+    Content is always stored as bytes, kept as a list of chunks so that appending never copies the
+    data already in the file. The chunks are held along with the offset each one starts at in a
+    single '_content' pair, which readers take once so that they never see chunks and offsets from
+    different versions of the content. Text content is encoded once when it is written and decoded
+    again when read through 'content', while bytes content is returned as-is. The encoded length is
+    recorded at write time so that 'size' never has to touch the content.
+
+    Beneath a Zip content is stored in blocks of at most compression.BLOCK_SIZE raw bytes, each
+    compressed on its own. Reading part of the content only decompresses the blocks covering it,
+    while whole reads are kept in a small shared cache of recently read files.
+
+    While deduplication is enabled, content replaced as a whole is shared through the content store
+    with every other file holding the same content. '_digest' is then the key of the shared blob,
+    which is released as soon as the file's content changes.
+
+    In memory-bounded mode, the content of files that haven't been used for a while is spilled to
+    disk (see spill.SpillStore) and read back in on demand. Sizes and paths never touch content.
+    """
+    __slots__ = ('name', 'parent', '_path', '_content', '_is_text', '_size', '_stored_size', '_compressed',
+                 '_digest', '_lock', '_cow_epoch', '_history')
+    type = NodeType.FILE
+    encoding = 'utf-8'
+
     def __init__(self, name):
-        self.name = name
-        self.type = 'file'
+        self.name = sys.intern(name)
         self.parent = None
-        self.content = None
+        self._path = None
+        self._content = None  # (chunks, starting offset of each chunk), None until content is first written
+        self._is_text = False
+        self._size = 0
+        self._stored_size = 0
+        self._compressed = False
+        self._digest = None
+        self._lock = None
+        self._cow_epoch = current_epoch()
+        self._history = None
 
     @property
-    def size(self):
-        if self.content:
-            return len(self.content.encode('utf-8'))
+    def content(self):
+        data = self.data
+        if data is None or not self._is_text:
+            return data
+        return data.decode(self.encoding)
+
+    @content.setter
+    def content(self, content):
+        if content is None:
+            self._replace(None, False)
         else:
-            return 0
+            data, is_text = self._encode(content)
+            self._replace(data, is_text)
+
+    @property
+    def _chunks(self):
+        """The stored content chunks, or None until content is first written"""
+        content = self._content
+        return None if content is None else content[0]
+
+    @property
+    def data(self):
+        """The raw bytes stored in the file, without decoding"""
+        content = self._content
+        if content is None:
+            return None
+        chunks = self._raw_chunks(content)
+        if len(chunks) == 1 and type(chunks[0]) is bytes:
+            return chunks[0]
+        data = b''.join(chunks)
+        if not self._compressed and _readers_may_cache():
+            # Collapse the chunks so that repeated reads don't join them again
+            self._content = [data], [0]
+        return data
+
+    @property
+    def buffer(self):
+        """
+        A read-only memoryview of the raw bytes stored in the file. Uncompressed content is not
+        copied, and content loaded from a saved file system or spilled to disk is not even read into
+        memory, so the view stays valid (and unchanged) after the file is written to again.
+        """
+        content = self._content
+        if content is None:
+            return None
+        chunks = content[0]
+        if not self._compressed and len(chunks) == 1 and type(chunks[0]) is memoryview:
+            if spill_store.enabled:
+                spill_store.touch(self)
+            return chunks[0]
+        return memoryview(self.data).toreadonly()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def stored_size(self):
+        """The number of content bytes held in memory for this file, after any compression"""
+        return self._stored_size
 
     @property
     def path(self):
-        if not self.parent:
-            raise IllegalFileSystemOperation('The given file object is not present in the file system hierarchy')
-        return "{}\\{}".format(self.parent.path, self.name)
+        return _cached_path(self)
 
     def get(self, name):
         raise IllegalFileSystemOperation('File objects cannot contain other items')
+
+    def _get_state(self):
+        """Captures the stored content so that it can later be restored with _set_state"""
+        content = self._content
+        # Appends extend the chunk lists in place, so the captured state gets lists of its own
+        if content is not None:
+            content = list(content[0]), list(content[1])
+        return content, self._is_text, self._size, self._stored_size, self._compressed, self._digest
+
+    def _set_state(self, state):
+        """Restores content previously captured with _get_state"""
+        content, is_text, size, stored_size, compressed, digest = state
+        preserve(self)
+        decompressed_cache.discard(self)
+        self._release_content()
+        self._content, self._is_text, self._compressed = content, is_text, compressed
+        if digest is not None:
+            self._restore_content(digest)
+        self._resize(size, stored_size)
+
+    def _restore_content(self, digest):
+        """
+        Takes back the reference to shared content the file released under the given key, e.g. when
+        the write or deletion that released it is undone
+        """
+        content = self._content
+        stored = content_store.restore(digest, list(content[0]))
+        self._digest = digest
+        self._content = list(stored), content[1]
+
+    def _encode(self, content):
+        """Converts the given content to bytes, returning it with a flag saying whether it was text"""
+        if isinstance(content, str):
+            return content.encode(self.encoding), True
+        data = as_bytes(content)
+        if data is None:
+            raise InvalidWriteException('File content must be a str or a bytes-like object')
+        return data, False
+
+    def _replace(self, data, is_text):
+        """Replaces the whole content of the file with the given bytes"""
+        preserve(self)
+        decompressed_cache.discard(self)
+        self._release_content()
+        if data and content_store.enabled:
+            self._digest, stored = content_store.acquire(data, self._compressed, self._store)
+        else:
+            stored = None if data is None else self._store(data)
+        self._content = None if data is None else (list(stored), _block_offsets(0, len(stored)))
+        self._is_text = is_text
+        self._resize(len(data) if data else 0, _stored_length(stored) if stored else 0)
+
+    def _append(self, data):
+        """Appends the given bytes to the end of the file without copying the existing content"""
+        content = self._content
+        if content is None:
+            preserve(self)
+            content = self._content = [], []
+        if data:
+            preserve(self)
+            decompressed_cache.discard(self)
+            self._release_content()
+            stored = self._store(data)
+            # Readers are excluded while the file is written, so the lists can be extended in place
+            content[1].extend(_block_offsets(self._size, len(stored)))
+            content[0].extend(stored)
+            self._resize(self._size + len(data), self._stored_size + _stored_length(stored))
+
+    def _write_at(self, position, data):
+        """Writes the given bytes at the given offset, overwriting and extending as needed"""
+        if position == self._size:
+            return self._append(data)
+        current = self.data or b''
+        if position > len(current):
+            current += b'\0' * (position - len(current))
+        self._replace(current[:position] + data + current[position + len(data):], self._is_text)
+
+    def _read_at(self, position, length=-1):
+        """Reads up to 'length' bytes starting at the given offset (all remaining bytes if negative)"""
+        end = self._size if length < 0 else min(self._size, position + length)
+        return b''.join(self._iter_chunks(position, end))
+
+    def _iter_chunks(self, position, end=None):
+        """Yields the stored chunks covering the given byte range, slicing only the boundary chunks"""
+        end = self._size if end is None else end
+        content = self._content
+        if content is None or not content[0] or position >= end:
+            return
+        offsets = content[1]
+        chunks = decompressed_cache.get(self) if self._compressed else self._raw_chunks(content)
+        # Unless the whole file was decompressed recently, only the blocks covering the range are
+        inflate = chunks is None
+        if inflate:
+            if spill_store.enabled:
+                spill_store.touch(self)
+            chunks = content[0]
+        index = bisect.bisect_right(offsets, position) - 1
+        while index < len(chunks) and offsets[index] < end:
+            chunk, offset = chunks[index], offsets[index]
+            if inflate:
+                chunk = decompress(chunk)
+            if position > offset or end < offset + len(chunk):
+                chunk = chunk[max(position - offset, 0):end - offset]
+            yield chunk
+            index += 1
+
+    def _raw_chunks(self, content):
+        """Returns the uncompressed chunks of the given stored content, decompressing them if needed"""
+        if spill_store.enabled:
+            spill_store.touch(self)
+        chunks = content[0]
+        if not self._compressed:
+            if chunks and type(chunks[0]) is memoryview and _readers_may_cache():
+                # Content loaded from a saved file system, or spilled to disk, is only copied into
+                # memory when it is used (in thread-safe mode, it is read from the mapping instead)
+                chunks = [bytes(chunk) for chunk in chunks]
+                self._content = chunks, content[1]
+                if spill_store.enabled:
+                    spill_store.touch(self)
+            return chunks
+        chunks = decompressed_cache.get(self)
+        if chunks is None:
+            chunks = [decompress(chunk) for chunk in content[0]]
+            decompressed_cache.put(self, chunks, self._size)
+        return chunks
+
+    def _store(self, data):
+        """Converts raw content to the list of chunks it is stored as (see _block_offsets)"""
+        return compress_blocks(data) if self._compressed else [data]
+
+    def _set_compressed(self, compressed):
+        """Compresses or decompresses the stored content chunks, e.g. when moved in or out of a Zip"""
+        if compressed == self._compressed:
+            return
+        preserve(self)
+        raw_chunks = self._raw_chunks(self._content) if self._content is not None else None
+        decompressed_cache.discard(self)
+        shared = self._release_content() and content_store.enabled
+        self._compressed = compressed
+        if shared:
+            data = raw_chunks[0] if len(raw_chunks) == 1 else b''.join(raw_chunks)
+            self._digest, stored = content_store.acquire(data, compressed, self._store)
+            self._content = list(stored), _block_offsets(0, len(stored))
+        elif raw_chunks is not None:
+            chunks, offsets = [], []
+            for chunk, offset in zip(raw_chunks, self._content[1]):
+                stored = self._store(chunk)
+                chunks.extend(stored)
+                offsets.extend(_block_offsets(offset, len(stored)))
+            self._content = chunks, offsets
+        self._resize(self._size, sum(len(chunk) for chunk in self._chunks or ()))
+
+    def _release_content(self):
+        """Releases the file's reference to shared content, returning whether it held one"""
+        if self._digest is None:
+            return False
+        content_store.release(self._digest)
+        self._digest = None
+        return True
+
+    def _resize(self, size, stored_size):
+        delta = size - self._size
+        stored_delta = stored_size - self._stored_size
+        self._size = size
+        self._stored_size = stored_size
+        if spill_store.enabled:
+            spill_store.touch(self)
+        if (delta or stored_delta) and self.parent:
+            self.parent._update_size(delta, stored_delta)
+
+
+def _block_offsets(start, count):
+    """
+    Returns the raw offsets of the chunks stored for content starting at the given offset. Content
+    is stored as a single chunk, or beneath a Zip as blocks of exactly BLOCK_SIZE raw bytes but the last.
+    """
+    return [start + block * BLOCK_SIZE for block in range(count)]
+
+
+def _stored_length(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def as_bytes(content):
+    """
+    Returns the bytes held by the given bytes-like object (i.e. any object supporting the buffer
+    protocol, such as bytearray, memoryview, mmap or array objects), or None if it isn't one.
+    Bytes are returned as-is, and the content of any other buffer is copied exactly once.
+    """
+    if type(content) is bytes:
+        return content
+    try:
+        view = memoryview(content)
+    except TypeError:
+        return None
+    with view:
+        # Copies the raw bytes in C order, whatever the buffer's item format, shape and strides
+        return view.tobytes()
+
+
+def _cached_path(node):
+    """
+    Returns the full path of the given object, building and caching it on first access.
+
+    Only objects whose cache has been invalidated (i.e. after they or an ancestor moved) rebuild
+    their path, and they do so from their parent's cached path rather than from the root.
+
+    A path built while a move or delete was in progress might already be stale, so it is only
+    cached if no path changes were in progress or started while it was being built.
+    """
+    path = node._path
+    if path is None:
+        version = _counters.path_version
+        changing = _counters.path_changes
+        if not node.parent:
+            raise IllegalFileSystemOperation('The given file object is not present in the file system hierarchy')
+        parent_path = node.parent.path
+        path = node.name if parent_path == '' else "{}\\{}".format(parent_path, node.name)
+        if not changing and version == _counters.path_version:
+            node._path = path
+    return path
+
+
+def begin_path_change():
+    """Marks the start of an operation that invalidates existing paths"""
+    _update_counters(1)
+
+
+def end_path_change():
+    """Marks the end of an operation started with begin_path_change"""
+    _update_counters(-1)
+
+
+def set_thread_safe(enabled):
+    """
+    Enables or disables the locking of shared counters needed by thread-safe mode. The counters
+    are shared by every file system, so they stay locked while any of them is in thread-safe mode.
+    """
+    _counters.thread_safe += 1 if enabled else -1
+    if _counters.thread_safe <= 0:
+        _counters.thread_safe = 0
+        _counters.lock = None
+    elif _counters.lock is None:
+        _counters.lock = threading.Lock()
+
+
+def _update_counters(change):
+    lock = _counters.lock
+    if lock is None:
+        _counters.path_changes += change
+        _counters.path_version += 1
+    else:
+        with lock:
+            _counters.path_changes += change
+            _counters.path_version += 1
+
+
+def set_compressed(node, compressed):
+    """
+    Sets whether file content in the given subtree is stored compressed, converting the content of
+    every file in it. Zips always compress their own content, so their subtrees are left untouched.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.type == 'file':
+            node._set_compressed(compressed)
+        elif node.type != 'zip':
+            node._compressed = compressed
+            stack.extend(node.children.values())
+
+
+def _propagate_size(node, delta, stored_delta):
+    """
+    Add the given byte deltas to the aggregated sizes of the node and each of its ancestors.
+
+    The size delta passed on to a parent is the change in the node's *reported* size, which
+    differs from the raw delta for containers like Zip that report their compressed size.
+    """
+    lock = _counters.lock
+    if lock is None:
+        _apply_size_delta(node, delta, stored_delta)
+    else:
+        with lock:
+            _apply_size_delta(node, delta, stored_delta)
+
+
+def _apply_size_delta(node, delta, stored_delta):
+    while (delta or stored_delta) and node is not None:
+        if _versions.active:
+            preserve(node)
+        old_size = node.size
+        node._size += delta
+        node._stored_size += stored_delta
+        delta = node.size - old_size
+        node = node.parent
@@ -1,141 +1,868 @@
 """
 This file contains the code for the MemFs module public contract
 
-Assumptions:
- Concurrency is not a concern (i.e. methods like 'move' don't need to be atomic)
+Concurrency:
+ By default, no locking is performed and callers must not use the file system from several
+ threads at once. After calling set_thread_safe(True), every mutating function locks only the
+ objects it changes (and read-locks their ancestors), so operations in different subtrees run in
+ parallel. Lookups, '.size' and '.path' never take locks.
+
+Handles:
+ Objects are given either by their full path or by a handle, i.e. the object itself as returned by
+ create, move, write_to_file or a query. A handle stays valid when its object (or one of its
+ ancestors) is moved or renamed, and using it skips parsing and looking up the path.
 """
-from .filesystem import FileSystem, File, Drive, Zip, Folder
+import contextlib
+import sys
+import weakref
+from .compression import decompressed_cache
+from .content_store import content_store
+from .spill import spill_store
+from .filesystem import Container, FileSystem as RootNode, File, Drive, Zip, Folder, set_compressed
 from .exceptions import IllegalFileSystemOperation, InvalidWriteException, PathNotFoundException, PathAlreadyExistsException
-
-# Only provide a single instance of a file system to consumers of this module
-_file_system = FileSystem()
-
-
-def create(fs_type, name, parent_path=''):
+from .locking import LockedOperation, TreeLocks
+from .metrics import instrumented
+from .query_index import QueryIndexes
+from . import journal
+from . import persistence
+from .snapshot import preserve
+from . import snapshot as _snapshot
+from .stream import FileStream
+from .batch import Batch
+from . import traversal
+from . import transfer
+from .watch import Watch, Watchers, CREATED, DELETED, MOVED, MODIFIED
+from . import filesystem
+
+# Every live file system, so that process-wide settings can be applied to all of them
+_instances = weakref.WeakSet()
+# Journal field values marking written content as text or bytes
+_TEXT_FLAGS = {True: b'\x01', False: b'\x00'}
+
+
+class FileSystem:
     """
-    Create the object in the file system in the given parent path.
-
-    If you are creating a file, you must then use the write_to_file method to put content
-    in the file.
-
-    :param fs_type: The type of object being created. Allowed values: 'drive', 'folder', 'zip', 'file'
-    :param name: The name of the object to be created.
-    :param parent_path: The path of the parent object that will contain this object.
-    :returns: The created object (i.e. Drive, Folder, etc.)
-    :raises PathNotFoundException: The parent path does not exist in the file system
-    :raises PathAlreadyExistsException: The path attempting to be created already exists.
-    :raises IllegalFileSystemOperationException: The attempted action is not valid
+    An independent in-memory file system.
+
+    The module-level functions operate on a single default instance. Further instances share
+    nothing with it or with each other, except for the process-wide settings (deduplication and
+    the memory budget), and can each be made thread-safe or journaled on their own. Handles are
+    only valid with the file system they were created in.
     """
-    # Make sure the requested object doesn't already exist
-    new_path = _object_path(parent_path, name)
-    if _get_object(new_path, _file_system):
-        raise PathAlreadyExistsException("The requested path to create already exists")
-
-    # Enforce file system rules about root-level objects
-    if fs_type == 'drive':
-        if parent_path != '':
-            raise IllegalFileSystemOperation('Drives may only be created at the root of the file system')
-        parent = _file_system
-    else:
+    def __init__(self):
+        self.root = RootNode()
+        # Per-object reader/writer locks, only set while thread-safe mode is enabled
+        self._tree_locks = None
+        # The write-ahead journal operations are recorded to, only set while journaling is enabled
+        self._journal = None
+        # The watches registered with watch, only set once something has been watched
+        self._watchers = None
+        _instances.add(self)
+
+    @instrumented('create', (2, 'parent_path'), method=True)
+    def create(self, fs_type, name, parent_path=''):
+        """
+        Create the object in the file system in the given parent path.
+
+        If you are creating a file, you must then use the write_to_file method to put content
+        in the file.
+
+        :param fs_type: The type of object being created. Allowed values: 'drive', 'folder', 'zip', 'file'
+        :param name: The name of the object to be created.
+        :param parent_path: The path of (or handle to) the parent object that will contain this object.
+        :returns: The created object (i.e. Drive, Folder, etc.)
+        :raises PathNotFoundException: The parent path does not exist in the file system
+        :raises PathAlreadyExistsException: The path attempting to be created already exists.
+        :raises IllegalFileSystemOperationException: The attempted action is not valid
+        """
+        with self._locked(lambda: [self._resolve(parent_path)[0] if parent_path != '' else self.root]):
+            new_object = self._create(fs_type, name, parent_path)
+            self._record(journal.CREATE, fs_type, name, new_object.parent.path)
+        self._maybe_compact()
+        self._notify()
+        return new_object
+
+    @instrumented('delete', (0, 'path'), method=True)
+    def delete(self, path):
+        """
+        Delete the given object in the file system.
+
+        This method is recursive for objects. If you delete a folder, it and all its children
+        will be deleted.
+
+        :param path: The path of (or handle to) the object to delete
+        :return: None
+        :raises PathNotFoundException: The path attempting to be deleted does not exist
+        """
+        with self._locked(lambda: _with_parent(self._resolve(path)[0])):
+            deleted_path = self._delete(path)
+            self._record(journal.DELETE, deleted_path)
+        self._maybe_compact()
+        self._notify()
+
+    @instrumented('move', (0, 'src'), method=True)
+    def move(self, src, dest):
+        """
+        Move the given source object to the given destination path
+
+        This functions in a similar manner to os.remove in Python: The 'dest' path is the full
+        path to the new location for the filename, not the path to the new parent
+
+        :param src: The source path of (or handle to) the object to move
+        :param dest: The destination path to which the object should be moved
+        :return: The moved object (i.e. Drive, Folder, etc.)
+        :raises PathNotFoundException: The given source path does not exist, or the destination parent does not exist
+        :raises PathAlreadyExistsException: The given destination path already exists.
+        :raises IllegalFileSystemOperation: The attempted move action is not valid
+        """
+        with self._locked(lambda: _with_parent(self._resolve(src)[0]) + [self._get_parent(dest)]):
+            src_object, src_path = self._move(src, dest)
+            self._record(journal.MOVE, src_path, dest)
+        self._maybe_compact()
+        self._notify()
+        return src_object
+
+    @instrumented('write_to_file', (0, 'path'), method=True)
+    def write_to_file(self, path, content):
+        """
+        Write new content to the given file.
+
+        The given file must already exist prior to writing content to the file.
+
+        This action only supports overwriting the existing contents. It does not support
+        appending content to the file.
+
+        Text content is encoded as UTF-8 when it is written. Bytes are stored as-is, and any other
+        bytes-like object (bytearray, memoryview, mmap, array, ...) is copied once into the file.
+
+        :param path: The path of (or handle to) the file to write.
+        :param content: The content to write to the file, as a str or a bytes-like object.
+        :return: The File object just written to.
+        :raises PathNotFoundException: The given file path does not exist
+        :raises InvalidWriteException: The given object is not a file, or the content is not text or bytes.
+        """
+        return self._write(path, content)
+
+    @instrumented('write_from', (0, 'path'), method=True)
+    def write_from(self, path, buffer):
+        """
+        Write the content of a buffer to the given file, replacing its existing content.
+
+        The buffer may be any object supporting the buffer protocol, e.g. bytes, bytearray,
+        memoryview, mmap or array objects. Its raw bytes (in C order, whatever its item format and
+        shape) are copied exactly once, into the file; bytes objects are stored without copying.
+
+        :param path: The path of (or handle to) the file to write.
+        :param buffer: The bytes-like object holding the content to write.
+        :return: The File object just written to.
+        :raises PathNotFoundException: The given file path does not exist
+        :raises InvalidWriteException: The given object is not a file, or the buffer is not a bytes-like object.
+        """
+        if isinstance(buffer, str):
+            raise InvalidWriteException('Only bytes-like objects can be written with write_from, use write_to_file for text')
+        return self._write(path, buffer)
+
+    @instrumented('read_buffer', (0, 'path'), method=True)
+    def read_buffer(self, path):
+        """
+        Return a read-only memoryview over the bytes stored in the given file.
+
+        The view refers to the stored content itself, so it can be handed to sockets, hashes or
+        other buffer consumers without copying. Writing to the file afterwards replaces its content
+        rather than changing it in place, so an existing view always keeps the content it was taken
+        from. Content stored beneath a Zip is decompressed (and thus copied) first.
+
+        :param path: The path of (or handle to) the file to read.
+        :return: A read-only memoryview of the file's content, or None if nothing was ever written to it.
+        :raises PathNotFoundException: The given file path does not exist
+        :raises InvalidWriteException: The given object is not a file.
+        """
+        read_object = self._resolve(path)[0]
+        if not read_object:
+            raise PathNotFoundException('The file you are attempting to read does not exist, please create it first')
+        if read_object.type != 'file':
+            raise InvalidWriteException('The object you are attempting to read is not a file object.')
+        with self._locked(lambda: [read_object], write=False):
+            return read_object.buffer
+
+    @instrumented('open', (0, 'path'), method=True)
+    def open(self, path, mode='r'):
+        """
+        Open the given file and return a file-like stream over its content.
+
+        The file must already exist. Streams support chunked reads, writes at the current position,
+        appends, seeking and iteration over the stored content chunks. Appending content never copies
+        the data already in the file.
+
+        :param path: The path of (or handle to) the file to open.
+        :param mode: One of 'r', 'w', 'a', 'r+', 'w+' or 'a+', optionally with 'b' for a binary stream.
+            Opening with 'w' truncates the file.
+        :return: A FileStream over the file's content.
+        :raises PathNotFoundException: The given file path does not exist
+        :raises InvalidWriteException: The given object is not a file.
+        :raises IllegalFileSystemOperation: The given mode is not valid
+        """
+        open_object = self._resolve(path)[0]
+        if not open_object:
+            raise PathNotFoundException('The file you are attempting to open does not exist, please create it first')
+        if open_object.type != 'file':
+            raise InvalidWriteException('The object you are attempting to open is not a file object.')
+        return FileStream(open_object, mode, self._locked_file, self._record_stream_change)
+
+    @instrumented('is_ancestor', (1, 'descendant'), method=True)
+    def is_ancestor(self, ancestor, descendant):
+        """
+        Check whether an object lies beneath another one in the file system hierarchy.
+
+        Full paths label every object with its position in the hierarchy, so this compares the two
+        objects' (cached) paths rather than walking the parent chain.
+
+        :param ancestor: The path of (or handle to) the possible ancestor
+        :param descendant: The path of (or handle to) the possible descendant
+        :return: True if 'descendant' is a child, grandchild, etc. of 'ancestor'
+        :raises PathNotFoundException: One of the objects does not exist
+        """
+        ancestor_object, ancestor_path = self._resolve(ancestor)
+        descendant_object, descendant_path = self._resolve(descendant)
+        if not ancestor_object or not descendant_object:
+            raise PathNotFoundException('The requested object does not exist')
+        return _is_ancestor_path(ancestor_path, descendant_path)
+
+    @instrumented('snapshot', method=True)
+    def snapshot(self):
+        """
+        Take a read-only, point-in-time snapshot of the whole file system.
+
+        Taking a snapshot is O(1). Objects are shared between the snapshot and the live file system
+        until they change: the first change to an object after the snapshot preserves a copy of its
+        previous state, so a write only copies the objects it touches (and, through their sizes, their
+        ancestors). Snapshots are released once no longer referenced, or explicitly with 'release'.
+
+        :return: A Snapshot of the file system
+        """
+        with self._locked(lambda: [self.root]):
+            return _snapshot.take(self.root)
+
+    @instrumented('save', method=True)
+    def save(self, path):
+        """
+        Save the whole file system to the given path on disk, in a compact binary format.
+
+        :param path: The path of the file to write. An existing file is replaced atomically.
+        :return: None
+        """
+        # Writers only read-lock the root, so it is write-locked to save a consistent file system
+        with self._locked(lambda: [self.root]):
+            persistence.save(self.root, path)
+
+    @instrumented('load', method=True)
+    def load(self, path):
+        """
+        Replace the whole file system with the one previously saved to the given path.
+
+        Loading only reads the table of objects: the file is memory-mapped, and the content of each
+        file is only copied into memory the first time it is read. The saved file must therefore not
+        be modified while the loaded file system is in use (saving over it is fine, since save
+        replaces the file rather than writing into it).
+
+        :param path: The path of a file written by save
+        :return: None
+        :raises IllegalFileSystemOperation: The given file is not a saved file system
+        """
+        with self._locked(lambda: [self.root]):
+            persistence.load(self.root, path)
+            # The journal can't describe a load, so the loaded file system becomes the new checkpoint
+            if self._journal is not None:
+                self._journal.compact(self._save_checkpoint)
+
+    def set_thread_safe(self, enabled=True):
+        """
+        Enable or disable thread-safe mode.
+
+        In thread-safe mode each operation write-locks only the containers (or file) it changes and
+        read-locks their ancestors, so that operations on disjoint subtrees proceed concurrently.
+        Moving or deleting an object excludes every concurrent operation beneath it. Streams lock
+        their file for each read or write.
+
+        This should be called before the file system is shared between threads.
+
+        :param enabled: Whether thread-safe mode should be enabled
+        :return: None
+        """
+        if enabled != (self._tree_locks is not None):
+            filesystem.set_thread_safe(enabled)
+        self._tree_locks = TreeLocks() if enabled else None
+
+    def set_query_indexes(self, enabled=True):
+        """
+        Enable or disable the secondary indexes of objects by type and by name used by memfs.query.
+
+        While enabled, the indexes are kept up to date as objects are created, deleted and moved, so
+        that queries take time proportional to the number of objects they return rather than scanning
+        the whole file system. Enabling them indexes every existing object once.
+
+        :param enabled: Whether the indexes should be maintained
+        :return: None
+        """
+        with self._locked(lambda: [self.root]):
+            if not enabled:
+                self.root.query_indexes = None
+            elif self.root.query_indexes is None:
+                query_indexes = QueryIndexes()
+                query_indexes.rebuild(self.root.index)
+                self.root.query_indexes = query_indexes
+
+    def enable_journal(self, directory, sync_interval=0.05, compact_every=100000, synchronous=False):
+        """
+        Make the file system durable by recording every operation to a write-ahead journal.
+
+        If the directory already holds a journaled file system, it is recovered first: its latest
+        checkpoint is loaded and the operations journaled since are replayed, replacing the current
+        file system. Otherwise the current file system is saved as the first checkpoint.
+
+        Operations are written to the journal as they are applied, and a background thread fsyncs
+        the journal every 'sync_interval' seconds, so one fsync covers many operations (group commit).
+        Once 'compact_every' operations have been journaled, the file system is saved as a new
+        checkpoint and the journal is started afresh, which keeps recovery time bounded.
+
+        :param directory: The directory holding the checkpoint and journal. It is created if needed.
+        :param sync_interval: Seconds between fsyncs of the journal.
+        :param compact_every: Number of journaled operations after which a new checkpoint is saved.
+        :param synchronous: Whether each operation waits until its journal record is durable, rather
+            than risking the loss of the last 'sync_interval' seconds of operations in a crash.
+        :return: None
+        :raises IllegalFileSystemOperation: A journal is already enabled
+        """
+        if self._journal is not None:
+            raise IllegalFileSystemOperation('A journal is already enabled, disable it first')
+        new_journal = journal.Journal(directory, sync_interval, compact_every, synchronous)
+        with self._locked(lambda: [self.root]):
+            if new_journal.has_checkpoint():
+                persistence.load(self.root, new_journal.checkpoint_path)
+                for operation, fields in new_journal.records():
+                    self._replay(operation, fields)
+                # Recovering the file system replaces it as a whole, like load, so it isn't reported to watchers
+                if self._watchers is not None:
+                    self._watchers.discard()
+            else:
+                new_journal.compact(self._save_checkpoint)
+            new_journal.start()
+            self._journal = new_journal
+
+    def disable_journal(self):
+        """
+        Stop journaling operations, after making every journaled operation durable.
+
+        :return: None
+        """
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    @instrumented('import_tree', (1, 'dest_path'), method=True)
+    def import_tree(self, source, dest_path, text=False, zips=True, workers=None):
+        """
+        Import the content of a directory, tar archive or zip archive on disk beneath the given container.
+
+        The source is scanned with os.scandir, or streamed with tarfile or zipfile, into a detached
+        tree in which every object is attached to its parent directly, without looking any path up.
+        File content is read and decompressed in parallel on a thread pool meanwhile (tar archives
+        are read sequentially as they are streamed). The tree is only linked into the file system
+        once everything has been read, so a failed import leaves the file system untouched.
+
+        Directories become folders and files become files. When 'zips' is set, real zip archives
+        found in the source (with a '.zip' name) become Zip objects holding their entries.
+
+        Imports are not journaled operation by operation: with a journal enabled, the file system is
+        saved as a new checkpoint once the import is done, as with load.
+
+        :param source: The path of the directory or archive on disk
+        :param dest_path: The path of (or handle to) the drive, folder or zip to import into
+        :param text: Whether imported files hold text (UTF-8), returned by their content as a str,
+            rather than bytes
+        :param zips: Whether zip archives found in the source become Zip objects
+        :param workers: The number of threads reading file content (chosen by the thread pool by default)
+        :return: The list of imported top-level objects
+        :raises PathNotFoundException: The destination does not exist
+        :raises PathAlreadyExistsException: A top-level object of the source already exists in the destination
+        :raises IllegalFileSystemOperation: The destination is a file or the root, or the source is
+            neither a directory nor an archive
+        """
+        dest = self._get_create_parent('folder', dest_path)
+        # Clashes are checked again once the destination is locked, but most are found before any content is read
+        holder = transfer.build(source, dest._compressed, text, zips, workers,
+                                lambda name: dest.get(name) is not None)
+        imported = []
+        try:
+            with self._locked(lambda: [self._resolve(dest_path)[0]]):
+                dest = self._get_create_parent('folder', dest_path)
+                dest_path = dest.path
+                for name in holder.children:
+                    if dest.get(name) is not None:
+                        raise PathAlreadyExistsException('{} already exists in the destination'.format(name))
+                for child in list(holder.children.values()):
+                    holder._remove_child(child)
+                    child.parent = None
+                    child_path = _object_path(dest_path, child.name)
+                    self._link(child, dest, child_path)
+                    self._emit(CREATED, child_path)
+                    imported.append(child)
+                if self._journal is not None:
+                    self._journal.compact(self._save_checkpoint)
+        finally:
+            # Whatever is still detached is thrown away, so release its content
+            transfer.discard(holder)
+        self._notify()
+        return imported
+
+    @instrumented('export_tree', (0, 'path'), method=True)
+    def export_tree(self, path, target, workers=None):
+        """
+        Export the given object, and everything beneath it, to a directory or archive on disk.
+
+        The target is written as a zip archive if its name ends with '.zip', as a (compressed) tar
+        archive if it ends with '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz' or '.txz',
+        and as a directory otherwise, in which case files are written in parallel on a thread pool.
+        The objects beneath the exported one become directories (drives and folders) and files, while
+        each Zip becomes a real zip archive, named after it, holding its subtree. Exporting a file
+        writes it to the target itself, or as the only member of an archive.
+
+        File content is written straight from the stored bytes (see read_buffer). The exported
+        subtree is locked while it is written in thread-safe mode.
+
+        :param path: The path of (or handle to) the object to export, or '' for the whole file system
+        :param target: The path of the directory or archive to write on disk
+        :param workers: The number of threads writing files (chosen by the thread pool by default)
+        :return: None
+        :raises PathNotFoundException: The given path does not exist
+        :raises IllegalFileSystemOperation: The name of an object beneath the exported one is '.' or
+            '..', holds a path separator or is an absolute path, so it can't be written
+        """
+        export_object = self._resolve(path)[0] if path != '' else self.root
+        if not export_object:
+            raise PathNotFoundException('The object you are attempting to export does not exist')
+        with self._locked(lambda: [export_object]):
+            transfer.export(export_object, target, workers)
+
+    def watch(self, path, callback=None, queue=None):
+        """
+        Watch the given object, and everything beneath it, for changes.
+
+        Creating, deleting, moving or writing to an object (including through a stream) produces an
+        Event(type, path, dest) for the watches of the object's path and of each of its ancestors,
+        where type is one of 'created', 'deleted', 'moved' or 'modified', and dest is the destination
+        of a move. Deleting or moving a container is also reported to the watches beneath it, while
+        nothing is reported for the objects deleted or moved along with it.
+
+        Events are coalesced and delivered in batches: each operation, or each committed batch of
+        operations, delivers a single list of events to every watch it concerns, in which repeated
+        writes to a file are reported once. The list is either passed to 'callback', on the thread
+        that made the changes once they have been applied (or, for stream writes, while the file is
+        still locked), or put on 'queue'. Exceptions raised by the callback propagate to the caller
+        of the operation. Loading a file system or recovering it from a journal reports nothing.
+
+        :param path: The path of (or handle to) the object to watch, or '' for the whole file system.
+            A path that doesn't exist yet may be watched, e.g. to be told when it is created.
+        :param callback: Callable receiving each list of events
+        :param queue: Object with a 'put' method receiving each list of events instead, e.g. a queue.Queue
+        :return: A Watch, whose close method stops the delivery of events
+        :raises PathNotFoundException: The given handle's object has been deleted
+        :raises IllegalFileSystemOperation: Neither or both of a callback and a queue were given
+        """
+        if (callback is None) == (queue is None):
+            raise IllegalFileSystemOperation('A watch needs either a callback or a queue')
+        if not isinstance(path, str):
+            obj, path = self._resolve(path)
+            if not obj:
+                raise PathNotFoundException('The object you are attempting to watch does not exist')
+        with self._locked(lambda: [self.root]):
+            if self._watchers is None:
+                self._watchers = Watchers()
+            new_watch = Watch(self._watchers, path, callback, queue)
+            self._watchers.add(new_watch)
+        return new_watch
+
+    def batch(self):
+        """
+        Start a batch of file system operations that are committed all-or-nothing.
+
+        Use it as a context manager: the queued operations are committed when the block exits
+        normally, and discarded if the block raises.
+
+            with memfs.batch() as b:
+                b.create('folder', 'Folder1', 'Drive1')
+                b.create('file', 'File1', 'Drive1\\Folder1')
+                b.write_to_file('Drive1\\Folder1\\File1', 'The Silmarillion')
+
+        :return: A new Batch object
+        """
+        return Batch(self)
+
+    def walk(self, path='', topdown=True):
+        """Walk the hierarchy beneath the given path, in the manner of os.walk. See traversal.walk"""
+        return traversal.walk(self, path, topdown)
+
+    def glob(self, pattern):
+        """Find the objects whose full path matches the given pattern. See traversal.glob"""
+        return traversal.glob(self, pattern)
+
+    def find(self, path='', type=None, name=None, min_size=None, max_size=None):
+        """Find the objects beneath the given path that match all of the given criteria. See traversal.find"""
+        return traversal.find(self, path, type, name, min_size, max_size)
+
+    @instrumented('query', method=True)
+    def query(self, type=None, name=None):
+        """Find every object with the given type and/or name. See traversal.query"""
+        return traversal.query(self, type, name)
+
+    def _write(self, path, content):
+        """Writes to a file and journals the write, see write_to_file"""
+        with self._locked(lambda: [self._resolve(path)[0]]):
+            write_object, data, is_text = self._write_to_file(path, content)
+            if self._journal is not None:
+                self._record(journal.WRITE, write_object.path, _TEXT_FLAGS[is_text], data or b'')
+        self._maybe_compact()
+        self._notify()
+        return write_object
+
+    def _create(self, fs_type, name, parent_path):
+        """Creates an object without journaling it, see create"""
+        parent = self._get_create_parent(fs_type, parent_path)
+
+        # Make sure the requested object doesn't already exist
+        new_path = _object_path(parent.path, name)
+        if self._get_object(new_path):
+            raise PathAlreadyExistsException("The requested path to create already exists")
+
+        # Create and link new file
+        new_object = _create_object(name, fs_type)
+        self._link(new_object, parent, new_path)
+        self._emit(CREATED, new_path)
+        return new_object
+
+    def _delete(self, path):
+        """Deletes an object without journaling it, returning the path it was at. See delete"""
+        to_delete, path = self._resolve(path)
+        if not to_delete:
+            raise PathNotFoundException('The requested object does not exist')
+        self._unlink(to_delete, path)
+        # Release the deleted files' references to deduplicated content, and stop tracking their use
+        if len(content_store) or spill_store.enabled:
+            for _, sub_object in _iter_subtree(path, to_delete):
+                if sub_object.type == 'file':
+                    sub_object._release_content()
+                    spill_store.discard(sub_object)
+        self._emit(DELETED, path)
+        return path
+
+    def _move(self, src, dest):
+        """Moves an object without journaling it, returning it along with its source path. See move"""
+        # Source object must exist
+        src_object, src = self._resolve(src)
+        if not src_object:
+            raise PathNotFoundException("The given source path does not exist")
+
+        # Cannot move to a path where an object already exists
+        if self._get_object(dest):
+            raise PathAlreadyExistsException("The given destination path already exists")
+
+        # Parent object must exist
+        dest_parent = self._get_parent(dest)
+        if not dest_parent:
+            raise PathNotFoundException("The given destination parent path does not exist")
+
+        # Drives are only allowed at the root level, and nothing else is allowed at root
+        if src_object.type == 'drive':
+            raise IllegalFileSystemOperation('Drives may not be moved')
+        if dest_parent is self.root:
+            raise IllegalFileSystemOperation('You cannot move files, folders, or zips to the root of a file system')
+        if dest_parent.type == 'file':
+            raise IllegalFileSystemOperation('File objects cannot contain other items')
+        # An object can't be moved beneath itself, which would detach it from the tree in a cycle
+        if _is_ancestor_path(src, dest):
+            raise IllegalFileSystemOperation('Objects cannot be moved inside themselves')
+
+        # Unlink object from file system, then link it at the destination under its new name
+        self._unlink(src_object, src)
+        src_object.name = sys.intern(_object_name(dest))
+        self._link(src_object, dest_parent, dest)
+        self._emit(MOVED, src, dest)
+        return src_object, src
+
+    def _write_to_file(self, path, content):
+        """
+        Writes to a file without journaling it, returning it along with the bytes written and
+        whether they were text. See write_to_file
+        """
+        write_object = self._resolve(path)[0]
+
+        # The object must exist and be a file
+        if not write_object:
+            raise PathNotFoundException('The object you are attempting to write does not exist, please create it first')
+        if write_object.type != 'file':
+            raise InvalidWriteException('The object you are attempting to write is not a file object.')
+
+        # Content is only encoded (or copied out of its buffer) once, for both the file and the journal
+        data, is_text = write_object._encode(content) if content is not None else (None, False)
+        write_object._replace(data, is_text)
+        if self._watchers is not None:
+            self._watchers.emit(MODIFIED, write_object.path)
+        return write_object, data, is_text
+
+    def _emit(self, kind, path, dest=None):
+        """Reports a change to watchers once the current operation completes, if anything is watched"""
+        if self._watchers is not None:
+            self._watchers.emit(kind, path, dest)
+
+    def _notify(self):
+        """Delivers the changes made by the operation just applied to the watches they concern"""
+        if self._watchers is not None:
+            self._watchers.deliver()
+
+    def _record(self, operation, *fields):
+        """Records an operation that was just applied, if journaling is enabled"""
+        if self._journal is not None:
+            self._journal.append(operation, *fields)
+
+    def _record_stream_change(self, file, position, data):
+        """
+        Records a stream write of the given data at the given position, or a truncation of the file
+        if 'data' is None, and reports it to watchers. Writes to files that have since been deleted
+        are neither recorded nor reported.
+        """
+        if self._journal is None and self._watchers is None:
+            return
+        try:
+            path = file.path
+        except IllegalFileSystemOperation:
+            return
+        if self._journal is not None:
+            if data is None:
+                self._journal.append(journal.TRUNCATE, path, _TEXT_FLAGS[file._is_text])
+            else:
+                self._journal.append(journal.WRITE_AT, path, journal.encode_position(position), data)
+        if self._watchers is not None:
+            self._watchers.emit(MODIFIED, path)
+            self._watchers.deliver()
+
+    def _maybe_compact(self):
+        """Saves a new checkpoint once enough operations have been journaled since the last one"""
+        if self._journal is None or not self._journal.compaction_due():
+            return
+        # Operations applied within a batch are compacted once the whole batch has been committed
+        if self._tree_locks is not None and self._tree_locks.held():
+            return
+        with self._locked(lambda: [self.root]):
+            if self._journal is not None and self._journal.compaction_due():
+                self._journal.compact(self._save_checkpoint)
+
+    def _save_checkpoint(self, path):
+        persistence.save(self.root, path)
+
+    def _replay(self, operation, fields):
+        """Applies an operation read back from the journal"""
+        if operation == journal.CREATE:
+            self._create(*(field.decode('utf-8') for field in fields))
+        elif operation == journal.DELETE:
+            self._delete(fields[0].decode('utf-8'))
+        elif operation == journal.MOVE:
+            self._move(fields[0].decode('utf-8'), fields[1].decode('utf-8'))
+        else:
+            file = self._get_object(fields[0].decode('utf-8'))
+            if operation == journal.WRITE:
+                file._replace(fields[2], fields[1] == _TEXT_FLAGS[True])
+            elif operation == journal.WRITE_AT:
+                file._write_at(journal.decode_position(fields[1]), fields[2])
+            elif operation == journal.TRUNCATE:
+                file._replace(b'', fields[1] == _TEXT_FLAGS[True])
+
+    def _locked(self, resolve, write=True):
+        """
+        Returns a context manager holding the locks for an operation on the objects returned by
+        'resolve'. This does nothing unless thread-safe mode is enabled.
+        """
+        if self._tree_locks is None or self._tree_locks.held():
+            return contextlib.nullcontext()
+        return LockedOperation(self._tree_locks, resolve, write)
+
+    def _locked_file(self, file, write):
+        """Returns a context manager locking the given file for a stream read or write"""
+        return self._locked(lambda: [file], write)
+
+    def _get_create_parent(self, fs_type, parent_path):
+        """
+        Resolves the parent an object of the given type would be created in, enforcing the
+        file system rules about which objects may be created where
+        """
+        # Enforce file system rules about root-level objects
+        if fs_type == 'drive':
+            if parent_path != '':
+                raise IllegalFileSystemOperation('Drives may only be created at the root of the file system')
+            return self.root
         if parent_path == '':
             raise IllegalFileSystemOperation('Only drives may be created at the root of the filesystem')
-        parent = _get_object(parent_path, _file_system)
-
-    # The given parent path must exist in the file system
-    if not parent:
-        raise PathNotFoundException('The requested parent path does not exist')
-
-    # Create and link new file
-    new_object = _create_object(name, fs_type)
-    new_object.parent = parent
-    parent.children[new_object.name] = new_object
-    return new_object
-
-
-def delete(path):
+        parent = self._resolve(parent_path)[0]
+
+        # The given parent path must exist in the file system
+        if not parent:
+            raise PathNotFoundException('The requested parent path does not exist')
+        if parent.type == 'file':
+            raise IllegalFileSystemOperation('File objects cannot contain other items')
+        return parent
+
+    def _get_parent(self, path):
+        path_parts = path.rsplit('\\', 1)
+        if len(path_parts) == 1:
+            return self.root
+        return self._get_object(path_parts[0])
+
+    def _resolve(self, target):
+        """
+        Returns the object for the given path or handle, along with its current full path. Both are
+        None if there is no object at the given path, or if the handle's object has been deleted.
+        """
+        if isinstance(target, str):
+            return self._get_object(target), target
+        if not isinstance(target, (Container, File)):
+            raise IllegalFileSystemOperation('Objects must be given by path or by handle')
+        try:
+            path = target.path
+        except IllegalFileSystemOperation:
+            return None, None
+        if self.root.index.get(path) is not target:
+            raise IllegalFileSystemOperation('The given object belongs to another file system')
+        return target, path
+
+    def _get_object(self, path):
+        """
+        Looks up the object at the given full path in the file system's flat path index
+        """
+        return self.root.index.get(path)
+
+    def _link(self, obj, parent, path):
+        """
+        Attaches the given detached object, along with its whole subtree, beneath the given parent
+        at the given path, indexing the subtree and updating the ancestors' sizes
+        """
+        # Compress or decompress content moved in or out of a zip while it is still detached
+        set_compressed(obj, parent._compressed)
+        preserve(parent)
+        preserve(obj)
+        obj.parent = parent
+        parent._add_child(obj)
+        index = self.root.index
+        query_indexes = self.root.query_indexes
+        for sub_path, sub_object in _iter_subtree(path, obj):
+            index[sub_path] = sub_object
+            if query_indexes is not None:
+                query_indexes.add(sub_path, sub_object)
+        parent._update_size(obj.size, obj.stored_size)
+
+    def _unlink(self, obj, path):
+        """
+        Detaches the given object and its whole subtree from the file system hierarchy, removing
+        the subtree from the path index and invalidating its cached paths
+        """
+        filesystem.begin_path_change()
+        index = self.root.index
+        query_indexes = self.root.query_indexes
+        for sub_path, sub_object in _iter_subtree(path, obj):
+            del index[sub_path]
+            if query_indexes is not None:
+                query_indexes.remove(sub_path, sub_object)
+            sub_object._path = None
+            decompressed_cache.discard(sub_object)
+        parent = obj.parent
+        preserve(parent)
+        preserve(obj)
+        parent._remove_child(obj)
+        parent._update_size(-obj.size, -obj.stored_size)
+        obj.parent = None
+        filesystem.end_path_change()
+
+
+# The default file system, which the module-level functions below operate on
+_default = FileSystem()
+_file_system = _default.root
+
+create = _default.create
+delete = _default.delete
+move = _default.move
+write_to_file = _default.write_to_file
+write_from = _default.write_from
+read_buffer = _default.read_buffer
+open = _default.open
+is_ancestor = _default.is_ancestor
+snapshot = _default.snapshot
+save = _default.save
+load = _default.load
+set_thread_safe = _default.set_thread_safe
+set_query_indexes = _default.set_query_indexes
+enable_journal = _default.enable_journal
+disable_journal = _default.disable_journal
+batch = _default.batch
+watch = _default.watch
+import_tree = _default.import_tree
+export_tree = _default.export_tree
+walk = _default.walk
+glob = _default.glob
+find = _default.find
+query = _default.query
+_get_object = _default._get_object
+
+
+def set_deduplicated(enabled=True):
     """
-    Delete the given object in the file system.
+    Enable or disable deduplication of file content.
 
-    This method is recursive for objects. If you delete a folder, it and all its children
-    will be deleted.
+    While enabled, content written with write_to_file (or otherwise replacing a file's whole
+    content) is hashed, and files with identical content share a single reference-counted copy of
+    it. A file releases its reference when it is overwritten, appended to or deleted, and the copy
+    is freed once no file references it. Sizes are unaffected: every file still reports the size
+    of its own content.
 
-    :param path: The path of the object to delete
+    Disabling deduplication only stops new content from being shared. Identical content is shared
+    between every FileSystem instance in the process.
+
+    :param enabled: Whether content should be deduplicated
     :return: None
-    :raises PathNotFoundException: The path attempting to be deleted does not exist
     """
-    to_delete = _get_object(path, _file_system)
-    if not to_delete:
-        raise PathNotFoundException('The requested object does not exist')
-    parent = _file_system if to_delete.type == 'drive' else to_delete.parent
-    to_delete.parent = None
-    del parent.children[to_delete.name]
+    content_store.enabled = enabled
 
 
-def move(src, dest):
+def set_memory_budget(budget, directory=None):
     """
-    Move the given source object to the given destination path
+    Bound the memory used by file content, spilling the content of cold files to disk.
 
-    This functions in a similar manner to os.remove in Python: The 'dest' path is the full
-    path to the new location for the filename, not the path to the new parent
+    Once the content of the files in memory exceeds the budget, the content of the least recently
+    used files is written to memory-mapped files on local disk, and read back in transparently the
+    next time it is used. Object metadata, sizes and paths always stay in memory, and never read
+    spilled content. The most recently used file always stays in memory, even if it exceeds the
+    budget on its own.
 
-    :param src: The source path of the object to move
-    :param dest: The destination path to which the object should be moved
-    :return: The moved object (i.e. Drive, Folder, etc.)
-    :raises PathNotFoundException: The given source path does not exist, or the destination parent does not exist
-    :raises PathAlreadyExistsException: The given destination path already exists.
-    :raises IllegalFileSystemOperation: The attempted move action is not valid
-    """
-    # Source object must exist
-    src_object = _get_object(src, _file_system)
-    if not src_object:
-        raise PathNotFoundException("The given source path does not exist")
-
-    # Cannot move to a path where an object already exists
-    if _get_object(dest, _file_system):
-        raise PathAlreadyExistsException("The given destination path already exists")
-
-    # Parent object must exist
-    dest_parent = _get_parent(dest)
-    if not dest_parent:
-        raise PathNotFoundException("The given destination parent path does not exist")
-
-    # Drives are only allowed at the root level, and nothing else is allowed at root
-    if src_object.type == 'drive':
-        raise IllegalFileSystemOperation('Drives may not be moved')
-    if dest_parent.path == '':
-        raise IllegalFileSystemOperation('You cannot move files, folders, or zips to the root of a file system')
-
-    # Unlink object from file system
-    del src_object.parent.children[src_object.name]
-    src_object.parent = dest_parent
-    dest_parent.children[src_object.name] = src_object
-    return src_object
-
-
-def write_to_file(path, content):
-    """
-    Write new content to the given file.
-
-    The given file must already exist prior to writing content to the file.
+    Passing None disables the budget. Content that has already been spilled stays on disk until it
+    is next used or written.
 
-    This action only supports overwriting the existing contents. It does not support
-    appending content to the file.
+    The budget is shared by every FileSystem instance in the process.
 
-    :param path: The path of the file to write.
-    :param content: The content to write to the file.
-    :return: The File object just written to.
-    :raises PathNotFoundException: The given file path does not exist
-    :raises InvalidWriteException: The given object is not a file.
+    :param budget: The maximum number of stored content bytes to keep in memory, or None
+    :param directory: The directory spilled content is written to (the system's temporary
+        directory by default)
+    :return: None
     """
-    write_object = _get_object(path, _file_system)
+    was_enabled = spill_store.enabled
+    spill_store.configure(budget, directory)
+    # Start tracking the content already in memory, in every file system
+    if spill_store.enabled and not was_enabled:
+        for instance in list(_instances):
+            with instance._locked(lambda: [instance.root]):
+                for obj in list(instance.root.index.values()):
+                    if obj.type == 'file' and obj._chunks:
+                        spill_store.touch(obj)
 
-    # The object must exist and be a file
-    if not write_object:
-        raise PathNotFoundException('The object you are attempting to write does not exist, please create it first')
-    if write_object.type != 'file':
-        raise InvalidWriteException('The object you are attempting to write is not a file object.')
 
-    write_object.content = content
+def _with_parent(obj):
+    return [obj, obj.parent if obj else None]
 
 
 def _object_path(parent_path, name):
@@ -146,21 +873,29 @@ def _object_path(parent_path, name):
     return name if parent_path == '' else '{}\\{}'.format(parent_path, name)
 
 
-def _get_parent(path):
-    path_parts = path.rsplit('\\', 1)
-    if len(path_parts) == 1:
-        return _file_system
-    return _get_object(path_parts[0], _file_system)
+def _is_ancestor_path(ancestor_path, path):
+    """Whether the given path lies strictly beneath the given ancestor path"""
+    return len(path) > len(ancestor_path) and path[len(ancestor_path)] == '\\' and path.startswith(ancestor_path)
+
+
+def _object_name(path):
+    """
+    Given the full path to an object, returns its name (the last component of the path)
+    """
+    return path.rsplit('\\', 1)[-1]
 
 
-def _get_object(path, parent):
-    path_parts = path.split('\\', 1)
-    child = parent.get(path_parts[0])
-    if not child:  # The requested object does not exist
-        return None
-    if len(path_parts) == 1:  # Reached the child object we want
-        return child
-    return _get_object(path_parts[1], child)
+def _iter_subtree(path, root):
+    """
+    Yields (path, object) pairs for the given object and all of its descendants
+    """
+    stack = [(path, root)]
+    while stack:
+        obj_path, obj = stack.pop()
+        yield obj_path, obj
+        if obj.type != 'file':
+            for name, child in obj.children.items():
+                stack.append(('{}\\{}'.format(obj_path, name), child))
 
 
 def _create_object(name, fs_type):
@@ -175,3 +910,4 @@ def _create_object(name, fs_type):
     else:
         raise IllegalFileSystemOperation(
             'You may only create objects of the following types: File, Drive, Folder, Zip')
+
@@ -0,0 +1,232 @@
+"""
+This file contains the append-only operation journal used to make the file system durable
+
+A journal directory holds at most one checkpoint (a file system saved with memfs.save) and one
+journal of the operations applied since that checkpoint, both numbered by a generation:
+
+    checkpoint.<generation>.memfs
+    journal.<generation>.log
+
+Journal records are framed as: payload length (u32), CRC-32 of the payload (u32), payload. The
+payload is an operation code (u8) followed by length-prefixed (u32) fields. A torn or corrupt
+record at the end of the journal (e.g. after a crash) marks the end of the recoverable journal.
+
+Compaction saves a new checkpoint for the next generation before starting its empty journal and
+removing the previous generation, so a crash at any point leaves one complete generation behind.
+"""
+import os
+import re
+import struct
+import threading
+import zlib
+
+CREATE = 1
+DELETE = 2
+MOVE = 3
+WRITE = 4
+WRITE_AT = 5
+TRUNCATE = 6
+
+_FRAME = struct.Struct('<II')
+_FIELD = struct.Struct('<I')
+_POSITION = struct.Struct('<Q')
+_GENERATION_PATTERN = re.compile(r'^(checkpoint|journal)\.(\d+)\.(memfs|log)$')
+
+
+class Journal:
+    """
+    An append-only journal of file system operations with group commit.
+
+    Records are written to the journal file as soon as they are appended, but are only fsynced by
+    a background thread every 'sync_interval' seconds, so that a single fsync covers every record
+    appended in the meantime. In synchronous mode, appending a record waits for the fsync covering
+    it; otherwise at most the last 'sync_interval' seconds of operations can be lost in a crash.
+
+    :param directory: Directory holding the checkpoint and journal files. It is created if needed.
+    :param sync_interval: Seconds between group fsyncs of the journal.
+    :param compact_every: Number of records after which the journal should be compacted.
+    :param synchronous: Whether appending a record waits until it is durable.
+    """
+    def __init__(self, directory, sync_interval=0.05, compact_every=100000, synchronous=False):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.synchronous = synchronous
+        os.makedirs(directory, exist_ok=True)
+        self.generation = _latest_generation(directory)
+        self.record_count = 0
+        self._file = None
+        self._lock = threading.Lock()  # Guards appends to the journal file
+        self._sync_lock = threading.Lock()  # Serialises fsyncs with replacing or closing the file
+        self._synced = threading.Condition(self._lock)
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._stop = threading.Event()
+        self._flusher = None
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.directory, 'checkpoint.{}.memfs'.format(self.generation))
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.directory, 'journal.{}.log'.format(self.generation))
+
+    def has_checkpoint(self):
+        return os.path.exists(self.checkpoint_path)
+
+    def records(self):
+        """
+        Reads the operations recorded in the current journal, as (operation, fields) tuples, and
+        truncates any torn record left at its end
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, 'rb') as source:
+            data = source.read()
+        records = []
+        position = 0
+        while position + _FRAME.size <= len(data):
+            length, checksum = _FRAME.unpack_from(data, position)
+            payload = data[position + _FRAME.size:position + _FRAME.size + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            records.append(_decode(payload))
+            position += _FRAME.size + length
+        if position != len(data):
+            with open(self.journal_path, 'r+b') as source:
+                source.truncate(position)
+        self.record_count = len(records)
+        return records
+
+    def start(self):
+        """Opens the journal for appending and starts the background group commit thread"""
+        _remove_older_generations(self.directory, self.generation)
+        self._file = open(self.journal_path, 'ab')
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name='memfs-journal', daemon=True)
+        self._flusher.start()
+
+    def append(self, operation, *fields):
+        """Appends an operation to the journal, waiting for it to be durable in synchronous mode"""
+        payload = _encode(operation, fields)
+        with self._lock:
+            self._file.write(_FRAME.pack(len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self._written_seq += 1
+            self.record_count += 1
+            sequence = self._written_seq
+            if self.synchronous:
+                while self._synced_seq < sequence and not self._stop.is_set():
+                    self._synced.wait()
+
+    def compaction_due(self):
+        return self.record_count >= self.compact_every
+
+    def compact(self, save_checkpoint):
+        """
+        Starts a new generation from a checkpoint of the current state, discarding the journal.
+        The caller must make sure no operations are applied to the file system meanwhile.
+
+        :param save_checkpoint: Callable saving the file system to the path it is given
+        """
+        with self._sync_lock, self._lock:
+            previous = (self.checkpoint_path, self.journal_path)
+            save_checkpoint(os.path.join(self.directory, 'checkpoint.{}.memfs'.format(self.generation + 1)))
+            self.generation += 1
+            if self._file is not None:
+                self._file.close()
+                self._file = open(self.journal_path, 'ab')
+            else:
+                open(self.journal_path, 'ab').close()
+            self.record_count = 0
+            # Everything journaled so far is now durable as part of the checkpoint
+            self._synced_seq = self._written_seq
+            self._synced.notify_all()
+            for path in previous:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self):
+        """Makes every appended record durable and stops the group commit thread"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self._sync()
+        with self._sync_lock, self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._synced.notify_all()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.sync_interval):
+            self._sync()
+
+    def _sync(self):
+        """
+        Flushes the journal and fsyncs it. Appends can continue while the fsync is in progress,
+        and are covered by the next one.
+        """
+        with self._sync_lock:
+            with self._lock:
+                if self._file is None or self._synced_seq == self._written_seq:
+                    return
+                self._file.flush()
+                sequence = self._written_seq
+                descriptor = self._file.fileno()
+            os.fsync(descriptor)
+            with self._lock:
+                self._synced_seq = sequence
+                self._synced.notify_all()
+
+
+def encode_position(position):
+    return _POSITION.pack(position)
+
+
+def decode_position(field):
+    return _POSITION.unpack(field)[0]
+
+
+def _encode(operation, fields):
+    parts = [bytes((operation,))]
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode('utf-8')
+        parts.append(_FIELD.pack(len(field)))
+        parts.append(field)
+    return b''.join(parts)
+
+
+def _decode(payload):
+    operation = payload[0]
+    fields = []
+    position = 1
+    while position < len(payload):
+        length, = _FIELD.unpack_from(payload, position)
+        position += _FIELD.size
+        fields.append(payload[position:position + length])
+        position += length
+    return operation, fields
+
+
+def _latest_generation(directory):
+    """The newest generation with a complete checkpoint, or the newest journal if there are none"""
+    checkpoints, journals = [], []
+    for name in os.listdir(directory):
+        match = _GENERATION_PATTERN.match(name)
+        if match:
+            (checkpoints if match.group(1) == 'checkpoint' else journals).append(int(match.group(2)))
+    if checkpoints:
+        return max(checkpoints)
+    return max(journals) if journals else 0
+
+
+def _remove_older_generations(directory, generation):
+    """Removes checkpoints and journals left behind by a crash during compaction"""
+    for name in os.listdir(directory):
+        match = _GENERATION_PATTERN.match(name)
+        if match and int(match.group(2)) < generation:
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,147 @@
+"""
+This file contains the locks used by the file system's thread-safe mode
+"""
+import threading
+
+
+class ReadWriteLock:
+    """
+    A lock allowing many concurrent readers or a single writer.
+
+    Waiting writers take precedence over new readers so that a steady stream of readers
+    cannot starve them.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class TreeLocks:
+    """
+    Hierarchical reader/writer locking over the file system tree.
+
+    Each object gets its own ReadWriteLock, created on first use. An operation write-locks the
+    objects it changes (e.g. the parent containers whose children it modifies) and read-locks all
+    of their ancestors, so that operations in disjoint subtrees run concurrently while anything
+    that moves or deletes a subtree excludes every operation inside it.
+
+    Every lock an operation needs is acquired up front, always in id order, to avoid deadlocks
+    between operations. Unlike an object's depth, its id can't be changed by a concurrent move, so
+    the order holds even when the tree changes while the locks are being acquired. The plan is then
+    checked again once the locks are held, and retried if the tree changed in the meantime.
+
+    Nested operations on the same thread (e.g. a batch applying its operations) run under the
+    locks already held by the outermost operation.
+    """
+    def __init__(self):
+        self._creation_lock = threading.Lock()
+        self._local = threading.local()
+
+    def held(self):
+        """Whether the current thread is already inside a locked operation"""
+        return getattr(self._local, 'depth', 0) > 0
+
+    def acquire(self, resolve, write=True):
+        """
+        Acquire locks on the objects returned by 'resolve' and read locks on their ancestors.
+
+        :param resolve: Callable returning the list of objects the operation uses. Entries may
+            be None for objects that don't exist, in which case they must still not exist once the
+            locks are held.
+        :param write: Whether the objects themselves are write-locked (True) or read-locked (False)
+        :return: The held locks, to be passed to release
+        """
+        while True:
+            targets = resolve()
+            plan = self._plan(targets, write)
+            held = []
+            for _, node, node_write in plan:
+                lock = self._lock_for(node)
+                if node_write:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                held.append((lock, node_write))
+            # Nothing in the plan can change while its locks are held, so this check is final
+            if _same_objects(resolve(), targets) and self._plan(targets, write) == plan:
+                self._local.depth = getattr(self._local, 'depth', 0) + 1
+                return held
+            self._release_locks(held)
+
+    def release(self, held):
+        self._local.depth -= 1
+        self._release_locks(held)
+
+    def _plan(self, targets, write):
+        modes = {}
+        for target in targets:
+            if target is None:
+                continue
+            node = target
+            while node is not None:
+                modes[node] = (write and node is target) or modes.get(node, False)
+                node = node.parent
+        return sorted((id(node), node, mode) for node, mode in modes.items())
+
+    def _lock_for(self, node):
+        lock = node._lock
+        if lock is None:
+            with self._creation_lock:
+                if node._lock is None:
+                    node._lock = ReadWriteLock()
+                lock = node._lock
+        return lock
+
+    def _release_locks(self, held):
+        for lock, write in reversed(held):
+            if write:
+                lock.release_write()
+            else:
+                lock.release_read()
+
+
+class LockedOperation:
+    """Context manager holding the locks for a single operation, see TreeLocks.acquire"""
+    def __init__(self, tree_locks, resolve, write=True):
+        self.tree_locks = tree_locks
+        self.resolve = resolve
+        self.write = write
+        self.held = None
+
+    def __enter__(self):
+        self.held = self.tree_locks.acquire(self.resolve, self.write)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tree_locks.release(self.held)
+
+
+def _same_objects(first, second):
+    return len(first) == len(second) and all(a is b for a, b in zip(first, second))
@@ -0,0 +1,227 @@
+"""
+This file contains the opt-in instrumentation of the file system's public operations
+"""
+import functools
+import threading
+import time
+from .exceptions import IllegalFileSystemOperation
+
+# Upper bounds, in microseconds, of the latency histogram buckets (the last bucket is unbounded)
+LATENCY_BUCKETS = tuple(2 ** power for power in range(21))
+
+# The metrics being collected, only set while metrics are enabled
+_metrics = None
+# Hooks registered while metrics are disabled, as [pre hooks, post hooks]
+_pending_hooks = [[], []]
+
+
+class Metrics:
+    """
+    Collects per-operation call counts, failures by exception type, latency histograms and path
+    depth distributions, along with call counts per drive, and runs the registered hooks.
+
+    Pre hooks are called with (operation, args, kwargs) before an operation runs. Post hooks are
+    called with (operation, args, kwargs, seconds, error) after it returns or raises, where error is
+    the exception it raised or None.
+    """
+    def __init__(self, pre_hooks=(), post_hooks=()):
+        self.operations = {}
+        self.drives = {}
+        self.pre_hooks = list(pre_hooks)
+        self.post_hooks = list(post_hooks)
+        self._lock = threading.Lock()
+
+    def call(self, operation, func, args, kwargs, path_argument, method=False):
+        # Hooks are given the arguments the operation was called with, without the instance of a method
+        hook_args = args[1:] if method else args
+        path = _path_of(hook_args, kwargs, path_argument)
+        for hook in self.pre_hooks:
+            hook(operation, hook_args, kwargs)
+        error = None
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self._record(operation, seconds, error, path)
+            for hook in self.post_hooks:
+                hook(operation, hook_args, kwargs, seconds, error)
+
+    def _record(self, operation, seconds, error, path):
+        microseconds = seconds * 1e6
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and microseconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        with self._lock:
+            counters = self.operations.get(operation)
+            if counters is None:
+                counters = self.operations[operation] = _OperationCounters()
+            counters.calls += 1
+            counters.seconds += seconds
+            counters.latencies[bucket] += 1
+            if error is not None:
+                name = type(error).__name__
+                counters.errors[name] = counters.errors.get(name, 0) + 1
+            if path:
+                depth = path.count('\\') + 1
+                counters.depths[depth] = counters.depths.get(depth, 0) + 1
+                drive = path.split('\\', 1)[0]
+                self.drives[drive] = self.drives.get(drive, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'operations': {operation: counters.stats() for operation, counters in self.operations.items()},
+                'drives': dict(self.drives),
+            }
+
+
+class _OperationCounters:
+    __slots__ = ('calls', 'seconds', 'errors', 'latencies', 'depths')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.errors = {}
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.depths = {}
+
+    def stats(self):
+        latencies = {}
+        for bound, count in zip(LATENCY_BUCKETS + ('inf',), self.latencies):
+            if count:
+                latencies[str(bound)] = count
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'errors': dict(self.errors),
+            'latency_us': latencies,
+            'depths': dict(sorted(self.depths.items())),
+        }
+
+
+def instrumented(operation, path_argument=None, method=False):
+    """
+    Decorates a public operation so that it is measured while metrics are enabled. When they are
+    disabled, the only overhead is a call through the wrapper and a check of a global.
+
+    :param operation: The name the operation is reported under
+    :param path_argument: The (position, name) of the argument holding the path of (or handle to)
+        the object the operation looks up, if any, not counting the instance of a method
+    :param method: Whether the decorated function is a FileSystem method, whose instance is not
+        passed on to hooks
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = _metrics
+            if metrics is None:
+                return func(*args, **kwargs)
+            return metrics.call(operation, func, args, kwargs, path_argument, method)
+        return wrapper
+    return decorate
+
+
+def set_metrics(enabled=True):
+    """
+    Enable or disable the collection of metrics about the file system's public operations.
+
+    While enabled, every call to create, delete, move, write_to_file, write_from, read_buffer, open,
+    is_ancestor, snapshot, save, load, import_tree, export_tree, query and batch commits is counted
+    and timed, along with the exceptions it raised and the depth and drive of the path it looked up.
+    Registered hooks are also only called while enabled. Enabling metrics again starts over from
+    empty counters, keeping the hooks.
+
+    :param enabled: Whether metrics should be collected
+    :return: None
+    """
+    global _metrics
+    if enabled:
+        _metrics = Metrics(*_hooks())
+    else:
+        _pending_hooks[:] = _hooks()
+        _metrics = None
+
+
+def stats():
+    """
+    Return a snapshot of the metrics collected since they were enabled.
+
+    :return: A dict with an 'operations' entry mapping each operation name to its 'calls', total
+        'seconds', 'errors' by exception name, 'latency_us' histogram (call counts keyed by the upper
+        bound of each bucket in microseconds) and 'depths' of the paths it looked up, and a 'drives'
+        entry counting the calls that looked up a path on each drive. Both are empty if metrics are
+        disabled.
+    """
+    metrics = _metrics
+    if metrics is None:
+        return {'operations': {}, 'drives': {}}
+    return metrics.stats()
+
+
+def add_hook(pre=None, post=None):
+    """
+    Register callbacks run before and/or after every instrumented operation while metrics are
+    enabled. See Metrics for the arguments they are called with. Exceptions raised by hooks
+    propagate to the caller of the operation.
+
+    :param pre: Callable run before each operation
+    :param post: Callable run after each operation, whether it succeeded or not
+    :return: None
+    """
+    pre_hooks, post_hooks = _hooks()
+    if pre is not None:
+        pre_hooks.append(pre)
+    if post is not None:
+        post_hooks.append(post)
+    _set_hooks(pre_hooks, post_hooks)
+
+
+def remove_hook(pre=None, post=None):
+    """
+    Unregister callbacks previously registered with add_hook.
+
+    :param pre: The pre-operation callable to remove
+    :param post: The post-operation callable to remove
+    :return: None
+    """
+    pre_hooks, post_hooks = _hooks()
+    if pre in pre_hooks:
+        pre_hooks.remove(pre)
+    if post in post_hooks:
+        post_hooks.remove(post)
+    _set_hooks(pre_hooks, post_hooks)
+
+
+def _hooks():
+    """Returns copies of the registered (pre hooks, post hooks)"""
+    metrics = _metrics
+    if metrics is None:
+        return list(_pending_hooks[0]), list(_pending_hooks[1])
+    return list(metrics.pre_hooks), list(metrics.post_hooks)
+
+
+def _set_hooks(pre_hooks, post_hooks):
+    # Hook lists are replaced rather than changed in place, so running operations aren't affected
+    metrics = _metrics
+    if metrics is None:
+        _pending_hooks[:] = [pre_hooks, post_hooks]
+    else:
+        metrics.pre_hooks = pre_hooks
+        metrics.post_hooks = post_hooks
+
+
+def _path_of(args, kwargs, path_argument):
+    if path_argument is None:
+        return None
+    position, name = path_argument
+    target = args[position] if len(args) > position else kwargs.get(name)
+    if target is None or isinstance(target, str):
+        return target
+    try:
+        return target.path
+    except (AttributeError, IllegalFileSystemOperation):
+        return None
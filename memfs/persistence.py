@@ -0,0 +1,164 @@
+"""
+This file contains the compact binary on-disk format used by memfs.save and memfs.load
+
+Layout (all integers little-endian):
+
+    header      magic b'MEMFS', format version (u8), node count (u64), node table size (u64)
+    node table  one record per object, parents always before their children:
+                    type code (u8), flags (u8), parent index (u32, 0xFFFFFFFF for drives),
+                    name length (u16), UTF-8 name,
+                    and for files with content: size (u64), stored size (u64), content offset (u64),
+                    chunk count (u32), then for each chunk after the first: content offset within
+                    the file (u64) and stored length (u64)
+    content     the stored content of every file, back to back. Files beneath a Zip keep their
+                individually compressed chunks, and are therefore described by a chunk table.
+
+Loading only parses the node table. The content region is memory-mapped, and a file's content is
+only copied into memory the first time it is read.
+"""
+import mmap
+import os
+import struct
+from .exceptions import IllegalFileSystemOperation
+from .filesystem import Drive, File, Folder, Zip
+
+MAGIC = b'MEMFS'
+VERSION = 1
+
+_HEADER = struct.Struct('<5sBQQ')
+_RECORD = struct.Struct('<BBIH')
+_CONTENT = struct.Struct('<QQQI')
+_CHUNK = struct.Struct('<QQ')
+_NO_PARENT = 0xFFFFFFFF
+
+_TYPE_CODES = {'drive': 1, 'folder': 2, 'zip': 3, 'file': 4}
+_TYPES = {1: Drive, 2: Folder, 3: Zip, 4: File}
+
+_HAS_CONTENT = 1
+_IS_TEXT = 2
+
+
+def save(root, path):
+    """
+    Writes the hierarchy under the given root to the given path. The file is written next to its
+    destination first and then moved into place, so an existing file is replaced atomically.
+    """
+    records = []
+    contents = []
+    content_offset = 0
+    indexes = {}
+    stack = [(drive, _NO_PARENT) for drive in reversed(list(root.children.values()))]
+    while stack:
+        node, parent_index = stack.pop()
+        indexes[node] = len(indexes)
+        name = node.name.encode('utf-8')
+        flags = 0
+        content_record = b''
+        if node.type == 'file':
+            content = node._content
+            if content is not None:
+                flags |= _HAS_CONTENT | (_IS_TEXT if node._is_text else 0)
+                chunks, offsets = content
+                content_record = _CONTENT.pack(node.size, node.stored_size, content_offset,
+                                               len(chunks) if node._compressed else 1)
+                if node._compressed:
+                    content_record += b''.join(_CHUNK.pack(offset, len(chunk))
+                                               for offset, chunk in zip(offsets[1:], chunks[1:]))
+                contents.extend(chunks)
+                content_offset += node.stored_size
+        else:
+            index = indexes[node]
+            stack.extend((child, index) for child in reversed(list(node.children.values())))
+        records.append(_RECORD.pack(_TYPE_CODES[node.type], flags, parent_index, len(name)))
+        records.append(name)
+        records.append(content_record)
+
+    table_size = sum(len(record) for record in records)
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, VERSION, len(indexes), table_size))
+        out.writelines(records)
+        out.writelines(contents)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_path, path)
+
+
+def load(root, path):
+    """
+    Replaces the hierarchy under the given root with the one saved at the given path. The whole file
+    is parsed into a detached hierarchy first, so the current one is left untouched if it is invalid.
+    """
+    with open(path, 'rb') as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            raise IllegalFileSystemOperation('The given file is not a saved memfs file system')
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, node_count, table_size = _HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or version != VERSION:
+        raise IllegalFileSystemOperation('The given file is not a saved memfs file system')
+    content_view = memoryview(mapped)[_HEADER.size + table_size:]
+
+    drives = []
+    nodes = []
+    paths = []
+    index = {}
+    position = _HEADER.size
+    for _ in range(node_count):
+        type_code, flags, parent_index, name_length = _RECORD.unpack_from(mapped, position)
+        position += _RECORD.size
+        name = bytes(mapped[position:position + name_length]).decode('utf-8')
+        position += name_length
+
+        node = _TYPES[type_code](name)
+        parent = None if parent_index == _NO_PARENT else nodes[parent_index]
+        if node.type != 'zip' and parent is not None:
+            node._compressed = parent._compressed
+        if flags & _HAS_CONTENT:
+            size, stored_size, offset, chunk_count = _CONTENT.unpack_from(mapped, position)
+            position += _CONTENT.size
+            offsets, lengths = [0], []
+            for _ in range(chunk_count - 1):
+                raw_offset, length = _CHUNK.unpack_from(mapped, position)
+                position += _CHUNK.size
+                offsets.append(raw_offset)
+                lengths.append(length)
+            lengths.insert(0, stored_size - sum(lengths))
+            # Content stays in the mapped file until it is first read, see File._raw_chunks
+            chunks = []
+            for length in lengths:
+                chunks.append(content_view[offset:offset + length])
+                offset += length
+            node._content = chunks, offsets
+            node._is_text = bool(flags & _IS_TEXT)
+            node._size = size
+            node._stored_size = stored_size
+        if parent is None:
+            drives.append(node)
+        else:
+            node.parent = parent
+            parent._add_child(node)
+
+        parent_path = paths[parent_index] if parent_index != _NO_PARENT else ''
+        node_path = node.name if parent_path == '' else '{}\\{}'.format(parent_path, node.name)
+        node._path = node_path
+        index[node_path] = node
+        nodes.append(node)
+        paths.append(node_path)
+
+    # Parents always precede their children, so walking backwards aggregates each subtree's size
+    # before it is added to its parent
+    for node in reversed(nodes):
+        if node.parent is not None:
+            node.parent._size += node.size
+            node.parent._stored_size += node.stored_size
+
+    root.reset()
+    for drive in drives:
+        drive.parent = root
+        root._add_child(drive)
+        root._size += drive.size
+        root._stored_size += drive.stored_size
+    root.index = index
+    if root.query_indexes is not None:
+        root.query_indexes.rebuild(index)
+
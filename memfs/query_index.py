@@ -0,0 +1,57 @@
+"""
+This file contains the optional secondary indexes used to query objects by type and by name
+"""
+import threading
+
+
+class QueryIndexes:
+    """
+    Maps each object type and each object name to the objects having it, keyed by full path.
+
+    Like the file system's flat path index, these are updated by the file system whenever an
+    object is linked into or unlinked from the hierarchy, so a query only touches its results.
+    """
+    def __init__(self):
+        self.by_type = {}
+        self.by_name = {}
+        self._lock = threading.Lock()
+
+    def add(self, path, obj):
+        with self._lock:
+            self.by_type.setdefault(obj.type.value, {})[path] = obj
+            self.by_name.setdefault(obj.name, {})[path] = obj
+
+    def remove(self, path, obj):
+        with self._lock:
+            _remove(self.by_type, obj.type.value, path)
+            _remove(self.by_name, obj.name, path)
+
+    def lookup(self, type=None, name=None):
+        """Returns the objects with the given type and/or name"""
+        with self._lock:
+            by_type = self.by_type.get(type, {}) if type is not None else None
+            by_name = self.by_name.get(name, {}) if name is not None else None
+            if by_type is None or by_name is None:
+                return list((by_type if by_type is not None else by_name).values())
+            # Only the smaller of the two buckets needs to be scanned
+            smaller, larger = (by_type, by_name) if len(by_type) <= len(by_name) else (by_name, by_type)
+            return [obj for path, obj in smaller.items() if path in larger]
+
+    def rebuild(self, index):
+        """Rebuilds the indexes from the given flat path index"""
+        self.clear()
+        for path, obj in index.items():
+            self.add(path, obj)
+
+    def clear(self):
+        with self._lock:
+            self.by_type.clear()
+            self.by_name.clear()
+
+
+def _remove(buckets, key, path):
+    bucket = buckets.get(key)
+    if bucket is not None:
+        bucket.pop(path, None)
+        if not bucket:
+            del buckets[key]
@@ -0,0 +1,96 @@
+"""
+This file contains the framed protocol spoken between memfs.server and memfs.client
+
+Every message is framed as: payload length (u32), request id (u32), code (u8), then the payload,
+made of length-prefixed (u32) fields. Requests carry an operation code and its arguments, and
+responses carry the id of the request they answer with a status code and the results. Clients may
+send any number of requests before reading the responses (pipelining). Responses on a connection
+always come back in the order the requests were sent.
+"""
+import struct
+from .exceptions import IllegalFileSystemOperation, InvalidWriteException, PathAlreadyExistsException, PathNotFoundException
+
+# Operation codes
+CREATE = 1
+DELETE = 2
+MOVE = 3
+WRITE = 4
+READ = 5
+SIZE = 6
+CHILDREN = 7
+GLOB = 8
+EXISTS = 9
+
+# Response status codes
+OK = 0
+ERROR = 1
+
+# Exceptions that are raised again on the client, by name. Any other error is reported as an
+# IllegalFileSystemOperation
+EXCEPTIONS = {exception.__name__: exception for exception in (
+    IllegalFileSystemOperation, InvalidWriteException, PathAlreadyExistsException, PathNotFoundException)}
+
+HEADER = struct.Struct('<IIB')
+_FIELD = struct.Struct('<I')
+_NUMBER = struct.Struct('<Q')
+
+
+def encode(request_id, code, fields):
+    """Returns the frame holding the given fields, as a list of buffers to be written in order"""
+    parts = [None]
+    length = 0
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode('utf-8')
+        parts.append(_FIELD.pack(len(field)))
+        parts.append(field)
+        length += _FIELD.size + len(field)
+    parts[0] = HEADER.pack(length, request_id, code)
+    return parts
+
+
+def decode(payload):
+    """Returns the fields of a frame's payload, as memoryviews of it"""
+    payload = memoryview(payload)
+    fields = []
+    position = 0
+    while position < len(payload):
+        length, = _FIELD.unpack_from(payload, position)
+        position += _FIELD.size
+        fields.append(payload[position:position + length])
+        position += length
+    return fields
+
+
+def encode_flag(flag):
+    return b'\x01' if flag else b'\x00'
+
+
+def decode_flag(field):
+    return field == b'\x01'
+
+
+def encode_number(number):
+    return _NUMBER.pack(number)
+
+
+def decode_number(field):
+    return _NUMBER.unpack(field)[0]
+
+
+def text(field):
+    return str(field, 'utf-8')
+
+
+def error_fields(error):
+    """Returns the fields describing an error raised by an operation"""
+    return type(error).__name__, str(error)
+
+
+def raise_error(fields):
+    """Raises the error described by the given fields again"""
+    name, message = text(fields[0]), text(fields[1])
+    exception = EXCEPTIONS.get(name)
+    if exception is None:
+        raise IllegalFileSystemOperation('{}: {}'.format(name, message))
+    raise exception(message)
@@ -0,0 +1,222 @@
+"""
+This file contains the asyncio server sharing a file system with other processes over a socket
+
+Run it with:
+
+    python -m memfs.server (--unix PATH | --host HOST --port PORT) [--load FILE] [--journal DIRECTORY]
+"""
+import argparse
+import asyncio
+import threading
+from . import index
+from . import rpc
+from .exceptions import IllegalFileSystemOperation
+
+# Bytes of responses allowed to pile up on a connection before the server waits for the client
+WRITE_BUFFER_LIMIT = 1024 * 1024
+
+
+class Server:
+    """
+    Serves a file system over a Unix socket or a localhost TCP socket (see memfs.rpc).
+
+    Every request is applied on the event loop's thread as soon as it has been read, so operations
+    from all connections are applied one at a time, each with the same semantics as in-process.
+    Responses are written without waiting for the client to read them until WRITE_BUFFER_LIMIT
+    bytes are pending, which lets pipelined requests be answered back to back.
+
+    :param fs: The FileSystem to serve (the module-level file system by default)
+    """
+    def __init__(self, fs=None):
+        self.fs = fs if fs is not None else index._default
+        self.address = None
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._writers = set()  # The writer of each open connection
+        self._operations = {
+            rpc.CREATE: self._create,
+            rpc.DELETE: self._delete,
+            rpc.MOVE: self._move,
+            rpc.WRITE: self._write,
+            rpc.READ: self._read,
+            rpc.SIZE: self._size,
+            rpc.CHILDREN: self._children,
+            rpc.GLOB: self._glob,
+            rpc.EXISTS: self._exists,
+        }
+
+    async def start(self, address):
+        """
+        Starts listening on the given address.
+
+        :param address: The path of a Unix socket, or a (host, port) tuple. Port 0 picks a free port.
+        :return: None
+        """
+        if isinstance(address, str):
+            self._server = await asyncio.start_unix_server(self._serve, path=address)
+            self.address = address
+        else:
+            self._server = await asyncio.start_server(self._serve, *address)
+            self.address = self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    def start_in_thread(self, address):
+        """
+        Starts serving on the given address from an event loop run by a background thread, e.g. to
+        share a file system the current process also uses. Note that the server applies requests
+        concurrently with the rest of the process, which should therefore use thread-safe mode.
+
+        :param address: See start
+        :return: None
+        """
+        started = threading.Event()
+        failure = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.start(address))
+            except Exception as e:
+                failure.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='memfs-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        if failure:
+            raise failure[0]
+
+    def stop(self):
+        """Stops a server started with start_in_thread, closing every connection"""
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    async def close(self):
+        """Stops listening and closes every connection"""
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(rpc.HEADER.size)
+                length, request_id, operation = rpc.HEADER.unpack(header)
+                fields = rpc.decode(await reader.readexactly(length)) if length else []
+                writer.writelines(self._respond(request_id, operation, fields))
+                if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _respond(self, request_id, operation, fields):
+        try:
+            apply = self._operations.get(operation)
+            if apply is None:
+                raise IllegalFileSystemOperation('Unknown operation code: {}'.format(operation))
+            return rpc.encode(request_id, rpc.OK, apply(*fields))
+        except Exception as e:
+            return rpc.encode(request_id, rpc.ERROR, rpc.error_fields(e))
+
+    def _create(self, fs_type, name, parent_path):
+        return self.fs.create(rpc.text(fs_type), rpc.text(name), rpc.text(parent_path)).path,
+
+    def _delete(self, path):
+        self.fs.delete(rpc.text(path))
+        return ()
+
+    def _move(self, src, dest):
+        return self.fs.move(rpc.text(src), rpc.text(dest)).path,
+
+    def _write(self, path, is_text, data):
+        # Written data is copied out of the request exactly once, see write_from
+        if rpc.decode_flag(is_text):
+            return self.fs.write_to_file(rpc.text(path), rpc.text(data)).path,
+        return self.fs.write_from(rpc.text(path), data).path,
+
+    def _read(self, path):
+        file = self.fs._get_object(rpc.text(path))
+        # Content is sent straight from the stored bytes, see read_buffer
+        buffer = self.fs.read_buffer(file if file is not None else rpc.text(path))
+        if buffer is None:
+            return ()
+        return rpc.encode_flag(file._is_text), buffer
+
+    def _size(self, path):
+        path = rpc.text(path)
+        obj = self.fs._get_object(path) if path != '' else self.fs.root
+        if obj is None:
+            raise index.PathNotFoundException('The requested object does not exist')
+        return rpc.encode_number(obj.size),
+
+    def _children(self, path):
+        path = rpc.text(path)
+        obj = self.fs._get_object(path) if path != '' else self.fs.root
+        if obj is None:
+            raise index.PathNotFoundException('The requested object does not exist')
+        if obj.type == 'file':
+            raise IllegalFileSystemOperation('File objects cannot contain other items')
+        return list(obj.children)
+
+    def _glob(self, pattern):
+        return [obj.path for obj in self.fs.glob(rpc.text(pattern))]
+
+    def _exists(self, path):
+        return rpc.encode_flag(self.fs._get_object(rpc.text(path)) is not None),
+
+
+async def serve(address, fs=None):
+    """
+    Serves the given file system on the given address until cancelled.
+
+    :param address: The path of a Unix socket, or a (host, port) tuple
+    :param fs: The FileSystem to serve (the module-level file system by default)
+    :return: None
+    """
+    server = Server(fs)
+    await server.start(address)
+    await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a memfs file system to other processes')
+    parser.add_argument('--unix', help='Path of the Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to listen on for TCP connections')
+    parser.add_argument('--port', type=int, help='Port to listen on for TCP connections')
+    parser.add_argument('--load', help='Load a file system previously saved with memfs.save first')
+    parser.add_argument('--journal', help='Make the file system durable with a journal in this directory')
+    args = parser.parse_args(argv)
+    if (args.unix is None) == (args.port is None):
+        parser.error('Exactly one of --unix and --port is required')
+
+    if args.load:
+        index.load(args.load)
+    if args.journal:
+        index.enable_journal(args.journal)
+    try:
+        asyncio.run(serve(args.unix if args.unix is not None else (args.host, args.port)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.disable_journal()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+This file contains the file system sharded by drive across worker processes
+"""
+import multiprocessing
+import os
+import threading
+import zlib
+from .exceptions import IllegalFileSystemOperation, InvalidWriteException, PathNotFoundException
+from .index import FileSystem
+
+
+class ShardedFileSystem:
+    """
+    Spreads drives across worker processes, each holding an independent FileSystem, so that
+    operations on drives in different shards run in parallel on different cores.
+
+    Every call is routed by the drive its path starts with, and the drive is placed in the shard
+    picked by hashing its name, so a drive and everything beneath it always live in the same worker.
+    Calls within a drive therefore behave exactly as they do on a FileSystem. Objects live in the
+    workers, so they are only given by path, results are returned as paths and file content as str
+    or bytes. Moving an object to a drive in another shard is not supported.
+
+    Calls from different threads only wait for each other when they go to the same shard. The
+    workers are stopped by close, or when the sharded file system is used as a context manager.
+    """
+    def __init__(self, shards=None, start_method=None):
+        """
+        :param shards: The number of worker processes (the number of CPUs by default)
+        :param start_method: The multiprocessing start method used for the workers (the platform's
+            default by default)
+        """
+        context = multiprocessing.get_context(start_method)
+        self._shards = []
+        for _ in range(shards or os.cpu_count() or 1):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_serve, args=(worker_connection,), daemon=True)
+            process.start()
+            worker_connection.close()
+            self._shards.append(_Shard(process, connection))
+
+    @property
+    def shards(self):
+        return len(self._shards)
+
+    def shard_of(self, path):
+        """Returns the index of the shard holding the drive the given path is on"""
+        drive = path.split('\\', 1)[0]
+        return zlib.crc32(drive.encode('utf-8')) % len(self._shards)
+
+    def create(self, fs_type, name, parent_path=''):
+        """Create an object, see memfs.create. Returns the path of the created object"""
+        return self._call(parent_path if parent_path != '' else name, 'create', fs_type, name, parent_path)
+
+    def delete(self, path):
+        """Delete an object, see memfs.delete"""
+        return self._call(path, 'delete', path)
+
+    def move(self, src, dest):
+        """
+        Move an object, see memfs.move. Returns the path of the moved object
+
+        :raises IllegalFileSystemOperation: The destination is on a drive in another shard
+        """
+        if self.shard_of(src) != self.shard_of(dest):
+            raise IllegalFileSystemOperation('Objects cannot be moved to a drive in another shard')
+        return self._call(src, 'move', src, dest)
+
+    def write_to_file(self, path, content):
+        """Write new content to a file, see memfs.write_to_file. Returns the path of the file"""
+        return self._call(path, 'write_to_file', path, content)
+
+    def read(self, path):
+        """
+        Read the whole content of a file.
+
+        :param path: The path of the file to read
+        :return: The file's content, as a str or bytes depending on how it was written
+        :raises PathNotFoundException: The given file path does not exist
+        :raises InvalidWriteException: The given object is not a file
+        """
+        return self._call(path, 'read', path)
+
+    def size(self, path):
+        """Returns the size of the object at the given path"""
+        return self._call(path, 'size', path)
+
+    def children(self, path):
+        """Returns the names of the children of the container at the given path"""
+        return self._call(path, 'children', path)
+
+    def glob(self, pattern):
+        """
+        Find the paths of the objects matching the given pattern, see memfs.glob. A pattern
+        starting with a literal drive name is only matched in that drive's shard.
+        """
+        drive = pattern.split('\\', 1)[0]
+        if any(wildcard in drive for wildcard in '*?['):
+            return self._call_all('glob', pattern)
+        return self._call(pattern, 'glob', pattern)
+
+    def query(self, type=None, name=None):
+        """Find the paths of every object with the given type and/or name, see memfs.query"""
+        return self._call_all('query', type, name)
+
+    def close(self):
+        """Stops the worker processes. The sharded file system can't be used afterwards"""
+        for shard in self._shards:
+            with shard.lock:
+                if shard.process.is_alive():
+                    shard.connection.send(None)
+                shard.connection.close()
+        for shard in self._shards:
+            shard.process.join()
+        self._shards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _call(self, path, operation, *args):
+        if not self._shards:
+            raise IllegalFileSystemOperation('The sharded file system has been closed')
+        shard = self._shards[self.shard_of(path)]
+        with shard.lock:
+            shard.connection.send((operation, args))
+            return _result(shard.connection.recv())
+
+    def _call_all(self, operation, *args):
+        """Runs an operation in every shard at once, returning all of their results"""
+        if not self._shards:
+            raise IllegalFileSystemOperation('The sharded file system has been closed')
+        for shard in self._shards:
+            shard.lock.acquire()
+        try:
+            for shard in self._shards:
+                shard.connection.send((operation, args))
+            replies = [shard.connection.recv() for shard in self._shards]
+        finally:
+            for shard in self._shards:
+                shard.lock.release()
+        results = []
+        for reply in replies:
+            results.extend(_result(reply))
+        return results
+
+
+class _Shard:
+    __slots__ = ('process', 'connection', 'lock')
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.lock = threading.Lock()
+
+
+def _result(reply):
+    """Returns the result of a worker's reply, re-raising the exception it failed with"""
+    error, result = reply
+    if error is not None:
+        raise error
+    return result
+
+
+def _serve(connection):
+    """The loop run by each worker process, applying operations to its own file system"""
+    fs = FileSystem()
+    operations = {
+        'create': lambda *args: fs.create(*args).path,
+        'delete': fs.delete,
+        'move': lambda *args: fs.move(*args).path,
+        'write_to_file': lambda *args: fs.write_to_file(*args).path,
+        'read': lambda path: _get_file(fs, path).content,
+        'size': lambda path: _get(fs, path).size,
+        'children': lambda path: list(_get_container(fs, path).children),
+        'glob': lambda pattern: [obj.path for obj in fs.glob(pattern)],
+        'query': lambda *args: [obj.path for obj in fs.query(*args)],
+    }
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        operation, args = request
+        try:
+            reply = (None, operations[operation](*args))
+        except Exception as e:
+            reply = (e, None)
+        connection.send(reply)
+    connection.close()
+
+
+def _get(fs, path):
+    obj = fs._get_object(path)
+    if obj is None:
+        raise PathNotFoundException('The requested object does not exist')
+    return obj
+
+
+def _get_container(fs, path):
+    obj = _get(fs, path)
+    if obj.type == 'file':
+        raise IllegalFileSystemOperation('File objects cannot contain other items')
+    return obj
+
+
+def _get_file(fs, path):
+    obj = _get(fs, path)
+    if obj.type != 'file':
+        raise InvalidWriteException('The requested object is not a file object.')
+    return obj
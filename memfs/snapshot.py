@@ -0,0 +1,225 @@
+"""
+This file contains the copy-on-write snapshots of the file system hierarchy
+"""
+import bisect
+import threading
+import weakref
+from .compression import decompress
+
+
+class _Versions:
+    """
+    Tracks snapshot epochs. Taking a snapshot is O(1): it only starts a new epoch. Objects are
+    then copied lazily, the first time each one is about to change during the new epoch, so that
+    a write only copies the objects it actually changes (the written object and, through size
+    propagation, its ancestors). Everything else is shared between the live tree and snapshots.
+    """
+    def __init__(self):
+        self.epoch = 0
+        self.live_epochs = []  # Sorted epochs of the snapshots that haven't been released
+        self.active = False  # Whether any snapshot is live, i.e. whether objects must be preserved
+        self.preserved = set()  # The objects holding recorded states, cleared as snapshots are released
+        self.lock = threading.Lock()  # Guards the recorded states against releases from other threads
+
+
+_versions = _Versions()
+
+
+def preserve(node):
+    """
+    Records the current state of the given object before it is changed, if a live snapshot may
+    still need to see it. Every mutation of an object in the hierarchy must call this first.
+    """
+    if not _versions.active or node._cow_epoch >= _versions.epoch:
+        return
+    with _versions.lock:
+        # The last snapshot may have been released meanwhile
+        if not _versions.active:
+            return
+        snapshot_epoch = _versions.epoch - 1
+        history = node._history
+        if history is None:
+            history = node._history = []
+        else:
+            _prune(history)
+        history.append((snapshot_epoch, _capture(node)))
+        node._cow_epoch = _versions.epoch
+        _versions.preserved.add(node)
+
+
+def take(root):
+    """Starts a new epoch and returns a snapshot of the hierarchy under the given root at this point"""
+    snapshot = Snapshot(root, _versions.epoch)
+    bisect.insort(_versions.live_epochs, snapshot.epoch)
+    _versions.active = True
+    _versions.epoch += 1
+    weakref.finalize(snapshot, _release, snapshot.epoch)
+    return snapshot
+
+
+def current_epoch():
+    return _versions.epoch
+
+
+def _release(epoch):
+    with _versions.lock:
+        index = bisect.bisect_left(_versions.live_epochs, epoch)
+        if index < len(_versions.live_epochs) and _versions.live_epochs[index] == epoch:
+            del _versions.live_epochs[index]
+        _versions.active = bool(_versions.live_epochs)
+        # Drop the states only the released snapshot could see, so that they don't keep replaced
+        # content in memory until their objects happen to change again
+        preserved = _versions.preserved
+        if not _versions.active:
+            _versions.preserved = set()
+        for node in list(preserved):
+            if _versions.active:
+                _prune(node._history)
+            if not _versions.active or not node._history:
+                node._history = None
+                preserved.discard(node)
+
+
+def _prune(history):
+    """Drops recorded states that no live snapshot can see any more"""
+    live_epochs = _versions.live_epochs
+    previous = -1
+    kept = []
+    for epoch, state in history:
+        # This state is seen by snapshots taken in the epochs (previous, epoch]
+        first_live = bisect.bisect_right(live_epochs, previous)
+        if first_live < len(live_epochs) and live_epochs[first_live] <= epoch:
+            kept.append((epoch, state))
+        previous = epoch
+    history[:] = kept
+
+
+def _capture(node):
+    if node.type == 'file':
+        content, is_text, size, stored_size, compressed, _ = node._get_state()
+        return node.name, node.parent, size, stored_size, None, (content, is_text, compressed)
+    return node.name, node.parent, node.size, node.stored_size, dict(node.children), None
+
+
+class Snapshot:
+    """
+    A read-only, point-in-time view of the file system hierarchy.
+
+    Objects are looked up by path with 'get', and are returned as read-only SnapshotObject views.
+    Snapshots are released automatically once they are no longer referenced, or explicitly with
+    'release' (also called when used as a context manager).
+    """
+    def __init__(self, root, epoch):
+        self.epoch = epoch
+        self.released = False
+        self._root = root
+
+    @property
+    def root(self):
+        return SnapshotObject(self, self._root)
+
+    @property
+    def size(self):
+        return self.root.size
+
+    @property
+    def children(self):
+        return self.root.children
+
+    def get(self, path):
+        """
+        Returns a view of the object at the given path as of when the snapshot was taken, or None
+        if there was no object at that path
+        """
+        obj = self.root
+        for name in path.split('\\'):
+            obj = obj.get(name) if obj.type != 'file' else None
+            if obj is None:
+                return None
+        return obj
+
+    def release(self):
+        """Releases the snapshot, letting the live tree discard the states kept only for it"""
+        if not self.released:
+            self.released = True
+            _release(self.epoch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SnapshotObject:
+    """A read-only view of a Drive, Folder, Zip or File as of when its snapshot was taken"""
+    def __init__(self, snapshot, node):
+        self.snapshot = snapshot
+        self.node = node
+        self.type = node.type
+
+    def _state(self):
+        """The state recorded for the snapshot's epoch, or None if the object hasn't changed since"""
+        for epoch, state in self.node._history or ():
+            if epoch >= self.snapshot.epoch:
+                return state
+        return None
+
+    @property
+    def name(self):
+        state = self._state()
+        return self.node.name if state is None else state[0]
+
+    @property
+    def parent(self):
+        state = self._state()
+        parent = self.node.parent if state is None else state[1]
+        return None if parent is None else SnapshotObject(self.snapshot, parent)
+
+    @property
+    def size(self):
+        state = self._state()
+        return self.node.size if state is None else state[2]
+
+    @property
+    def stored_size(self):
+        state = self._state()
+        return self.node.stored_size if state is None else state[3]
+
+    @property
+    def path(self):
+        if self.type == 'filesystem':
+            return ''
+        parent_path = self.parent.path
+        return self.name if parent_path == '' else "{}\\{}".format(parent_path, self.name)
+
+    @property
+    def children(self):
+        state = self._state()
+        children = self.node.children if state is None else state[4]
+        return {name: SnapshotObject(self.snapshot, child) for name, child in children.items()}
+
+    def get(self, name):
+        state = self._state()
+        child = (self.node.children if state is None else state[4]).get(name)
+        return None if child is None else SnapshotObject(self.snapshot, child)
+
+    @property
+    def data(self):
+        state = self._state()
+        if state is None:
+            return self.node.data
+        content, _, compressed = state[5]
+        if content is None:
+            return None
+        chunks = content[0]
+        return b''.join(decompress(chunk) for chunk in chunks) if compressed else b''.join(chunks)
+
+    @property
+    def content(self):
+        data = self.data
+        state = self._state()
+        is_text = self.node._is_text if state is None else state[5][1]
+        if data is None or not is_text:
+            return data
+        return data.decode(self.node.encoding)
@@ -0,0 +1,121 @@
+"""
+This file contains the store used to spill the content of cold files to disk in memory-bounded mode
+"""
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+# Size of each file the spilled content is written to (larger chunks get a file of their own)
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class SpillStore:
+    """
+    Keeps the stored content of the most recently used files in memory, within a byte budget, and
+    spills the content of the least recently used ones to disk once the budget is exceeded.
+
+    Spilled chunks are written to memory-mapped segment files and replaced, in the file's own chunk
+    list, by read-only memoryviews of the mapping: the same form as content loaded by memfs.load.
+    Reading a spilled file therefore pages its content back in transparently (see File._raw_chunks),
+    while the operating system is free to drop the mapped pages from memory.
+
+    A file counts against the budget with its whole stored size while any of its chunks are in
+    memory. Segment files are removed once no chunk refers to them any more.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.budget = 0
+        self.directory = None
+        self.resident_size = 0  # Stored bytes of the files currently counted as in memory
+        self.spilled_size = 0  # Bytes written to segment files so far
+        self._resident = OrderedDict()  # Maps file -> counted bytes, least recently used first
+        self._segment = None  # The segment being filled, as [read-only view, mapping, used bytes]
+        self._lock = threading.Lock()
+
+    def configure(self, budget, directory=None):
+        with self._lock:
+            self.enabled = budget is not None
+            self.budget = budget or 0
+            self.directory = directory
+            self._segment = None
+            if not self.enabled:
+                self._resident.clear()
+                self.resident_size = 0
+            else:
+                self._evict(None)
+
+    def touch(self, file):
+        """Records that the given file's content was just used or changed, spilling colder files if needed"""
+        chunks = file._chunks
+        in_memory = bool(chunks) and (type(chunks[0]) is not memoryview or type(chunks[-1]) is not memoryview)
+        with self._lock:
+            self.resident_size -= self._resident.pop(file, 0)
+            if in_memory:
+                self._resident[file] = file._stored_size
+                self.resident_size += file._stored_size
+                self._evict(file)
+
+    def discard(self, file):
+        """Stops tracking a file, e.g. because it was deleted"""
+        with self._lock:
+            self.resident_size -= self._resident.pop(file, 0)
+
+    def clear(self):
+        with self._lock:
+            self._resident.clear()
+            self.resident_size = 0
+
+    def _evict(self, keep):
+        # The file just used is never spilled, even if it doesn't fit in the budget on its own
+        while self.resident_size > self.budget and self._resident:
+            file, size = next(iter(self._resident.items()))
+            if file is keep:
+                break
+            del self._resident[file]
+            self.resident_size -= size
+            self._spill(file)
+
+    def _spill(self, file):
+        chunks = file._chunks
+        if not chunks:
+            return
+        # Chunks are replaced in place, so a concurrent append to the same list is never lost
+        for index, chunk in enumerate(list(chunks)):
+            if type(chunk) is not memoryview and chunk:
+                chunks[index] = self._write(chunk)
+        file._release_content()
+
+    def _write(self, chunk):
+        """Writes a chunk to the current segment, returning a read-only view of it"""
+        size = len(chunk)
+        if self._segment is None or self._segment[2] + size > len(self._segment[1]):
+            self._segment = self._new_segment(max(SEGMENT_SIZE, size))
+        view, mapped, used = self._segment
+        mapped[used:used + size] = chunk
+        self._segment[2] = used + size
+        self.spilled_size += size
+        return view[used:used + size]
+
+    def _new_segment(self, size):
+        descriptor, path = tempfile.mkstemp(prefix='memfs-spill-', suffix='.bin', dir=self.directory)
+        try:
+            os.ftruncate(descriptor, size)
+            mapped = mmap.mmap(descriptor, size)
+        finally:
+            os.close(descriptor)
+        # The segment is removed once every view of it (i.e. every spilled chunk in it) is gone
+        weakref.finalize(mapped, _remove, path)
+        return [memoryview(mapped).toreadonly(), mapped, 0]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+spill_store = SpillStore()
@@ -0,0 +1,170 @@
+"""
+This file contains the file-like stream objects returned by memfs.open
+"""
+import codecs
+import contextlib
+from .exceptions import IllegalFileSystemOperation
+from .filesystem import as_bytes
+
+# Modes understood by memfs.open, mapped to whether they allow (reading, writing)
+_MODES = {
+    'r': (True, False),
+    'w': (False, True),
+    'a': (False, True),
+    'r+': (True, True),
+    'w+': (True, True),
+    'a+': (True, True),
+}
+
+
+class FileStream:
+    """
+    A file-like handle over the content of a File object.
+
+    Positions passed to 'seek' and returned by 'tell' are byte offsets. In text mode 'read' decodes
+    the bytes it reads incrementally, so the size passed to it is also measured in bytes.
+
+    Iterating over the stream yields the stored chunks from the current position onwards, which
+    lets large files be streamed out without joining their content into a single buffer.
+
+    'lock' is called with the file and whether the stream is about to write to it, and returns the
+    context manager each read or write runs under (used by the file system's thread-safe mode).
+    'on_change' is called under that lock after each change the stream makes to the file, with the
+    file, the position and the bytes written there, or with None for both when the file is
+    truncated (used by the file system's journal).
+    """
+    def __init__(self, file, mode='r', lock=None, on_change=None):
+        binary = 'b' in mode
+        base_mode = mode.replace('b', '').replace('t', '')
+        if base_mode not in _MODES:
+            raise IllegalFileSystemOperation("Invalid file mode '{}'".format(mode))
+        self.file = file
+        self.mode = mode
+        self.binary = binary
+        self.readable, self.writable = _MODES[base_mode]
+        self.closed = False
+        self._append_only = base_mode.startswith('a')
+        self._decoder = None if binary else codecs.getincrementaldecoder(file.encoding)()
+        self._lock = lock or _no_lock
+        self._on_change = on_change or _no_change
+
+        if base_mode.startswith('w') or (self.writable and file._chunks is None):
+            with self._lock(file, True):
+                file._replace(b'', not binary)
+                self._on_change(file, None, None)
+        self.position = file.size if self._append_only else 0
+
+    def read(self, size=-1):
+        """Reads up to 'size' bytes from the current position, or everything left if 'size' is negative"""
+        self._check_readable()
+        with self._lock(self.file, False):
+            data = self.file._read_at(self.position, size)
+        self.position += len(data)
+        return self._decode(data, final=size < 0)
+
+    def write(self, content):
+        """Writes the given content at the current position (or the end of the file in append mode)"""
+        self._check_writable()
+        data = self._encode(content)
+        with self._lock(self.file, True):
+            if self._append_only:
+                self.position = self.file.size
+            self.file._write_at(self.position, data)
+            self._on_change(self.file, self.position, data)
+        self.position += len(data)
+        return len(content) if isinstance(content, str) else len(data)
+
+    def append(self, content):
+        """Appends the given content to the end of the file regardless of the current position"""
+        self._check_writable()
+        data = self._encode(content)
+        with self._lock(self.file, True):
+            position = self.file.size
+            self.file._append(data)
+            self._on_change(self.file, position, data)
+            self.position = self.file.size
+        return len(content) if isinstance(content, str) else len(data)
+
+    def seek(self, offset, whence=0):
+        """Moves the current position, relative to the start (0), current position (1) or end (2)"""
+        self._check_open()
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self.position + offset
+        elif whence == 2:
+            position = self.file.size + offset
+        else:
+            raise IllegalFileSystemOperation('Invalid whence value: {}'.format(whence))
+        if position < 0:
+            raise IllegalFileSystemOperation('Cannot seek to a negative position')
+        self.position = position
+        if self._decoder:
+            self._decoder.reset()
+        return position
+
+    def tell(self):
+        self._check_open()
+        return self.position
+
+    def chunks(self):
+        """Yields the remaining content chunk by chunk, advancing the position as it goes"""
+        self._check_readable()
+        # Take the chunks up front so that no lock is held while the caller consumes them
+        with self._lock(self.file, False):
+            chunks = list(self.file._iter_chunks(self.position))
+        for chunk in chunks:
+            self.position += len(chunk)
+            yield self._decode(chunk)
+        tail = self._decode(b'', final=True)
+        if tail:
+            yield tail
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        return self.chunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _encode(self, content):
+        if self.binary:
+            data = as_bytes(content) if not isinstance(content, str) else None
+            if data is None:
+                raise IllegalFileSystemOperation('Binary streams can only be written with bytes-like objects')
+            return data
+        if not isinstance(content, str):
+            raise IllegalFileSystemOperation('Text streams can only be written with str')
+        return content.encode(self.file.encoding)
+
+    def _decode(self, data, final=False):
+        if self.binary:
+            return data
+        return self._decoder.decode(data, final)
+
+    def _check_open(self):
+        if self.closed:
+            raise IllegalFileSystemOperation('I/O operation on closed stream')
+
+    def _check_readable(self):
+        self._check_open()
+        if not self.readable:
+            raise IllegalFileSystemOperation('Stream is not open for reading')
+
+    def _check_writable(self):
+        self._check_open()
+        if not self.writable:
+            raise IllegalFileSystemOperation('Stream is not open for writing')
+
+
+def _no_lock(file, write):
+    return contextlib.nullcontext()
+
+
+def _no_change(file, position, data):
+    pass
@@ -0,0 +1,368 @@
+"""
+This file contains the bulk import and export of trees from and to real directories and archives
+"""
+import io
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from .content_store import content_store
+from .exceptions import IllegalFileSystemOperation, PathAlreadyExistsException
+from .filesystem import File, Folder, Zip
+from .spill import spill_store
+
+# Suffixes of the archive files export_tree writes, mapped to their tarfile mode (None for zip)
+ARCHIVE_SUFFIXES = (
+    ('.zip', None),
+    ('.tar', 'w'),
+    ('.tar.gz', 'w:gz'),
+    ('.tgz', 'w:gz'),
+    ('.tar.bz2', 'w:bz2'),
+    ('.tbz2', 'w:bz2'),
+    ('.tar.xz', 'w:xz'),
+    ('.txz', 'w:xz'),
+)
+
+# Number of files read together by each task submitted to the thread pool
+READ_BATCH_SIZE = 64
+
+
+class TreeBuilder:
+    """
+    Builds a detached tree of objects beneath a holder folder, attaching each object directly to its
+    parent rather than looking its path up. File content is read on a thread pool while the source
+    is still being scanned, and only stored once every read has been submitted (see finish).
+
+    Real zip archives found in the source become Zip objects holding their entries, when 'zips' is set.
+    Top-level objects for which 'exists' returns True are rejected as soon as they are scanned.
+    """
+    def __init__(self, pool, compressed, text, zips, exists=None):
+        self.holder = Folder('')
+        self.holder._compressed = compressed
+        self.pool = pool
+        self.text = text
+        self.zips = zips
+        self.exists = exists
+        self._batch = []  # (file, read, args) of the files whose reads haven't been submitted yet
+        self._pending = []  # (batch, future) pairs whose content hasn't been stored yet
+
+    def container(self, parent, name, fs_type='folder'):
+        """Returns the child container with the given name, creating it if needed"""
+        child = parent.get(name)
+        if child is None:
+            child = self._attach(Zip(name) if fs_type == 'zip' else Folder(name), parent)
+        elif child.type == 'file':
+            raise IllegalFileSystemOperation('The source holds both a file and a folder named {}'.format(name))
+        return child
+
+    def file(self, parent, name, read, *args):
+        """Adds a file whose content is read by calling read(*args) on the thread pool"""
+        if parent.get(name) is not None:
+            raise IllegalFileSystemOperation('The source holds two objects named {}'.format(name))
+        self._batch.append((self._attach(File(name), parent), read, args))
+        if len(self._batch) >= READ_BATCH_SIZE:
+            self._submit()
+
+    def finish(self):
+        """Stores the content of every file added so far, waiting for it to be read if needed"""
+        self._submit()
+        pending, self._pending = self._pending, []
+        for batch, future in pending:
+            # Content is stored while each file is detached, and the sizes of the files sharing a
+            # parent are then propagated to their ancestors at once
+            sizes = {}
+            for (file, _, _), data in zip(batch, future.result()):
+                parent, file.parent = file.parent, None
+                file._replace(data, self.text)
+                file.parent = parent
+                size, stored_size = sizes.get(parent, (0, 0))
+                sizes[parent] = (size + file._size, stored_size + file._stored_size)
+            for parent, (size, stored_size) in sizes.items():
+                parent._update_size(size, stored_size)
+
+    def _submit(self):
+        # Files are read in batches, so that small files don't each pay for a round trip to the pool
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._pending.append((batch, self.pool.submit(_read_batch, batch)))
+
+    def _attach(self, obj, parent):
+        if parent is self.holder and self.exists is not None and self.exists(obj.name):
+            raise PathAlreadyExistsException('{} already exists in the destination'.format(obj.name))
+        if obj.type != 'zip':
+            obj._compressed = parent._compressed
+        obj.parent = parent
+        parent._add_child(obj)
+        return obj
+
+    def path(self, parent, parts):
+        """Returns the container at the given relative path components, creating folders as needed"""
+        for part in parts:
+            parent = self.container(parent, part)
+        return parent
+
+
+def build(source, compressed, text=False, zips=True, workers=None, exists=None):
+    """
+    Reads a directory, tar archive or zip archive into a detached tree of objects.
+
+    Nothing is left behind if the source can't be read: the content stored so far is released.
+
+    :param source: The path of the directory or archive on disk
+    :param compressed: Whether the tree is to be attached beneath a Zip
+    :param text: Whether file content should be read back as text rather than bytes
+    :param zips: Whether zip archives found in the source become Zip objects
+    :param workers: The number of threads reading file content
+    :param exists: Callable returning whether a top-level object with the given name already
+        exists in the destination, in which case the import fails before its content is read
+    :return: The detached holder folder whose children are the top-level imported objects
+    :raises PathAlreadyExistsException: 'exists' returned True for a top-level object
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        builder = TreeBuilder(pool, compressed, text, zips, exists)
+        try:
+            if os.path.isdir(source):
+                _read_directory(builder, source)
+            elif zipfile.is_zipfile(source):
+                _read_zip(builder, builder.holder, source)
+            elif tarfile.is_tarfile(source):
+                _read_tar(builder, source)
+            else:
+                raise IllegalFileSystemOperation('{} is neither a directory nor a tar or zip archive'.format(source))
+            builder.finish()
+        except BaseException:
+            discard(builder.holder)
+            raise
+    return builder.holder
+
+
+def discard(holder):
+    """
+    Releases the content of the files in a detached tree that won't be linked into the file system,
+    i.e. their references to deduplicated content, and stops tracking their use
+
+    :param holder: The detached holder folder returned by build
+    :return: None
+    """
+    if not (len(content_store) or spill_store.enabled):
+        return
+    stack = list(holder.children.values())
+    while stack:
+        obj = stack.pop()
+        if obj.type == 'file':
+            obj._release_content()
+            spill_store.discard(obj)
+        else:
+            stack.extend(obj.children.values())
+
+
+def _read_directory(builder, source):
+    stack = [(builder.holder, source)]
+    while stack:
+        parent, os_path = stack.pop()
+        with os.scandir(os_path) as entries:
+            for entry in entries:
+                name = _check_name(entry.name)
+                # Links to directories are not followed, so that a link cycle can't be imported forever
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((builder.container(parent, name), entry.path))
+                elif entry.is_file():
+                    if builder.zips and _is_zip_name(name) and zipfile.is_zipfile(entry.path):
+                        _read_zip(builder, builder.container(parent, name, 'zip'), entry.path)
+                    else:
+                        builder.file(parent, name, _read_file, entry.path)
+
+
+def _read_zip(builder, parent, archive):
+    with zipfile.ZipFile(archive) as source:
+        for info in source.infolist():
+            parts = _split_member(info.filename)
+            if not parts:
+                continue
+            container = builder.path(parent, parts[:-1])
+            if info.is_dir():
+                builder.container(container, parts[-1])
+            elif builder.zips and _is_zip_name(parts[-1]) and _is_zip_entry(source, info):
+                nested = builder.container(container, parts[-1], 'zip')
+                _read_zip(builder, nested, io.BytesIO(source.read(info)))
+            else:
+                # Entries are decompressed in parallel, each through its own handle on the archive
+                builder.file(container, parts[-1], source.read, info)
+        # Every entry must have been read before the archive is closed
+        builder.finish()
+
+
+def _read_tar(builder, source):
+    # The archive is streamed, so each member is read as the archive is scanned
+    with tarfile.open(source, 'r|*') as archive:
+        for member in archive:
+            parts = _split_member(member.name)
+            if not parts:
+                continue
+            container = builder.path(builder.holder, parts[:-1])
+            if member.isdir():
+                builder.container(container, parts[-1])
+            elif member.isfile():
+                data = archive.extractfile(member).read()
+                if builder.zips and _is_zip_name(parts[-1]) and zipfile.is_zipfile(io.BytesIO(data)):
+                    _read_zip(builder, builder.container(container, parts[-1], 'zip'), io.BytesIO(data))
+                else:
+                    builder.file(container, parts[-1], _given, data)
+
+
+def _read_batch(batch):
+    return [read(*args) for _, read, args in batch]
+
+
+def _given(data):
+    return data
+
+
+def _read_file(path):
+    with open(path, 'rb') as source:
+        return source.read()
+
+
+def _split_member(name):
+    """Splits an archive member name into path components, ignoring empty and '.' components"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if '..' in parts:
+        raise IllegalFileSystemOperation('Archive members may not refer to parent directories: {}'.format(name))
+    return parts
+
+
+def _check_name(name):
+    if '\\' in name:
+        raise IllegalFileSystemOperation('Object names may not contain backslashes: {}'.format(name))
+    return name
+
+
+def _is_zip_name(name):
+    return name.lower().endswith('.zip')
+
+
+def _is_zip_entry(archive, info):
+    with archive.open(info) as entry:
+        return zipfile.is_zipfile(entry)
+
+
+def export(obj, target, workers=None):
+    """
+    Writes the subtree beneath the given container (or the file) to a directory or archive on disk
+
+    :param obj: The object to export
+    :param target: The directory to write to, or the archive to write if it has one of the
+        ARCHIVE_SUFFIXES
+    :param workers: The number of threads writing files to a directory
+    :return: None
+    :raises IllegalFileSystemOperation: An object's name can't be written as a single path component
+    """
+    # Every name is checked before anything is written, so that a bad name leaves nothing behind
+    _check_export_names(obj)
+    lowered = target.lower()
+    # Longer suffixes are checked first, so that '.tar.gz' isn't taken for a plain tar
+    for suffix, mode in sorted(ARCHIVE_SUFFIXES, key=lambda item: -len(item[0])):
+        if lowered.endswith(suffix):
+            if mode is None:
+                with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    _write_zip(archive, obj)
+            else:
+                with tarfile.open(target, mode) as archive:
+                    _write_tar(archive, obj)
+            return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        _write_directory(pool, obj, target)
+
+
+def _check_export_names(obj):
+    """
+    Checks that none of the names written for the given object can write outside the target, e.g.
+    a file named '../escaped' or '/etc/passwd'
+    """
+    # A container's own name isn't written, only the names beneath it (e.g. the root has none)
+    stack = [obj] if obj.type == 'file' else list(obj.children.values())
+    while stack:
+        obj = stack.pop()
+        name = obj.name
+        if (name in ('', '.', '..') or '/' in name or os.sep in name
+                or (os.altsep is not None and os.altsep in name) or os.path.isabs(name)):
+            raise IllegalFileSystemOperation('{} can not be exported as a file or directory name'.format(name))
+        if obj.type != 'file':
+            stack.extend(obj.children.values())
+
+
+def _members(obj):
+    """
+    Yields the (relative path components, object) pairs of the objects to write for the given
+    object, depth first. Zip objects are yielded without their content, which goes into an archive
+    of its own.
+    """
+    if obj.type == 'file':
+        yield (obj.name,), obj
+        return
+    stack = [((), child) for child in reversed(list(obj.children.values()))]
+    while stack:
+        parent_parts, child = stack.pop()
+        parts = parent_parts + (child.name,)
+        yield parts, child
+        if child.type != 'file' and child.type != 'zip':
+            stack.extend((parts, grandchild) for grandchild in reversed(list(child.children.values())))
+
+
+def _content(file):
+    return file.buffer if file._chunks is not None else b''
+
+
+def _zip_bytes(obj):
+    """Returns the content of a real zip archive holding the subtree beneath the given Zip object"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        _write_zip(archive, obj)
+    return buffer.getbuffer()
+
+
+def _write_directory(pool, obj, target):
+    if obj.type == 'file':
+        pool.submit(_write_file, target, _content(obj)).result()
+        return
+    os.makedirs(target, exist_ok=True)
+    futures = []
+    for parts, child in _members(obj):
+        os_path = os.path.join(target, *parts)
+        if child.type == 'file':
+            futures.append(pool.submit(_write_file, os_path, _content(child)))
+        elif child.type == 'zip':
+            futures.append(pool.submit(lambda path, zip_object: _write_file(path, _zip_bytes(zip_object)), os_path, child))
+        else:
+            os.makedirs(os_path, exist_ok=True)
+    for future in futures:
+        future.result()
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as out:
+        out.write(data)
+
+
+def _write_zip(archive, obj):
+    for parts, child in _members(obj):
+        name = '/'.join(parts)
+        if child.type == 'file':
+            archive.writestr(name, _content(child))
+        elif child.type == 'zip':
+            archive.writestr(name, _zip_bytes(child))
+        else:
+            archive.writestr(name + '/', b'')
+
+
+def _write_tar(archive, obj):
+    for parts, child in _members(obj):
+        info = tarfile.TarInfo('/'.join(parts))
+        if child.type == 'file' or child.type == 'zip':
+            data = _content(child) if child.type == 'file' else _zip_bytes(child)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        else:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            archive.addfile(info)
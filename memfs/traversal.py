@@ -0,0 +1,184 @@
+"""
+This file contains the generators used to enumerate and search the file system hierarchy
+"""
+import fnmatch
+import re
+from . import index
+
+# Characters that make a path component a pattern rather than a literal name
+_WILDCARDS = re.compile(r'[*?[]')
+
+
+def walk(fs, path='', topdown=True):
+    """
+    Walk the hierarchy beneath the given path, in the manner of os.walk.
+
+    Yields a (path, containers, files) tuple for the given object and every container beneath it,
+    where 'containers' and 'files' are lists of the names of its child drives, folders and zips
+    and of its child files. Containers are yielded lazily as the walk reaches them.
+
+    When walking top-down, the caller may remove names from 'containers' (in place) to prune the
+    walk: the removed containers are then not visited.
+
+    :param fs: The FileSystem to walk
+    :param path: The path of (or handle to) the container to walk, or '' for the whole file system
+    :param topdown: Whether each container is yielded before (True) or after (False) its children
+    :return: A generator of (path, containers, files) tuples
+    :raises PathNotFoundException: The given path does not exist
+    :raises IllegalFileSystemOperation: The given path is a file
+    """
+    root = _get_container(fs, path)
+    path = root.path
+    # Each stack entry is (path, object, listing). The listing is None until the object is
+    # expanded, and set while waiting for its children to be yielded bottom-up
+    stack = [(path, root, None)]
+    while stack:
+        obj_path, obj, listing = stack.pop()
+        if listing is not None:
+            yield listing
+            continue
+        containers, files = [], []
+        # Take the child names up front, so that the walk survives changes made while it is paused
+        for name, child in list(obj.children.items()):
+            (files if child.type == 'file' else containers).append(name)
+        listing = (obj_path, containers, files)
+        if topdown:
+            yield listing
+        else:
+            stack.append((obj_path, obj, listing))
+        for name in reversed(containers):
+            child = obj.get(name)
+            if child is not None and child.type != 'file':
+                stack.append((index._object_path(obj_path, name), child, None))
+
+
+def glob(fs, pattern):
+    """
+    Find the objects whose full path matches the given pattern.
+
+    Patterns are matched component by component against backslash-separated paths. Within a
+    component, '*' matches any characters, '?' matches a single character and '[...]' matches a
+    set of characters. A '**' component matches zero or more whole path components. Leading
+    components without wildcards are looked up directly, so only the subtree beneath them is
+    searched.
+
+    :param fs: The FileSystem to search
+    :param pattern: The pattern to match, e.g. 'Drive1\\**\\*.txt'
+    :return: A generator of the matching objects
+    """
+    parts = []
+    for part in pattern.split('\\'):
+        # Consecutive '**' components match the same paths as a single one
+        if not (part == '**' and parts and parts[-1] == '**'):
+            parts.append(part)
+    literal_count = 0
+    while literal_count < len(parts) and not _is_pattern(parts[literal_count]):
+        literal_count += 1
+
+    if literal_count:
+        start_path = '\\'.join(parts[:literal_count])
+        start = fs._get_object(start_path)
+        if start is None:
+            return
+    else:
+        start_path, start = '', fs.root
+    if literal_count == len(parts):
+        yield start
+        return
+
+    matchers = [None if part == '**' else re.compile(fnmatch.translate(part)).match for part in parts]
+    # With several '**' components, the same object can be reached along different routes
+    seen = set() if parts.count('**') > 1 else None
+    stack = [(start_path, start, literal_count)]
+    while stack:
+        obj_path, obj, part_index = stack.pop()
+        if part_index == len(parts):
+            if obj is fs.root:
+                continue
+            if seen is None or id(obj) not in seen:
+                if seen is not None:
+                    seen.add(id(obj))
+                yield obj
+            continue
+        matcher = matchers[part_index]
+        pending = []
+        if matcher is None:
+            # '**' either matches nothing more, or one more component and stays in effect
+            pending.append((obj_path, obj, part_index + 1))
+        if obj.type == 'file':
+            stack.extend(pending)
+            continue
+        children = list(obj.children.items())
+        if matcher is None:
+            pending.extend((index._object_path(obj_path, name), child, part_index) for name, child in children)
+        else:
+            pending.extend((index._object_path(obj_path, name), child, part_index + 1)
+                           for name, child in children if matcher(name))
+        stack.extend(reversed(pending))
+
+
+def find(fs, path='', type=None, name=None, min_size=None, max_size=None):
+    """
+    Find the objects beneath the given path that match all of the given criteria.
+
+    The object at the given path itself is not included. Results are yielded as the search
+    reaches them, in depth-first order.
+
+    :param fs: The FileSystem to search
+    :param path: The path of (or handle to) the container to search, or '' for the whole file system
+    :param type: Only find objects of this type ('drive', 'folder', 'zip' or 'file')
+    :param name: Only find objects whose name matches this pattern (see glob)
+    :param min_size: Only find objects whose size is at least this many bytes
+    :param max_size: Only find objects whose size is at most this many bytes
+    :return: A generator of the matching objects
+    :raises PathNotFoundException: The given path does not exist
+    :raises IllegalFileSystemOperation: The given path is a file
+    """
+    root = _get_container(fs, path)
+    name_matcher = re.compile(fnmatch.translate(name)).match if name is not None else None
+    # Drives only ever exist at the root, so there is no need to look beneath them for one
+    descend = type != 'drive'
+    stack = [child for _, child in reversed(list(root.children.items()))]
+    while stack:
+        obj = stack.pop()
+        if ((type is None or obj.type == type) and
+                (name_matcher is None or name_matcher(obj.name)) and
+                (min_size is None or obj.size >= min_size) and
+                (max_size is None or obj.size <= max_size)):
+            yield obj
+        if descend and obj.type != 'file':
+            stack.extend(child for _, child in reversed(list(obj.children.items())))
+
+
+def query(fs, type=None, name=None):
+    """
+    Find every object with the given type and/or the given name, anywhere in the file system.
+
+    With the secondary indexes enabled (see memfs.set_query_indexes) this only touches the
+    matching objects. Otherwise it falls back to searching the whole file system.
+
+    :param fs: The FileSystem to search
+    :param type: Only find objects of this type ('drive', 'folder', 'zip' or 'file')
+    :param name: Only find objects with exactly this name
+    :return: A list of the matching objects
+    :raises IllegalFileSystemOperation: Neither a type nor a name was given
+    """
+    if type is None and name is None:
+        raise index.IllegalFileSystemOperation('A query needs a type, a name or both')
+    query_indexes = fs.root.query_indexes
+    if query_indexes is not None:
+        return query_indexes.lookup(type, name)
+    return [obj for obj in find(fs, type=type) if name is None or obj.name == name]
+
+
+def _is_pattern(part):
+    return part == '**' or _WILDCARDS.search(part) is not None
+
+
+def _get_container(fs, path):
+    obj = fs._resolve(path)[0] if path != '' else fs.root
+    if obj is None:
+        raise index.PathNotFoundException('The requested path does not exist')
+    if obj.type == 'file':
+        raise index.IllegalFileSystemOperation('File objects cannot contain other items')
+    return obj
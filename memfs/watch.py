@@ -0,0 +1,150 @@
+"""
+This file contains the change notifications delivered to the watchers of parts of the file system
+"""
+import bisect
+import threading
+from collections import namedtuple
+
+# Kinds of events
+CREATED = 'created'
+DELETED = 'deleted'
+MOVED = 'moved'
+MODIFIED = 'modified'
+
+# A change to the object at 'path'. 'dest' is the path a moved object was moved to, and None for
+# every other kind of event
+Event = namedtuple('Event', ('type', 'path', 'dest'))
+
+
+class Watch:
+    """
+    A subscription to the changes made at or beneath a path, returned by memfs.watch.
+
+    Events are delivered in batches, as a list of Event tuples: one batch per operation (or per
+    committed batch of operations) that changed something the watch covers. Batches are either
+    passed to a callback, on the thread that made the change once it has been applied, or put on a
+    queue (anything with a 'put' method, e.g. queue.Queue) for a consumer to pick up.
+    """
+    def __init__(self, watchers, path, callback, queue):
+        self.path = path
+        self._watchers = watchers
+        self._callback = callback
+        self._queue = queue
+
+    def close(self):
+        """Stops the delivery of events to this watch"""
+        self._watchers.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _deliver(self, events):
+        if self._queue is not None:
+            self._queue.put(events)
+        else:
+            self._callback(events)
+
+
+class Watchers:
+    """
+    The watches registered on a file system, keyed by the path they watch.
+
+    Operations emit events for the paths they change, which are held for the current thread until
+    the operation completes, then routed to the watches of each changed path and of its ancestors
+    by looking up every prefix of the path. Deleting or moving a container also notifies the
+    watches beneath it, which are found by bisecting the sorted list of watched paths. Neither
+    depends on the number of watches registered.
+    """
+    def __init__(self):
+        self.by_path = {}  # Maps watched path -> list of watches
+        self._paths = []  # Sorted watched paths, used to find the watches beneath a path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, watch):
+        with self._lock:
+            watches = self.by_path.get(watch.path)
+            if watches is None:
+                bisect.insort(self._paths, watch.path)
+                watches = self.by_path[watch.path] = []
+            # Lists are replaced rather than changed in place, so events being routed aren't affected
+            self.by_path[watch.path] = watches + [watch]
+
+    def remove(self, watch):
+        with self._lock:
+            watches = [other for other in self.by_path.get(watch.path, ()) if other is not watch]
+            if watches:
+                self.by_path[watch.path] = watches
+            elif watch.path in self.by_path:
+                del self.by_path[watch.path]
+                del self._paths[bisect.bisect_left(self._paths, watch.path)]
+
+    def emit(self, kind, path, dest=None):
+        """Records an event, to be delivered once the current operation completes"""
+        pending = getattr(self._local, 'events', None)
+        if pending is None:
+            pending = self._local.events = []
+        pending.append(Event(kind, path, dest))
+
+    def discard(self):
+        """Drops the events of the current operation, e.g. because it was rolled back"""
+        self._local.events = None
+
+    def deliver(self):
+        """Delivers the events of the current operation to the watches they concern"""
+        pending = getattr(self._local, 'events', None)
+        if not pending:
+            return
+        self._local.events = None
+        batches = {}
+        for event in pending:
+            for watch in self._watching(event):
+                batches.setdefault(watch, []).append(event)
+        for watch, events in batches.items():
+            watch._deliver(_coalesce(events))
+
+    def _watching(self, event):
+        """Returns the watches an event concerns, each once"""
+        by_path = self.by_path
+        watches = []
+        for path in (event.path, event.dest) if event.dest is not None else (event.path,):
+            # The watches of the changed path and of each of its ancestors (the root being '')
+            while True:
+                watches.extend(by_path.get(path, ()))
+                if path == '':
+                    break
+                separator = path.rfind('\\')
+                path = path[:separator] if separator >= 0 else ''
+        if event.type == DELETED or event.type == MOVED:
+            # The watches beneath a deleted or moved object
+            prefix = event.path + '\\'
+            with self._lock:
+                paths = self._paths
+                position = bisect.bisect_left(paths, prefix)
+                while position < len(paths) and paths[position].startswith(prefix):
+                    watches.extend(by_path.get(paths[position], ()))
+                    position += 1
+        return list(dict.fromkeys(watches)) if len(watches) > 1 else watches
+
+
+def _coalesce(events):
+    """
+    Collapses the events of a batch: repeated modifications of a path are reported once, and not at
+    all after its creation. Deletes and moves end the collapsing, since paths may be reused after them.
+    """
+    coalesced = []
+    reported = set()  # Paths created or modified since the last delete or move
+    for event in events:
+        if event.type == MODIFIED:
+            if event.path in reported:
+                continue
+            reported.add(event.path)
+        elif event.type == CREATED:
+            reported.add(event.path)
+        else:
+            reported.clear()
+        coalesced.append(event)
+    return coalesced
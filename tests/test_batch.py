@@ -0,0 +1,68 @@
+import memfs
+from memfs import PathNotFoundException, PathAlreadyExistsException
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def test_batch_commits_all_operations():
+    """
+    Operations queued in a batch are applied together when the block exits
+    """
+    drive = memfs.create('drive', 'Drive1')
+    with memfs.batch() as b:
+        b.create('folder', 'Folder1', drive.path)
+        for i in range(10):
+            b.create('file', 'File{}'.format(i), 'Drive1\\Folder1')
+        b.write_to_file('Drive1\\Folder1\\File0', 'The Left Hand of Darkness')
+        assert len(drive.children) == 0  # Nothing is applied until the block exits
+    folder1 = drive.get('Folder1')
+    assert len(folder1.children) == 10
+    assert folder1.get('File0').content == 'The Left Hand of Darkness'
+    assert drive.size == 25
+
+
+def test_batch_rolls_back_on_failure():
+    """
+    If any operation in a batch fails, all operations already applied are undone
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    zip1 = memfs.create('zip', 'Zip1', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    memfs.write_to_file(file1.path, 'The Dispossessed')
+    try:
+        with memfs.batch() as b:
+            b.write_to_file(file1.path, 'Always Coming Home')
+            b.move(file1.path, 'Drive1\\Zip1\\File1')
+            b.create('folder', 'Folder2', drive.path)
+            b.delete(folder1.path)
+            b.create('file', 'File2', 'Drive1\\Folder2')
+            b.create('file', 'File2', 'Drive1\\Folder2')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathAlreadyExistsException
+
+    assert sorted(drive.children) == ['Folder1', 'Zip1']
+    assert drive.get('Folder1') is folder1
+    assert file1.path == 'Drive1\\Folder1\\File1'
+    assert file1.content == 'The Dispossessed'
+    assert len(zip1.children) == 0
+    assert drive.size == 16
+    assert memfs.index._get_object('Drive1\\Folder2') is None
+    memfs.write_to_file(file1.path, 'The Lathe of Heaven')
+
+
+def test_batch_discarded_when_block_raises():
+    """
+    Nothing queued is applied when the body of the batch raises
+    """
+    drive = memfs.create('drive', 'Drive1')
+    try:
+        with memfs.batch() as b:
+            b.create('folder', 'Folder1', drive.path)
+            raise PathNotFoundException('Abort')
+    except PathNotFoundException:
+        pass
+    assert len(drive.children) == 0
@@ -0,0 +1,168 @@
+import io
+import warnings
+import zipfile
+import memfs
+from memfs.content_store import content_store
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+    memfs.set_deduplicated(True)
+
+
+def teardown_function():
+    memfs.set_deduplicated(False)
+
+
+def _build(count):
+    drive = memfs.create('drive', 'Drive1')
+    memfs.create('folder', 'Folder1', drive.path)
+    files = []
+    for i in range(count):
+        files.append(memfs.create('file', 'File{}'.format(i), 'Drive1\\Folder1'))
+        memfs.write_to_file(files[-1].path, 'A template shared by many files')
+    return drive, files
+
+
+def test_identical_content_is_shared():
+    """
+    Files with the same content share a single copy of it, without changing any sizes
+    """
+    drive, files = _build(3)
+    assert files[0]._chunks[0] is files[1]._chunks[0] is files[2]._chunks[0]
+    assert len(content_store) == 1
+    assert content_store.references(files[0]._digest) == 3
+    assert content_store.size == len('A template shared by many files')
+    assert files[0].size == len('A template shared by many files')
+    assert drive.size == 3 * len('A template shared by many files')
+
+    # Text and bytes with the same encoding share content too, but keep their own type
+    bytes_file = memfs.create('file', 'Bytes', 'Drive1')
+    memfs.write_to_file(bytes_file.path, b'A template shared by many files')
+    assert bytes_file._chunks[0] is files[0]._chunks[0]
+    assert bytes_file.content == b'A template shared by many files'
+    assert files[0].content == 'A template shared by many files'
+
+
+def test_overwrite_and_delete_release_references():
+    """
+    Shared content is released when a file is overwritten, appended to or deleted, and freed
+    once no file references it any more
+    """
+    drive, files = _build(3)
+    digest = files[0]._digest
+    memfs.write_to_file(files[0].path, 'Something else')
+    assert content_store.references(digest) == 2
+    with memfs.open(files[1].path, 'a') as stream:
+        stream.write('!')
+    assert files[1].content == 'A template shared by many files!'
+    assert files[2].content == 'A template shared by many files'
+    assert content_store.references(digest) == 1
+
+    memfs.delete('Drive1\\Folder1')
+    assert content_store.references(digest) == 0
+    assert len(content_store) == 0
+    assert content_store.size == 0
+    assert drive.size == 0
+
+
+def test_shared_content_in_zip():
+    """
+    Files moved into a zip share their compressed content
+    """
+    drive, files = _build(2)
+    memfs.create('zip', 'Zip1', 'Drive1')
+    memfs.move(files[0].path, 'Drive1\\Zip1\\File0')
+    memfs.move(files[1].path, 'Drive1\\Zip1\\File1')
+    assert files[0]._chunks[0] is files[1]._chunks[0]
+    assert files[0]._compressed
+    assert files[1].content == 'A template shared by many files'
+    assert drive.size == files[0].stored_size + files[1].stored_size
+
+
+def test_snapshot_keeps_shared_content():
+    """
+    A snapshot still sees content that has since been released by the live file system
+    """
+    _, files = _build(1)
+    with memfs.snapshot() as snapshot:
+        memfs.write_to_file(files[0].path, 'Rewritten')
+        assert snapshot.get(files[0].path).content == 'A template shared by many files'
+    assert files[0].content == 'Rewritten'
+
+
+def test_rolled_back_batch_keeps_shared_content():
+    """
+    Rolling back a batch takes back the references its deletes and writes released
+    """
+    drive, files = _build(2)
+    digest = files[0]._digest
+    try:
+        with memfs.batch() as b:
+            b.delete(files[0].path)
+            b.write_to_file(files[1].path, 'Something else')
+            b.delete('Drive1\\Missing')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == memfs.PathNotFoundException
+    assert files[0]._digest == files[1]._digest == digest
+    assert content_store.references(digest) == 2
+    assert files[0]._chunks[0] is files[1]._chunks[0]
+
+    # The shared content is only freed once both files are gone
+    memfs.delete(files[1].path)
+    assert content_store.references(digest) == 1
+    assert files[0].content == 'A template shared by many files'
+    memfs.delete(files[0].path)
+    assert len(content_store) == 0
+    assert content_store.size == 0
+
+
+def test_failed_import_releases_content(tmp_path, monkeypatch):
+    """
+    An import that fails once content has been read releases the references that content took
+    """
+    drive, files = _build(1)
+    digest = files[0]._digest
+    template = b'A template shared by many files'
+    source = tmp_path / 'Source'
+    (source / 'New').mkdir(parents=True)
+    for i in range(3):
+        (source / 'New' / 'File{}'.format(i)).write_bytes(template)
+
+    # The destination gains a clashing object while the source is read
+    read_file = memfs.transfer._read_file
+
+    def read_and_clash(path):
+        if drive.get('Folder1').get('New') is None:
+            memfs.create('folder', 'New', 'Drive1\\Folder1')
+        return read_file(path)
+    monkeypatch.setattr(memfs.transfer, '_read_file', read_and_clash)
+    for _ in range(3):
+        if drive.get('Folder1').get('New') is not None:
+            memfs.delete('Drive1\\Folder1\\New')
+        try:
+            memfs.import_tree(str(source), 'Drive1\\Folder1', text=True, workers=1)
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == memfs.PathAlreadyExistsException
+        assert content_store.references(digest) == 1
+
+    # The source itself is invalid, but only once some of its content has been stored
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w') as archive:
+        archive.writestr('File3', template)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # zipfile warns about the duplicate name
+        with zipfile.ZipFile(str(tmp_path / 'Source.zip'), 'w') as archive:
+            archive.writestr('Files/File1', template)
+            archive.writestr('Inner.zip', inner.getvalue())
+            archive.writestr('Files/File1', template)
+    try:
+        memfs.import_tree(str(tmp_path / 'Source.zip'), drive, text=True)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == memfs.IllegalFileSystemOperation
+    assert content_store.references(digest) == 1
+    memfs.delete(files[0].path)
+    assert len(content_store) == 0
@@ -1,3 +1,6 @@
+import array
+import mmap
+import zlib
 import memfs
 from memfs import IllegalFileSystemOperation, PathNotFoundException, PathAlreadyExistsException, InvalidWriteException
 
@@ -82,8 +85,10 @@ def test_create():
     assert file2.name == file2_name
     assert file2.path == "{}\\{}".format(zip1.path, file2_name)
     assert file2.content == file2_content
-    assert zip1.size == 13
-    assert drive.size == 38
+    compressed_size = len(zlib.compress(file2_content.encode('utf-8')))
+    assert file2.size == 25
+    assert zip1.size == compressed_size
+    assert drive.size == 25 + compressed_size
 
     assert len(drive.children) == 3
     assert len(folder1.children) == 0
@@ -330,3 +335,351 @@ def test_move_file_to_file():
         assert True == False  # Should not get here
     except Exception as e:
         assert type(e) == IllegalFileSystemOperation
+
+
+def test_size_tracks_mutations():
+    """
+    Container sizes stay correct as files are rewritten, moved and deleted
+
+        Drive1
+        |_Folder1
+          |_File1
+        |_Zip1
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    zip1 = memfs.create('zip', 'Zip1', drive.path)
+    memfs.write_to_file(file1.path, 'Dune')
+    assert folder1.size == 4
+    assert drive.size == 4
+
+    memfs.write_to_file(file1.path, 'Dune Messiah')
+    assert folder1.size == 12
+    assert drive.size == 12
+
+    memfs.move(file1.path, "{}\\{}".format(zip1.path, file1.name))
+    compressed_size = len(zlib.compress(b'Dune Messiah'))
+    assert folder1.size == 0
+    assert file1.size == 12
+    assert zip1.size == compressed_size
+    assert drive.size == compressed_size
+
+    memfs.move(zip1.path, "{}\\{}".format(folder1.path, zip1.name))
+    assert folder1.size == compressed_size
+    assert drive.size == compressed_size
+
+    memfs.delete(zip1.path)
+    assert folder1.size == 0
+    assert drive.size == 0
+
+
+def test_paths_resolve_after_move_and_delete():
+    """
+    Objects beneath a moved folder are reachable through their new paths only,
+    and nothing beneath a deleted folder can be resolved any longer
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    folder2 = memfs.create('folder', 'Folder2', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    old_path = file1.path
+
+    memfs.move(folder1.path, "{}\\{}".format(folder2.path, folder1.name))
+    memfs.write_to_file(file1.path, 'Ender\'s Game')
+    assert file1.path == 'Drive1\\Folder2\\Folder1\\File1'
+    try:
+        memfs.write_to_file(old_path, 'Speaker for the Dead')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathNotFoundException
+
+    new_path = file1.path
+    memfs.delete(folder2.path)
+    try:
+        memfs.write_to_file(new_path, 'Xenocide')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathNotFoundException
+    memfs.create('folder', 'Folder2', drive.path)
+
+
+def test_create_inside_file():
+    """
+    Files are leaf nodes and cannot have objects created under them
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', drive.path)
+    try:
+        memfs.create('file', 'File2', file1.path)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+
+
+def test_deleted_object_has_no_path():
+    """
+    Once deleted, an object and its descendants no longer report a cached path
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    assert file1.path == 'Drive1\\Folder1\\File1'
+    memfs.delete(folder1.path)
+    for obj in (folder1, file1):
+        try:
+            obj.path
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == IllegalFileSystemOperation
+
+
+def test_write_bytes():
+    """
+    Files accept bytes content as well as text, and report its size in bytes
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', drive.path)
+    memfs.write_to_file(file1.path, b'\x00\x01\x02')
+    assert file1.content == b'\x00\x01\x02'
+    assert file1.size == 3
+    assert drive.size == 3
+
+    memfs.write_to_file(file1.path, bytearray(b'Hyperion'))
+    assert file1.content == b'Hyperion'
+    assert drive.size == 8
+
+    memfs.write_to_file(file1.path, 'Café')
+    assert file1.content == 'Café'
+    assert file1.data == 'Café'.encode('utf-8')
+    assert drive.size == 5
+
+
+def test_write_invalid_content():
+    """
+    Only text and bytes may be written to a file
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', drive.path)
+    try:
+        memfs.write_to_file(file1.path, 42)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == InvalidWriteException
+    assert file1.size == 0
+
+
+def test_zip_compresses_content():
+    """
+    Content beneath a zip is stored compressed, read back transparently,
+    and decompressed again when moved out of the zip
+
+        Drive1
+        |_Zip1
+          |_Folder1
+            |_File1
+    """
+    drive = memfs.create('drive', 'Drive1')
+    zip1 = memfs.create('zip', 'Zip1', drive.path)
+    folder1 = memfs.create('folder', 'Folder1', zip1.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    content = 'All work and no play makes Jack a dull boy. ' * 100
+    memfs.write_to_file(file1.path, content)
+    assert file1.size == len(content)
+    assert folder1.size == len(content)
+    assert file1.stored_size == len(zlib.compress(content.encode('utf-8')))
+    assert zip1.size == file1.stored_size
+    assert zip1.size < len(content) / 10
+    assert file1.content == content
+
+    memfs.move(folder1.path, "{}\\{}".format(drive.path, folder1.name))
+    assert file1.stored_size == len(content)
+    assert zip1.size == 0
+    assert drive.size == len(content)
+    assert file1.content == content
+
+
+def test_move_renames():
+    """
+    The last component of the destination path becomes the moved object's name
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    file1 = memfs.create('file', 'File1', drive.path)
+    memfs.move(file1.path, "{}\\{}".format(folder1.path, 'Renamed'))
+    assert file1.name == 'Renamed'
+    assert file1.path == 'Drive1\\Folder1\\Renamed'
+    assert folder1.get('Renamed') is file1
+
+
+def test_compact_objects():
+    """
+    Objects have no per-instance __dict__, and empty containers don't allocate a children dict
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    for obj in (drive, folder1, file1):
+        assert not hasattr(obj, '__dict__')
+    assert folder1._children is not None
+    memfs.delete(file1.path)
+    assert folder1._children is None
+    assert len(folder1.children) == 0
+    assert folder1.get('File1') is None
+
+
+def test_handles():
+    """
+    Objects can be given by handle instead of by path, and handles survive moves
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive)
+    folder2 = memfs.create('folder', 'Folder2', drive)
+    file1 = memfs.create('file', 'File1', folder1)
+    assert file1.path == 'Drive1\\Folder1\\File1'
+
+    memfs.move(folder1, 'Drive1\\Folder2\\Moved')
+    assert memfs.write_to_file(file1, 'Moved along') is file1
+    assert memfs.index._get_object('Drive1\\Folder2\\Moved\\File1').content == 'Moved along'
+    with memfs.open(file1) as stream:
+        assert stream.read() == 'Moved along'
+    assert folder2.size == len('Moved along')
+
+    memfs.delete(folder1)
+    assert folder2.size == 0
+    for operation in (lambda: memfs.write_to_file(file1, 'Gone'), lambda: memfs.delete(file1),
+                      lambda: memfs.create('file', 'File2', folder1)):
+        try:
+            operation()
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == PathNotFoundException
+
+    try:
+        memfs.delete(42)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+
+
+def test_move_into_descendant():
+    """
+    Objects cannot be moved beneath themselves
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive)
+    sub = memfs.create('folder', 'Sub', folder1)
+    memfs.create('folder', 'Folder1 copy', drive)
+    for dest in ('Drive1\\Folder1\\Sub\\Folder1', 'Drive1\\Folder1\\Folder1'):
+        try:
+            memfs.move(folder1, dest)
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == IllegalFileSystemOperation
+    assert sub.path == 'Drive1\\Folder1\\Sub'
+
+    # A sibling sharing the name as a prefix is not a descendant
+    memfs.move(folder1, 'Drive1\\Folder1 copy\\Folder1')
+    assert sub.path == 'Drive1\\Folder1 copy\\Folder1\\Sub'
+
+
+def test_is_ancestor():
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive)
+    folder12 = memfs.create('folder', 'Folder12', drive)
+    file1 = memfs.create('file', 'File1', folder1)
+    assert memfs.is_ancestor(drive, file1)
+    assert memfs.is_ancestor('Drive1\\Folder1', 'Drive1\\Folder1\\File1')
+    assert not memfs.is_ancestor(file1, folder1)
+    assert not memfs.is_ancestor(folder1, folder1)
+    assert not memfs.is_ancestor(folder12, file1)
+    memfs.move(file1, 'Drive1\\Folder12\\File1')
+    assert memfs.is_ancestor(folder12, file1)
+    assert not memfs.is_ancestor(folder1, file1)
+    try:
+        memfs.is_ancestor('Drive2', file1)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathNotFoundException
+
+
+def test_instances():
+    """
+    FileSystem instances are independent of each other and of the module-level file system
+    """
+    fs1 = memfs.FileSystem()
+    fs2 = memfs.FileSystem()
+    drive = fs1.create('drive', 'Drive1')
+    fs1.create('folder', 'Folder1', drive)
+    fs1.write_to_file(fs1.create('file', 'File1', 'Drive1\\Folder1'), 'The Hobbit')
+    fs2.create('drive', 'Drive1')
+    assert drive.size == 10
+    assert fs2.root.index['Drive1'].size == 0
+    assert [obj.path for obj in fs1.glob('Drive1\\**\\File1')] == ['Drive1\\Folder1\\File1']
+    assert list(fs2.glob('Drive1\\**\\File1')) == []
+    assert memfs.index._get_object('Drive1') is None
+
+    # Handles only belong to the file system they were created in
+    try:
+        fs2.create('folder', 'Folder1', drive)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+
+    with fs2.batch() as b:
+        b.create('folder', 'Folder2', 'Drive1')
+    fs1.move('Drive1\\Folder1', 'Drive1\\Folder2')
+    assert [obj.path for obj in fs1.find(type='folder')] == ['Drive1\\Folder2']
+    assert [obj.path for obj in fs2.find(type='folder')] == ['Drive1\\Folder2']
+
+
+def test_buffers():
+    """
+    Any bytes-like object can be written, and content can be read back as a memoryview without copying
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', drive)
+    data = b'The Silmarillion'
+    memfs.write_to_file(file1, data)
+    view = memfs.read_buffer(file1)
+    assert view.readonly
+    assert view.obj is data
+    assert view == data
+
+    memfs.write_from(file1, bytearray(b'The Hobbit'))
+    assert memfs.read_buffer(file1) == b'The Hobbit'
+    assert view == data
+    numbers = array.array('i', range(4))
+    memfs.write_from('Drive1\\File1', numbers)
+    assert file1.size == len(numbers.tobytes())
+    assert memfs.read_buffer(file1) == numbers.tobytes()
+    # Non-contiguous buffers are copied in order
+    memfs.write_from(file1, memoryview(b'0123456789')[::2])
+    assert file1.content == b'02468'
+    mapped = mmap.mmap(-1, 5)
+    mapped.write(b'mmap!')
+    memfs.write_from(file1, mapped)
+    mapped.close()
+    assert file1.content == b'mmap!'
+
+    # Content beneath a zip is decompressed
+    zip1 = memfs.create('zip', 'Zip1', drive)
+    file2 = memfs.create('file', 'File2', zip1)
+    memfs.write_from(file2, bytearray(b'compressed ' * 10))
+    assert memfs.read_buffer(file2) == b'compressed ' * 10
+    assert memfs.read_buffer(memfs.create('file', 'File3', drive)) is None
+
+    for target, content, exception in ((file1, 'text', InvalidWriteException),
+                                       (file1, 12, InvalidWriteException),
+                                       (drive, b'bytes', InvalidWriteException),
+                                       ('Drive1\\Missing', b'bytes', PathNotFoundException)):
+        try:
+            memfs.write_from(target, content)
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == exception
+    try:
+        memfs.read_buffer(drive)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == InvalidWriteException
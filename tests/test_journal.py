@@ -0,0 +1,138 @@
+import os
+import memfs
+from memfs import IllegalFileSystemOperation
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def teardown_function():
+    memfs.disable_journal()
+
+
+def _restart(directory, **kwargs):
+    """Simulates a process restart: the in-memory file system is lost and recovered from disk"""
+    memfs.disable_journal()
+    memfs.index._file_system.reset()
+    memfs.enable_journal(directory, **kwargs)
+    return memfs.index._file_system
+
+
+def test_recovery_replays_operations(tmp_path):
+    """
+    Every kind of operation applied after enabling the journal is recovered
+    """
+    directory = str(tmp_path)
+    memfs.create('drive', 'Drive1')
+    memfs.enable_journal(directory)
+    memfs.create('folder', 'Folder1', 'Drive1')
+    memfs.create('zip', 'Zip1', 'Drive1')
+    memfs.create('file', 'File1', 'Drive1\\Folder1')
+    memfs.create('file', 'File2', 'Drive1\\Folder1')
+    memfs.write_to_file('Drive1\\Folder1\\File1', 'Le Petit Prince')
+    memfs.write_to_file('Drive1\\Folder1\\File2', b'\x00\x01')
+    memfs.move('Drive1\\Folder1\\File2', 'Drive1\\Zip1\\Renamed')
+    with memfs.open('Drive1\\Folder1\\File1', 'r+') as stream:
+        stream.seek(3)
+        stream.write('Grand')
+        stream.append('!')
+    memfs.create('folder', 'Temp', 'Drive1')
+    memfs.delete('Drive1\\Temp')
+    with memfs.batch() as batch:
+        batch.create('file', 'File3', 'Drive1')
+        batch.write_to_file('Drive1\\File3', 'Batched')
+    sizes = (memfs.index._get_object('Drive1').size, memfs.index._get_object('Drive1').stored_size)
+
+    root = _restart(directory)
+    drive1 = root.get('Drive1')
+    assert sorted(drive1.children) == ['File3', 'Folder1', 'Zip1']
+    assert drive1.get('Folder1').get('File1').content == 'Le Grand Prince!'
+    assert drive1.get('Zip1').get('Renamed').content == b'\x00\x01'
+    assert drive1.get('File3').content == 'Batched'
+    assert (drive1.size, drive1.stored_size) == sizes
+    assert memfs.index._get_object('Drive1\\Zip1\\Renamed') is drive1.get('Zip1').get('Renamed')
+
+
+def test_rolled_back_batch_is_not_journaled(tmp_path):
+    """
+    A batch that fails leaves nothing behind in the journal
+    """
+    directory = str(tmp_path)
+    memfs.enable_journal(directory)
+    memfs.create('drive', 'Drive1')
+    try:
+        with memfs.batch() as batch:
+            batch.create('folder', 'Folder1', 'Drive1')
+            batch.create('folder', 'Folder1', 'Drive1')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == memfs.PathAlreadyExistsException
+    assert memfs.index._default._journal.record_count == 1
+
+    root = _restart(directory)
+    assert list(root.get('Drive1').children) == []
+
+
+def test_torn_record_is_discarded(tmp_path):
+    """
+    A record only partly written before a crash is dropped, along with nothing before it
+    """
+    directory = str(tmp_path)
+    memfs.enable_journal(directory)
+    memfs.create('drive', 'Drive1')
+    memfs.create('folder', 'Folder1', 'Drive1')
+    memfs.disable_journal()
+    journal_path = memfs.journal.Journal(directory).journal_path
+    intact_size = os.path.getsize(journal_path)
+    with open(journal_path, 'ab') as journal_file:
+        journal_file.write(b'\x40\x00\x00\x00\x00\x00')
+
+    root = _restart(directory)
+    assert list(root.get('Drive1').children) == ['Folder1']
+    assert os.path.getsize(journal_path) == intact_size
+    memfs.create('folder', 'Folder2', 'Drive1')
+
+    root = _restart(directory)
+    assert sorted(root.get('Drive1').children) == ['Folder1', 'Folder2']
+
+
+def test_compaction(tmp_path):
+    """
+    Once enough operations have been journaled, a new checkpoint replaces the previous generation
+    """
+    directory = str(tmp_path)
+    memfs.enable_journal(directory, compact_every=3)
+    assert sorted(os.listdir(directory)) == ['checkpoint.1.memfs', 'journal.1.log']
+    memfs.create('drive', 'Drive1')
+    memfs.create('folder', 'Folder1', 'Drive1')
+    memfs.create('file', 'File1', 'Drive1\\Folder1')
+    assert sorted(os.listdir(directory)) == ['checkpoint.2.memfs', 'journal.2.log']
+    assert os.path.getsize(os.path.join(directory, 'journal.2.log')) == 0
+    memfs.write_to_file('Drive1\\Folder1\\File1', 'Journaled after the checkpoint')
+
+    root = _restart(directory, compact_every=3)
+    assert root.get('Drive1').get('Folder1').get('File1').content == 'Journaled after the checkpoint'
+
+
+def test_synchronous_journal(tmp_path):
+    """
+    In synchronous mode, operations only return once their record has been fsynced
+    """
+    directory = str(tmp_path)
+    memfs.enable_journal(directory, synchronous=True, sync_interval=0.001)
+    memfs.create('drive', 'Drive1')
+    journal = memfs.index._default._journal
+    assert journal._synced_seq == journal._written_seq == 1
+
+
+def test_enable_twice(tmp_path):
+    """
+    Only one journal can be enabled at a time
+    """
+    memfs.enable_journal(str(tmp_path / 'first'))
+    try:
+        memfs.enable_journal(str(tmp_path / 'second'))
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
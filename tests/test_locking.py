@@ -0,0 +1,126 @@
+import threading
+import memfs
+from memfs.locking import ReadWriteLock
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+    memfs.set_thread_safe(True)
+
+
+def teardown_function():
+    memfs.set_thread_safe(False)
+
+
+def test_read_write_lock():
+    """
+    Readers share the lock, while a writer waits for them to finish
+    """
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    lock.acquire_read()
+    acquired = threading.Event()
+
+    def writer():
+        lock.acquire_write()
+        acquired.set()
+        lock.release_write()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert not acquired.wait(0.05)
+    lock.release_read()
+    lock.release_read()
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_concurrent_mutations():
+    """
+    Threads creating, writing, moving and deleting in overlapping subtrees, while other threads
+    move those subtrees up and down the tree, leave the sizes and the path index consistent
+    """
+    drive = memfs.create('drive', 'Drive1')
+    shared = memfs.create('folder', 'Shared', drive.path)
+    nest = memfs.create('folder', 'Nest', shared.path)
+    deeper = memfs.create('folder', 'Deeper', nest.path)
+    folders = [memfs.create('folder', 'Folder{}'.format(n), shared.path) for n in range(8)]
+    finished = threading.Barrier(8)
+    errors = []
+
+    def worker(n):
+        try:
+            folder = folders[n]
+            for i in range(50):
+                file = memfs.create('file', 'File{}'.format(i), folder)
+                memfs.write_to_file(file, 'x' * 10)
+                with memfs.open(file, 'a') as stream:
+                    stream.write('y' * 10)
+                if i % 2:
+                    memfs.delete(file)
+                # Move the next thread's folder between depths while that thread works inside it
+                neighbour = folders[(n + 1) % 8]
+                target = (nest, deeper, shared)[i % 3]
+                memfs.move(neighbour, '{}\\{}'.format(target.path, neighbour.name))
+            finished.wait()
+            memfs.move(folder, 'Drive1\\Moved{}'.format(n))
+        except Exception as e:  # pragma: no cover - surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert list(drive.get('Shared').children) == ['Nest']
+    assert list(nest.children) == ['Deeper']
+    assert len(deeper.children) == 0
+    assert drive.size == 8 * 25 * 20
+    assert len(memfs.index._file_system.index) == 1 + 3 + 8 * 26
+    for n in range(8):
+        moved = drive.get('Moved{}'.format(n))
+        assert moved.size == 25 * 20
+        assert moved.get('File0').path == 'Drive1\\Moved{}\\File0'.format(n)
+
+
+def test_concurrent_reads():
+    """
+    Reading a file's whole content while streams read it in pieces never mixes up its chunks
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file = memfs.create('file', 'File1', drive.path)
+    expected = b''.join(bytes([i]) * 100 for i in range(200))
+    errors = []
+
+    def reset():
+        memfs.write_to_file(file.path, b'')
+        with memfs.open(file.path, 'ab') as stream:
+            for i in range(200):
+                stream.write(bytes([i]) * 100)
+
+    def reader(n):
+        try:
+            for _ in range(20):
+                if n % 2:
+                    assert memfs.index._default.read_buffer(file.path) == expected
+                else:
+                    with memfs.open(file.path, 'rb') as stream:
+                        data = b''
+                        while len(data) < len(expected):
+                            data += stream.read(700)
+                    assert data == expected
+        except Exception as e:  # pragma: no cover - surfaced by the assertion below
+            errors.append(e)
+
+    for _ in range(5):
+        reset()
+        threads = [threading.Thread(target=reader, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+    # Readers never changed the chunks they read
+    assert len(file._chunks) == 201
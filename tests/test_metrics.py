@@ -0,0 +1,96 @@
+import memfs
+from memfs import PathNotFoundException, PathAlreadyExistsException
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+    memfs.set_metrics(True)
+
+
+def teardown_function():
+    memfs.set_metrics(False)
+
+
+def test_operation_counters():
+    """
+    Calls, failures, latencies, path depths and drives are counted per operation
+    """
+    drive = memfs.create('drive', 'Drive1')
+    memfs.create('folder', 'Folder1', drive)
+    memfs.create('file', 'File1', 'Drive1\\Folder1')
+    memfs.write_to_file('Drive1\\Folder1\\File1', 'Metrics')
+    for path in ('Drive1\\Folder1\\Missing', 'Drive2\\Missing'):
+        try:
+            memfs.write_to_file(path, 'Metrics')
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == PathNotFoundException
+    try:
+        memfs.create('folder', 'Folder1', 'Drive1')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathAlreadyExistsException
+
+    stats = memfs.stats()
+    create = stats['operations']['create']
+    assert create['calls'] == 4
+    assert create['errors'] == {'PathAlreadyExistsException': 1}
+    assert create['depths'] == {1: 2, 2: 1}
+    write = stats['operations']['write_to_file']
+    assert write['calls'] == 3
+    assert write['errors'] == {'PathNotFoundException': 2}
+    assert write['depths'] == {2: 1, 3: 2}
+    assert sum(write['latency_us'].values()) == 3
+    assert write['seconds'] > 0
+    assert stats['drives'] == {'Drive1': 5, 'Drive2': 1}
+    assert 'delete' not in stats['operations']
+
+
+def test_hooks():
+    """
+    Hooks are called around every instrumented operation, including failed ones
+    """
+    calls = []
+
+    def pre(operation, args, kwargs):
+        calls.append(('pre', operation, args))
+
+    def post(operation, args, kwargs, seconds, error):
+        calls.append(('post', operation, type(error).__name__ if error else None))
+    memfs.add_hook(pre=pre, post=post)
+    memfs.create('drive', 'Drive1')
+    try:
+        memfs.delete('Drive2')
+    except PathNotFoundException:
+        pass
+    with memfs.batch() as batch:
+        batch.create('folder', 'Folder1', 'Drive1')
+    assert calls == [
+        ('pre', 'create', ('drive', 'Drive1')),
+        ('post', 'create', None),
+        ('pre', 'delete', ('Drive2',)),
+        ('post', 'delete', 'PathNotFoundException'),
+        ('pre', 'batch', (batch,)),
+        ('post', 'batch', None),
+    ]
+
+    # Hooks are kept, but not called, while metrics are disabled
+    memfs.set_metrics(False)
+    memfs.create('folder', 'Folder2', 'Drive1')
+    assert len(calls) == 6
+    memfs.set_metrics(True)
+    memfs.remove_hook(pre=pre)
+    memfs.create('folder', 'Folder3', 'Drive1')
+    assert calls[6:] == [('post', 'create', None)]
+    memfs.remove_hook(post=post)
+
+
+def test_disabled():
+    """
+    Nothing is collected while metrics are disabled
+    """
+    memfs.set_metrics(False)
+    memfs.create('drive', 'Drive1')
+    assert memfs.stats() == {'operations': {}, 'drives': {}}
+    memfs.set_metrics(True)
+    assert memfs.stats() == {'operations': {}, 'drives': {}}
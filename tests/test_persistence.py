@@ -0,0 +1,147 @@
+import os
+import threading
+import memfs
+from memfs import IllegalFileSystemOperation, PathNotFoundException
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def _build():
+    """
+    Drive1
+    |_Folder1
+      |_File1
+      |_Empty
+    |_Zip1
+      |_Folder2
+        |_File2
+    Drive2
+    """
+    drive1 = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive1.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    memfs.create('file', 'Empty', folder1.path)
+    zip1 = memfs.create('zip', 'Zip1', drive1.path)
+    folder2 = memfs.create('folder', 'Folder2', zip1.path)
+    file2 = memfs.create('file', 'File2', folder2.path)
+    memfs.create('drive', 'Drive2')
+    memfs.write_to_file(file1.path, 'Le Petit Prince')
+    with memfs.open(file2.path, 'ab') as stream:
+        stream.write(b'\x00' * 500)
+        stream.write(b'\x01' * 500)
+    return drive1, zip1
+
+
+def test_save_and_load(tmp_path):
+    """
+    A saved file system is restored with the same hierarchy, sizes and content
+    """
+    drive1, zip1 = _build()
+    sizes = (drive1.size, drive1.stored_size, zip1.size)
+    path = str(tmp_path / 'fs.memfs')
+    memfs.save(path)
+    memfs.index._file_system.reset()
+
+    memfs.load(path)
+    root = memfs.index._file_system
+    assert sorted(root.children) == ['Drive1', 'Drive2']
+    drive1 = root.get('Drive1')
+    zip1 = drive1.get('Zip1')
+    assert (drive1.size, drive1.stored_size, zip1.size) == sizes
+    file1 = drive1.get('Folder1').get('File1')
+    assert file1.path == 'Drive1\\Folder1\\File1'
+    assert type(file1._chunks[0]) is memoryview  # Not read yet
+    assert file1.content == 'Le Petit Prince'
+    assert type(file1._chunks[0]) is bytes
+    assert drive1.get('Folder1').get('Empty').content is None
+    assert zip1.get('Folder2').get('File2').data == b'\x00' * 500 + b'\x01' * 500
+
+    # The loaded file system behaves like any other
+    memfs.write_to_file('Drive1\\Zip1\\Folder2\\File2', 'Vol de nuit')
+    memfs.move('Drive1\\Folder1', 'Drive2\\Folder1')
+    assert root.get('Drive2').size == 15
+    memfs.save(path)
+    memfs.load(path)
+    assert memfs.index._get_object('Drive2\\Folder1\\File1').content == 'Le Petit Prince'
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_load_invalid_file(tmp_path):
+    """
+    Loading a file that wasn't written by save fails
+    """
+    path = tmp_path / 'not-memfs'
+    path.write_bytes(b'Terre des hommes' * 4)
+    try:
+        memfs.load(str(path))
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+
+
+def test_load_replaces_objects(tmp_path):
+    """
+    Objects replaced by a load are detached: snapshots keep seeing them, handles to them are
+    reported as deleted, and writes through streams opened on them don't affect the loaded tree
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', drive.path)
+    memfs.write_to_file(file1.path, 'Citadelle')
+    path = str(tmp_path / 'fs.memfs')
+    memfs.save(path)
+
+    memfs.write_to_file(file1.path, 'Courrier sud')
+    snapshot = memfs.snapshot()
+    stream = memfs.open(file1.path, 'a')
+    memfs.load(path)
+    stream.write(' and more')
+    stream.close()
+
+    root = memfs.index._file_system
+    assert root.size == len('Citadelle')
+    assert memfs.index._get_object('Drive1\\File1').content == 'Citadelle'
+    assert snapshot.get('Drive1\\File1').content == 'Courrier sud'
+    assert snapshot.size == len('Courrier sud')
+    try:
+        memfs.write_to_file(file1, 'Pilote de guerre')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathNotFoundException
+    snapshot.release()
+
+
+def test_save_excludes_writers(tmp_path):
+    """
+    In thread-safe mode, a save waits for writes in progress and keeps new writes out until it is
+    done, so that it saves a consistent file system
+    """
+    memfs.set_thread_safe(True)
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', memfs.create('folder', 'Folder1', drive.path).path)
+    saving = threading.Event()
+    written = threading.Event()
+    save = memfs.persistence.save
+
+    def writer():
+        saving.wait()
+        memfs.write_to_file(file1, 'Vol de nuit')
+        written.set()
+
+    def slow_save(root, path):
+        saving.set()
+        assert not written.wait(0.2)
+        save(root, path)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    memfs.persistence.save = slow_save
+    try:
+        memfs.save(str(tmp_path / 'fs.memfs'))
+    finally:
+        memfs.persistence.save = save
+        thread.join()
+        memfs.set_thread_safe(False)
+    assert written.is_set()
+    assert file1.content == 'Vol de nuit'
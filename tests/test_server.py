@@ -0,0 +1,107 @@
+import threading
+import memfs
+from memfs import IllegalFileSystemOperation, InvalidWriteException, PathAlreadyExistsException, PathNotFoundException
+from memfs.server import Server
+
+server = None
+
+
+def setup_function():
+    global server
+    memfs.index._file_system.reset()
+    server = Server(memfs.FileSystem())
+    server.start_in_thread(('127.0.0.1', 0))
+
+
+def teardown_function():
+    server.stop()
+
+
+def test_client_operations():
+    with memfs.Client(server.address) as client:
+        assert client.create('drive', 'Drive1') == 'Drive1'
+        assert client.create('folder', 'Folder1', 'Drive1') == 'Drive1\\Folder1'
+        assert client.create('file', 'File1', 'Drive1\\Folder1') == 'Drive1\\Folder1\\File1'
+        assert client.read('Drive1\\Folder1\\File1') is None
+        assert client.write_to_file('Drive1\\Folder1\\File1', 'The Hobbit') == 'Drive1\\Folder1\\File1'
+        assert client.read('Drive1\\Folder1\\File1') == 'The Hobbit'
+        client.create('file', 'File2', 'Drive1')
+        client.write_to_file('Drive1\\File2', bytearray(b'\x00\x01\x02'))
+        assert client.read('Drive1\\File2') == b'\x00\x01\x02'
+        assert client.size('Drive1') == 13
+        assert client.size('') == 13
+        assert client.move('Drive1\\File2', 'Drive1\\Folder1\\File2') == 'Drive1\\Folder1\\File2'
+        assert sorted(client.children('Drive1\\Folder1')) == ['File1', 'File2']
+        assert client.glob('Drive1\\**\\File2') == ['Drive1\\Folder1\\File2']
+        assert client.exists('Drive1\\Folder1')
+        client.delete('Drive1\\Folder1')
+        assert not client.exists('Drive1\\Folder1')
+        assert client.size('Drive1') == 0
+        # The module-level file system is not the one served
+        assert memfs.index._get_object('Drive1') is None
+
+        # Errors are raised again on the client, which stays usable
+        for call, exception in ((lambda: client.create('drive', 'Drive1'), PathAlreadyExistsException),
+                                (lambda: client.read('Drive1\\Missing'), PathNotFoundException),
+                                (lambda: client.write_to_file('Drive1', 'Text'), InvalidWriteException),
+                                (lambda: client.children('Missing'), PathNotFoundException),
+                                (lambda: client.create('folder', 'Folder1'), IllegalFileSystemOperation)):
+            try:
+                call()
+                assert True == False  # Should not get here
+            except Exception as e:
+                assert type(e) == exception
+        assert client.exists('Drive1')
+
+
+def test_pipeline():
+    with memfs.Client(server.address) as client:
+        with client.pipeline() as pipeline:
+            pipeline.create('drive', 'Drive1')
+            for i in range(500):
+                pipeline.create('file', 'File{}'.format(i), 'Drive1')
+                pipeline.write_to_file('Drive1\\File{}'.format(i), 'x' * i)
+            pipeline.size('Drive1')
+        assert len(pipeline.results) == 1002
+        assert pipeline.results[1] == 'Drive1\\File0'
+        assert pipeline.results[-1] == sum(range(500))
+
+        # Every call is applied, and the first error is raised afterwards
+        pipeline = client.pipeline()
+        pipeline.delete('Drive1\\File0')
+        pipeline.delete('Drive1\\Missing')
+        pipeline.read('Drive1\\File1')
+        try:
+            pipeline.execute()
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == PathNotFoundException
+        assert pipeline.results[0] is None
+        assert type(pipeline.results[1]) == PathNotFoundException
+        assert pipeline.results[2] == 'x'
+
+
+def test_pooled_threads(tmp_path):
+    """
+    Threads share a pool of connections, here over a Unix socket
+    """
+    unix_server = Server(memfs.FileSystem())
+    unix_server.start_in_thread(str(tmp_path / 'memfs.sock'))
+    try:
+        with memfs.Client(unix_server.address, pool_size=2) as client:
+            client.create('drive', 'Drive1')
+
+            def fill(thread):
+                folder = client.create('folder', 'Folder{}'.format(thread), 'Drive1')
+                for i in range(50):
+                    client.write_to_file(client.create('file', 'File{}'.format(i), folder), 'x')
+
+            threads = [threading.Thread(target=fill, args=(thread,)) for thread in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert client.size('Drive1') == 300
+            assert client._idle.qsize() <= 2
+    finally:
+        unix_server.stop()
@@ -0,0 +1,86 @@
+import threading
+import memfs
+from memfs import IllegalFileSystemOperation, PathAlreadyExistsException, PathNotFoundException
+
+shards = None
+
+
+def setup_module():
+    global shards
+    shards = memfs.ShardedFileSystem(shards=2)
+
+
+def teardown_module():
+    shards.close()
+
+
+def _drives_in_distinct_shards():
+    """Returns two drive names that are placed in different shards"""
+    names = ['Tenant{}'.format(i) for i in range(10)]
+    first = names[0]
+    second = next(name for name in names if shards.shard_of(name) != shards.shard_of(first))
+    return first, second
+
+
+def test_sharded_operations():
+    first, second = _drives_in_distinct_shards()
+    for drive in (first, second):
+        assert shards.create('drive', drive) == drive
+        assert shards.create('folder', 'Folder1', drive) == '{}\\Folder1'.format(drive)
+        shards.create('file', 'File1', '{}\\Folder1'.format(drive))
+    shards.write_to_file('{}\\Folder1\\File1'.format(first), 'The Hobbit')
+    shards.write_to_file('{}\\Folder1\\File1'.format(second), b'\x00\x01')
+    assert shards.read('{}\\Folder1\\File1'.format(first)) == 'The Hobbit'
+    assert shards.read('{}\\Folder1\\File1'.format(second)) == b'\x00\x01'
+    assert shards.size(first) == 10
+    assert shards.size(second) == 2
+
+    # Moves within a drive behave as usual
+    assert shards.move('{}\\Folder1\\File1'.format(first), '{}\\File2'.format(first)) == '{}\\File2'.format(first)
+    assert sorted(shards.children(first)) == ['File2', 'Folder1']
+    assert sorted(shards.glob('*\\Folder1\\File1')) == ['{}\\Folder1\\File1'.format(second)]
+    assert sorted(shards.glob('{}\\*'.format(first))) == ['{}\\File2'.format(first), '{}\\Folder1'.format(first)]
+    assert sorted(shards.query(type='drive')) == sorted([first, second])
+
+    # Errors raised in the workers are raised to the caller
+    try:
+        shards.create('drive', first)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathAlreadyExistsException
+    try:
+        shards.read('{}\\Missing'.format(second))
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathNotFoundException
+    try:
+        shards.move('{}\\File2'.format(first), '{}\\File2'.format(second))
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+
+    shards.delete(first)
+    shards.delete(second)
+    assert shards.query(type='drive') == []
+
+
+def test_sharded_threads():
+    """
+    Threads can drive the shards concurrently
+    """
+    first, second = _drives_in_distinct_shards()
+
+    def fill(drive):
+        shards.create('drive', drive)
+        for i in range(50):
+            shards.write_to_file(shards.create('file', 'File{}'.format(i), drive), 'x' * i)
+
+    threads = [threading.Thread(target=fill, args=(drive,)) for drive in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert shards.size(first) == shards.size(second) == sum(range(50))
+    assert len(shards.query(type='file')) == 100
+    shards.delete(first)
+    shards.delete(second)
@@ -0,0 +1,102 @@
+import memfs
+from memfs.snapshot import _versions
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def test_snapshot_is_isolated_from_later_writes():
+    """
+    A snapshot keeps showing the hierarchy as it was when it was taken
+
+        Drive1
+        |_Folder1
+          |_File1
+        |_Zip1
+          |_File2
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    zip1 = memfs.create('zip', 'Zip1', drive.path)
+    file2 = memfs.create('file', 'File2', zip1.path)
+    memfs.write_to_file(file1.path, 'Solaris')
+    memfs.write_to_file(file2.path, 'Roadside Picnic')
+    drive_size = drive.size
+
+    snapshot = memfs.snapshot()
+    memfs.write_to_file(file1.path, 'The Invincible')
+    with memfs.open(file2.path, 'a') as stream:
+        stream.write(' and more')
+    memfs.move(file1.path, "{}\\{}".format(zip1.path, 'Moved'))
+    memfs.create('folder', 'Folder2', drive.path)
+    memfs.delete(folder1.path)
+
+    assert snapshot.get('Drive1').size == drive_size
+    assert sorted(snapshot.get('Drive1').children) == ['Folder1', 'Zip1']
+    old_file1 = snapshot.get('Drive1\\Folder1\\File1')
+    assert old_file1.content == 'Solaris'
+    assert old_file1.path == 'Drive1\\Folder1\\File1'
+    assert snapshot.get('Drive1\\Zip1\\File2').content == 'Roadside Picnic'
+    assert snapshot.get('Drive1\\Zip1\\Moved') is None
+    assert snapshot.get('Drive1\\Folder2') is None
+
+    # The live tree reflects every change
+    assert sorted(drive.children) == ['Folder2', 'Zip1']
+    assert file1.content == 'The Invincible'
+    assert file2.content == 'Roadside Picnic and more'
+
+
+def test_unchanged_objects_are_shared():
+    """
+    Objects that don't change after a snapshot is taken are not copied
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive.path)
+    folder2 = memfs.create('folder', 'Folder2', drive.path)
+    file1 = memfs.create('file', 'File1', folder1.path)
+    memfs.create('file', 'File2', folder2.path)
+
+    with memfs.snapshot() as snapshot:
+        memfs.write_to_file(file1.path, 'Ubik')
+        assert folder2._history is None
+        assert folder2.get('File2')._history is None
+        assert len(folder1._history) == 1
+        assert len(drive._history) == 1
+        assert snapshot.get('Drive1\\Folder1\\File1').content is None
+
+    # Once released, the recorded states are dropped and no further states are preserved
+    assert folder1._history is None
+    assert drive._history is None
+    memfs.write_to_file(file1.path, 'Valis')
+    assert file1._history is None
+
+
+def test_release_drops_recorded_states():
+    """
+    Releasing a snapshot drops the states only it could see, while other live snapshots keep theirs
+    """
+    drive = memfs.create('drive', 'Drive1')
+    file1 = memfs.create('file', 'File1', drive.path)
+    file2 = memfs.create('file', 'File2', drive.path)
+    memfs.write_to_file(file1.path, 'Stalker')
+    memfs.write_to_file(file2.path, 'Mirror')
+
+    first = memfs.snapshot()
+    memfs.write_to_file(file1.path, 'Nostalghia')
+    second = memfs.snapshot()
+    memfs.write_to_file(file2.path, 'Sacrifice')
+    assert len(file1._history) == 1
+    assert len(file2._history) == 1
+
+    # Only the first snapshot sees File1's first content
+    first.release()
+    assert file1._history is None
+    assert second.get('Drive1\\File1').content == 'Nostalghia'
+    assert second.get('Drive1\\File2').content == 'Mirror'
+
+    second.release()
+    assert file2._history is None
+    assert drive._history is None
+    assert _versions.preserved == set()
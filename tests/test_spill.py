@@ -0,0 +1,157 @@
+import gc
+import os
+import memfs
+from memfs.spill import spill_store
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def teardown_function():
+    memfs.set_memory_budget(None)
+
+
+def _build(count, size):
+    drive = memfs.create('drive', 'Drive1')
+    files = []
+    for i in range(count):
+        files.append(memfs.create('file', 'File{}'.format(i), drive))
+        memfs.write_to_file(files[-1], str(i) * size)
+    return drive, files
+
+
+def _spilled(file):
+    return all(type(chunk) is memoryview for chunk in file._chunks)
+
+
+def test_cold_content_is_spilled(tmp_path):
+    """
+    The least recently used content is spilled once the budget is exceeded, without changing sizes
+    """
+    memfs.set_memory_budget(2500, str(tmp_path))
+    drive, files = _build(5, 1000)
+    assert [_spilled(file) for file in files] == [True, True, True, False, False]
+    assert spill_store.resident_size == 2000
+    assert len(os.listdir(str(tmp_path))) == 1
+    assert drive.size == 5000
+    assert [file.size for file in files] == [1000] * 5
+    assert files[0].path == 'Drive1\\File0'
+
+    # Reading spilled content pages it back in, and spills the coldest file in turn
+    assert files[0].content == '0' * 1000
+    assert not _spilled(files[0])
+    assert _spilled(files[3])
+    assert [file.content for file in files] == [str(i) * 1000 for i in range(5)]
+    assert drive.size == 5000
+
+
+def test_recently_read_content_stays(tmp_path):
+    memfs.set_memory_budget(2500, str(tmp_path))
+    _, files = _build(2, 1000)
+    files[0].content
+    memfs.write_to_file(memfs.create('file', 'File2', 'Drive1'), 'x' * 1000)
+    assert not _spilled(files[0])
+    assert _spilled(files[1])
+
+
+def test_spilled_content_changes(tmp_path):
+    """
+    Spilled content can be appended to, overwritten, moved into a zip and saved
+    """
+    memfs.set_memory_budget(1500, str(tmp_path))
+    drive, files = _build(3, 1000)
+    with memfs.open(files[0], 'a') as stream:
+        stream.write('!')
+    assert files[0].content == '0' * 1000 + '!'
+    zip1 = memfs.create('zip', 'Zip1', drive)
+    memfs.move(files[1], 'Drive1\\Zip1\\File1')
+    memfs.write_to_file(files[2], 'Small')
+    assert files[1].content == '1' * 1000
+    assert zip1.size == files[1].stored_size
+    assert drive.size == 1001 + zip1.size + 5
+
+    path = str(tmp_path / 'saved.memfs')
+    memfs.save(path)
+    memfs.set_memory_budget(None)
+    memfs.load(path)
+    assert memfs.index._get_object('Drive1\\File0').content == '0' * 1000 + '!'
+    assert memfs.index._get_object('Drive1\\Zip1\\File1').content == '1' * 1000
+
+
+def test_segments_are_removed(tmp_path):
+    """
+    Segment files are removed once none of their content is in use
+    """
+    directory = tmp_path / 'spill'
+    directory.mkdir()
+    memfs.set_memory_budget(0, str(directory))
+    _build(3, 1000)
+    assert len(os.listdir(str(directory))) == 1
+    memfs.delete('Drive1')
+    memfs.set_memory_budget(None)
+    gc.collect()
+    assert os.listdir(str(directory)) == []
+
+
+def test_enable_on_existing_content(tmp_path):
+    _, files = _build(3, 1000)
+    memfs.set_memory_budget(1000, str(tmp_path))
+    assert sum(_spilled(file) for file in files) == 2
+    assert spill_store.resident_size == 1000
+
+
+def test_rolled_back_batch(tmp_path):
+    """
+    Rolling back a batch stops tracking the files it created, and tracks the files it deleted again
+    """
+    memfs.set_memory_budget(5000, str(tmp_path))
+    drive, files = _build(2, 1000)
+    try:
+        with memfs.batch() as b:
+            b.create('file', 'New', 'Drive1')
+            b.write_to_file('Drive1\\New', 'n' * 1000)
+            b.delete(files[0].path)
+            b.delete('Drive1\\Missing')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == memfs.PathNotFoundException
+    assert list(spill_store._resident) == [files[1], files[0]]
+    assert spill_store.resident_size == 2000
+
+    # The restored file is spilled like any other
+    memfs.set_memory_budget(1000, str(tmp_path))
+    memfs.write_to_file(files[0], '0' * 1000)
+    assert _spilled(files[1])
+    assert spill_store.resident_size == 1000
+
+
+def test_failed_import(tmp_path, monkeypatch):
+    """
+    Files read by an import that fails are not counted against the memory budget
+    """
+    memfs.set_memory_budget(5000, str(tmp_path / 'spill'))
+    drive, files = _build(2, 1000)
+    source = tmp_path / 'Source'
+    (source / 'New').mkdir(parents=True)
+    for i in range(3):
+        (source / 'New' / 'File{}'.format(i)).write_bytes(b'n' * 1000)
+
+    # A clash found before the source is read, and one found once it has been
+    memfs.create('folder', 'New', drive)
+    read_file = memfs.transfer._read_file
+
+    def read_and_clash(path):
+        if drive.get('New') is None:
+            memfs.create('folder', 'New', drive)
+        return read_file(path)
+    for _ in range(2):
+        try:
+            memfs.import_tree(str(source), drive, workers=1)
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == memfs.PathAlreadyExistsException
+        assert list(spill_store._resident) == files
+        assert spill_store.resident_size == 2000
+        memfs.delete('Drive1\\New')
+        monkeypatch.setattr(memfs.transfer, '_read_file', read_and_clash)
@@ -0,0 +1,144 @@
+import memfs
+from memfs import IllegalFileSystemOperation, PathNotFoundException, InvalidWriteException
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def _create_file():
+    drive = memfs.create('drive', 'Drive1')
+    return drive, memfs.create('file', 'File1', drive.path)
+
+
+def test_append_and_read_chunks():
+    """
+    Content appended through a stream is stored chunk by chunk and can be read back in pieces
+    """
+    drive, file1 = _create_file()
+    with memfs.open(file1.path, 'a') as stream:
+        stream.write('The Hobbit')
+        stream.append(', or There')
+        stream.write(' and Back Again')
+    assert file1.content == 'The Hobbit, or There and Back Again'
+    assert file1.size == 35
+    assert drive.size == 35
+
+    with memfs.open(file1.path, 'rb') as stream:
+        assert stream.read(3) == b'The'
+        stream.seek(4)
+        assert stream.read(6) == b'Hobbit'
+        assert stream.tell() == 10
+        assert b''.join(stream) == b', or There and Back Again'
+
+
+def test_overwrite_at_position():
+    """
+    Writing after seeking overwrites the existing bytes and extends the file if needed
+    """
+    drive, file1 = _create_file()
+    memfs.write_to_file(file1.path, b'abcdef')
+    with memfs.open(file1.path, 'r+b') as stream:
+        stream.seek(4)
+        stream.write(b'XYZ')
+        stream.seek(0)
+        assert stream.read() == b'abcdXYZ'
+    assert drive.size == 7
+
+
+def test_write_mode_truncates():
+    """
+    Opening a file for writing replaces its content
+    """
+    drive, file1 = _create_file()
+    memfs.write_to_file(file1.path, 'Neuromancer')
+    with memfs.open(file1.path, 'w') as stream:
+        stream.write('Count Zero')
+    assert file1.content == 'Count Zero'
+    assert drive.size == 10
+
+
+def test_text_read_across_chunks():
+    """
+    Multi-byte characters split across chunk boundaries are decoded correctly
+    """
+    _, file1 = _create_file()
+    encoded = 'Ñandú'.encode('utf-8')
+    with memfs.open(file1.path, 'ab') as stream:
+        for i in range(len(encoded)):
+            stream.write(encoded[i:i + 1])
+    with memfs.open(file1.path) as stream:
+        assert ''.join(stream) == 'Ñandú'
+
+
+def test_invalid_stream_operations():
+    """
+    Streams enforce their mode, and only existing files can be opened
+    """
+    drive, file1 = _create_file()
+    for path, mode, error in [
+        ("{}\\{}".format(drive.path, 'FakeFile'), 'r', PathNotFoundException),
+        (drive.path, 'r', InvalidWriteException),
+        (file1.path, 'x', IllegalFileSystemOperation),
+    ]:
+        try:
+            memfs.open(path, mode)
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == error
+
+    stream = memfs.open(file1.path, 'r')
+    try:
+        stream.write('Foundation')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+    assert file1.content is None
+
+
+def test_stream_inside_zip():
+    """
+    Streams read and append compressed content beneath a zip transparently
+    """
+    drive = memfs.create('drive', 'Drive1')
+    zip1 = memfs.create('zip', 'Zip1', drive.path)
+    file1 = memfs.create('file', 'File1', zip1.path)
+    with memfs.open(file1.path, 'ab') as stream:
+        stream.write(b'a' * 1000)
+        stream.write(b'b' * 1000)
+    assert file1.size == 2000
+    assert zip1.size == file1.stored_size < 2000
+    with memfs.open(file1.path, 'rb') as stream:
+        stream.seek(995)
+        assert stream.read(10) == b'aaaaabbbbb'
+
+
+def test_partial_read_inside_zip():
+    """
+    Reading part of a large compressed file only decompresses the blocks covering it
+    """
+    drive = memfs.create('drive', 'Drive1')
+    zip1 = memfs.create('zip', 'Zip1', drive.path)
+    file1 = memfs.create('file', 'File1', zip1.path)
+    block_size = memfs.compression.BLOCK_SIZE
+    content = b''.join(bytes([i]) * block_size for i in range(10))
+    memfs.write_to_file(file1.path, content)
+    assert len(file1._chunks) == 10
+    assert file1.stored_size == sum(len(chunk) for chunk in file1._chunks)
+
+    decompressed = []
+    decompress = memfs.filesystem.decompress
+    memfs.filesystem.decompress = lambda data: decompressed.append(data) or decompress(data)
+    try:
+        with memfs.open(file1.path, 'rb') as stream:
+            stream.seek(3 * block_size - 5)
+            assert stream.read(10) == b'\x02' * 5 + b'\x03' * 5
+    finally:
+        memfs.filesystem.decompress = decompress
+    assert len(decompressed) == 2
+
+    # Appends are split into blocks too, and the whole content is still read back
+    with memfs.open(file1.path, 'ab') as stream:
+        stream.write(b'\x0a' * (block_size + 1))
+    assert len(file1._chunks) == 12
+    assert file1.data == content + b'\x0a' * (block_size + 1)
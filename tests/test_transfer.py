@@ -0,0 +1,127 @@
+import os
+import tarfile
+import zipfile
+import memfs
+from memfs import IllegalFileSystemOperation, PathAlreadyExistsException
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def _make_source(directory):
+    """
+    Creates the following directory on disk:
+
+    Source
+        Folder1
+            File1 ('The Hobbit')
+            Empty
+        File2 ('The Silmarillion')
+        Archive.zip
+            Inner/File3 ('Unfinished Tales')
+    """
+    source = directory / 'Source'
+    (source / 'Folder1' / 'Empty').mkdir(parents=True)
+    (source / 'Folder1' / 'File1').write_bytes(b'The Hobbit')
+    (source / 'File2').write_bytes(b'The Silmarillion')
+    with zipfile.ZipFile(str(source / 'Archive.zip'), 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('Inner/File3', b'Unfinished Tales')
+    return str(source)
+
+
+def _tree(obj):
+    """Returns the subtree beneath the given container as nested dicts of types and contents"""
+    return {name: (child.type.value, child.content if child.type == 'file' else _tree(child))
+            for name, child in obj.children.items()}
+
+
+EXPECTED = {
+    'Folder1': ('folder', {'File1': ('file', b'The Hobbit'), 'Empty': ('folder', {})}),
+    'File2': ('file', b'The Silmarillion'),
+    'Archive.zip': ('zip', {'Inner': ('folder', {'File3': ('file', b'Unfinished Tales')})}),
+}
+
+
+def test_import_directory(tmp_path):
+    source = _make_source(tmp_path)
+    drive = memfs.create('drive', 'Drive1')
+    imported = memfs.import_tree(source, drive, workers=2)
+    assert sorted(obj.path for obj in imported) == ['Drive1\\Archive.zip', 'Drive1\\File2', 'Drive1\\Folder1']
+    assert _tree(drive) == EXPECTED
+    assert memfs.index._get_object('Drive1\\Archive.zip\\Inner\\File3').content == b'Unfinished Tales'
+    archive = memfs.index._get_object('Drive1\\Archive.zip')
+    assert drive.size == len('The Hobbit') + len('The Silmarillion') + archive.size
+    assert archive.size < len('Unfinished Tales') + 10
+
+    # Imported objects behave like any other
+    memfs.move('Drive1\\Folder1\\File1', 'Drive1\\Archive.zip\\File1')
+    assert memfs.index._get_object('Drive1\\Archive.zip\\File1').content == b'The Hobbit'
+
+    # Nothing is imported if a top-level object already exists
+    folder = memfs.create('folder', 'Text', drive)
+    memfs.import_tree(source, folder, text=True, zips=False)
+    assert memfs.index._get_object('Drive1\\Text\\File2').content == 'The Silmarillion'
+    assert memfs.index._get_object('Drive1\\Text\\Archive.zip').type == 'file'
+    size = drive.size
+    try:
+        memfs.import_tree(source, folder)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathAlreadyExistsException
+    assert drive.size == size
+    try:
+        memfs.import_tree(os.path.join(source, 'File2'), drive)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+
+
+def test_export_round_trip(tmp_path):
+    source = _make_source(tmp_path)
+    drive = memfs.create('drive', 'Drive1')
+    memfs.import_tree(source, drive)
+
+    for target in ('Exported', 'Exported.zip', 'Exported.tar.gz'):
+        memfs.export_tree(drive, str(tmp_path / target))
+        copy = memfs.create('drive', 'Copy')
+        memfs.import_tree(str(tmp_path / target), copy)
+        assert _tree(copy) == EXPECTED
+        memfs.delete(copy)
+
+    # Zip objects are exported as real zip archives
+    assert zipfile.is_zipfile(str(tmp_path / 'Exported' / 'Archive.zip'))
+    with tarfile.open(str(tmp_path / 'Exported.tar.gz')) as archive:
+        assert sorted(archive.getnames()) == ['Archive.zip', 'File2', 'Folder1', 'Folder1/Empty', 'Folder1/File1']
+    assert (tmp_path / 'Exported' / 'Folder1' / 'File1').read_bytes() == b'The Hobbit'
+
+
+def test_export_rejects_unsafe_names(tmp_path):
+    """
+    Names that would write outside the target are rejected before anything is written
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder = memfs.create('folder', 'Folder1', drive)
+    memfs.write_to_file(memfs.create('file', 'File1', folder), b'Beren and Luthien')
+    out = tmp_path / 'out'
+    out.mkdir()
+    for name in ('../escaped.txt', '..', '.', '/absolute', 'nested/name'):
+        escaped = memfs.create('file', name, folder)
+        for target in ('target', 'target.zip', 'target.tar'):
+            try:
+                memfs.export_tree(folder, str(out / target))
+                assert True == False  # Should not get here
+            except Exception as e:
+                assert type(e) == IllegalFileSystemOperation
+        memfs.delete(escaped)
+    assert os.listdir(str(out)) == []
+
+    # Names beneath a Zip are checked too
+    zip_object = memfs.create('zip', 'Zip1', folder)
+    memfs.create('file', '..', zip_object)
+    try:
+        memfs.export_tree(drive, str(out / 'target'))
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
+    assert os.listdir(str(out)) == []
@@ -0,0 +1,186 @@
+import memfs
+from memfs import IllegalFileSystemOperation, PathNotFoundException
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+    _build()
+
+
+def _build():
+    """
+    Drive1
+    |_Folder1
+      |_a.txt
+      |_b.log
+      |_Sub
+        |_c.txt
+    |_Zip1
+      |_d.txt
+    Drive2
+    |_e.txt
+    """
+    memfs.create('drive', 'Drive1')
+    memfs.create('folder', 'Folder1', 'Drive1')
+    memfs.create('file', 'a.txt', 'Drive1\\Folder1')
+    memfs.create('file', 'b.log', 'Drive1\\Folder1')
+    memfs.create('folder', 'Sub', 'Drive1\\Folder1')
+    memfs.create('file', 'c.txt', 'Drive1\\Folder1\\Sub')
+    memfs.create('zip', 'Zip1', 'Drive1')
+    memfs.create('file', 'd.txt', 'Drive1\\Zip1')
+    memfs.create('drive', 'Drive2')
+    memfs.create('file', 'e.txt', 'Drive2')
+    memfs.write_to_file('Drive1\\Folder1\\a.txt', 'a' * 10)
+    memfs.write_to_file('Drive1\\Folder1\\Sub\\c.txt', 'c' * 100)
+
+
+def _paths(objects):
+    return sorted(obj.path for obj in objects)
+
+
+def test_walk():
+    """
+    Walk yields every container with the names of its children, lazily
+    """
+    walker = memfs.walk()
+    assert next(walker) == ('', ['Drive1', 'Drive2'], [])
+    assert list(walker) == [
+        ('Drive1', ['Folder1', 'Zip1'], []),
+        ('Drive1\\Folder1', ['Sub'], ['a.txt', 'b.log']),
+        ('Drive1\\Folder1\\Sub', [], ['c.txt']),
+        ('Drive1\\Zip1', [], ['d.txt']),
+        ('Drive2', [], ['e.txt']),
+    ]
+    bottom_up = [path for path, _, _ in memfs.walk('Drive1', topdown=False)]
+    assert bottom_up == ['Drive1\\Folder1\\Sub', 'Drive1\\Folder1', 'Drive1\\Zip1', 'Drive1']
+
+
+def test_walk_pruning():
+    """
+    Removing container names while walking top-down skips those containers
+    """
+    visited = []
+    for path, containers, _ in memfs.walk('Drive1'):
+        visited.append(path)
+        if 'Folder1' in containers:
+            containers.remove('Folder1')
+    assert visited == ['Drive1', 'Drive1\\Zip1']
+
+
+def test_walk_invalid_path():
+    for path, exception in (('Drive3', PathNotFoundException), ('Drive2\\e.txt', IllegalFileSystemOperation)):
+        try:
+            next(memfs.walk(path))
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == exception
+
+
+def test_glob():
+    """
+    Glob matches patterns component by component, with '**' spanning any number of components
+    """
+    assert _paths(memfs.glob('Drive1\\Folder1\\*.txt')) == ['Drive1\\Folder1\\a.txt']
+    assert _paths(memfs.glob('Drive1\\Folder1\\?.*')) == ['Drive1\\Folder1\\a.txt', 'Drive1\\Folder1\\b.log']
+    assert _paths(memfs.glob('*\\*.txt')) == ['Drive2\\e.txt']
+    assert _paths(memfs.glob('Drive1\\**\\*.txt')) == [
+        'Drive1\\Folder1\\Sub\\c.txt', 'Drive1\\Folder1\\a.txt', 'Drive1\\Zip1\\d.txt']
+    assert _paths(memfs.glob('**\\**\\Sub\\**')) == ['Drive1\\Folder1\\Sub', 'Drive1\\Folder1\\Sub\\c.txt']
+    assert _paths(memfs.glob('**\\Sub\\**\\c.txt')) == ['Drive1\\Folder1\\Sub\\c.txt']
+    assert _paths(memfs.glob('Drive1\\Folder1')) == ['Drive1\\Folder1']
+    assert _paths(memfs.glob('Drive3\\**')) == []
+    assert len(list(memfs.glob('**'))) == 10
+
+
+def test_glob_skips_unmatched_subtrees():
+    """
+    Literal leading components are looked up directly rather than searched for
+    """
+    visited = []
+    drive2 = memfs.index._get_object('Drive2')
+
+    class Spy(dict):
+        def items(self):
+            visited.append('Drive2')
+            return dict.items(self)
+    drive2._children = Spy(drive2._children)
+    assert _paths(memfs.glob('Drive1\\**\\*.log')) == ['Drive1\\Folder1\\b.log']
+    assert visited == []
+
+
+def test_find():
+    """
+    Find yields the objects beneath a path that match every given criterion
+    """
+    assert _paths(memfs.find(type='drive')) == ['Drive1', 'Drive2']
+    assert _paths(memfs.find('Drive1', type='file', min_size=10)) == [
+        'Drive1\\Folder1\\Sub\\c.txt', 'Drive1\\Folder1\\a.txt']
+    assert _paths(memfs.find('Drive1', type='file', max_size=10)) == [
+        'Drive1\\Folder1\\a.txt', 'Drive1\\Folder1\\b.log', 'Drive1\\Zip1\\d.txt']
+    assert _paths(memfs.find(name='*.txt', min_size=1)) == ['Drive1\\Folder1\\Sub\\c.txt', 'Drive1\\Folder1\\a.txt']
+    assert _paths(memfs.find('Drive1\\Folder1\\Sub')) == ['Drive1\\Folder1\\Sub\\c.txt']
+
+
+def test_query():
+    """
+    Queries by type and name give the same results with and without the secondary indexes
+    """
+    expected = {
+        ('zip', None): ['Drive1\\Zip1'],
+        ('file', None): ['Drive1\\Folder1\\Sub\\c.txt', 'Drive1\\Folder1\\a.txt', 'Drive1\\Folder1\\b.log',
+                         'Drive1\\Zip1\\d.txt', 'Drive2\\e.txt'],
+        (None, 'a.txt'): ['Drive1\\Folder1\\a.txt'],
+        ('folder', 'a.txt'): [],
+        ('file', 'missing'): [],
+    }
+    for enabled in (False, True):
+        memfs.set_query_indexes(enabled)
+        for (fs_type, name), paths in expected.items():
+            assert _paths(memfs.query(type=fs_type, name=name)) == paths
+    memfs.set_query_indexes(False)
+
+
+def test_query_indexes_follow_changes(tmp_path):
+    """
+    The secondary indexes are kept up to date by create, delete, move, batches and load
+    """
+    memfs.set_query_indexes(True)
+    try:
+        memfs.create('file', 'config.json', 'Drive1\\Folder1\\Sub')
+        memfs.create('file', 'config.json', 'Drive2')
+        assert _paths(memfs.query(name='config.json')) == ['Drive1\\Folder1\\Sub\\config.json', 'Drive2\\config.json']
+
+        memfs.move('Drive1\\Folder1', 'Drive2\\Moved')
+        assert _paths(memfs.query(name='config.json')) == ['Drive2\\Moved\\Sub\\config.json', 'Drive2\\config.json']
+        assert _paths(memfs.query(type='folder')) == ['Drive2\\Moved', 'Drive2\\Moved\\Sub']
+
+        memfs.delete('Drive2\\Moved')
+        assert _paths(memfs.query(name='config.json')) == ['Drive2\\config.json']
+        assert memfs.query(name='Sub') == []
+
+        try:
+            with memfs.batch() as batch:
+                batch.create('zip', 'Zip2', 'Drive2')
+                batch.create('zip', 'Zip2', 'Drive2')
+            assert True == False  # Should not get here
+        except Exception as e:
+            assert type(e) == memfs.PathAlreadyExistsException
+        assert _paths(memfs.query(type='zip')) == ['Drive1\\Zip1']
+
+        path = str(tmp_path / 'fs.memfs')
+        memfs.save(path)
+        memfs.delete('Drive2')
+        assert memfs.query(type='drive') == [memfs.index._get_object('Drive1')]
+        memfs.load(path)
+        assert _paths(memfs.query(type='drive')) == ['Drive1', 'Drive2']
+        assert memfs.query(name='config.json') == [memfs.index._get_object('Drive2\\config.json')]
+    finally:
+        memfs.set_query_indexes(False)
+
+
+def test_query_without_criteria():
+    try:
+        memfs.query()
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation
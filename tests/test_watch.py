@@ -0,0 +1,83 @@
+import queue
+import memfs
+from memfs import IllegalFileSystemOperation, PathAlreadyExistsException
+from memfs.watch import Event
+
+
+def setup_function():
+    memfs.index._file_system.reset()
+
+
+def test_watch_ancestors():
+    """
+    Changes are reported to the watches of the changed path and of each of its ancestors
+    """
+    drive = memfs.create('drive', 'Drive1')
+    folder1 = memfs.create('folder', 'Folder1', drive)
+    memfs.create('folder', 'Folder2', drive)
+    received = {'': [], 'Drive1': [], 'Drive1\\Folder1': [], 'Drive1\\Folder2': []}
+    watches = [memfs.watch(path, received[path].append) for path in received]
+
+    file1 = memfs.create('file', 'File1', folder1)
+    memfs.write_to_file(file1, 'The Hobbit')
+    memfs.move(file1, 'Drive1\\Folder2\\File1')
+    memfs.delete('Drive1\\Folder2\\File1')
+    created = [Event('created', 'Drive1\\Folder1\\File1', None)]
+    modified = [Event('modified', 'Drive1\\Folder1\\File1', None)]
+    moved = [Event('moved', 'Drive1\\Folder1\\File1', 'Drive1\\Folder2\\File1')]
+    deleted = [Event('deleted', 'Drive1\\Folder2\\File1', None)]
+    assert received[''] == received['Drive1'] == [created, modified, moved, deleted]
+    assert received['Drive1\\Folder1'] == [created, modified, moved]
+    assert received['Drive1\\Folder2'] == [moved, deleted]
+
+    # Watches beneath a deleted container are told too, and closed watches are not
+    watches[0].close()
+    memfs.delete(folder1)
+    assert received['Drive1\\Folder1'][-1] == [Event('deleted', 'Drive1\\Folder1', None)]
+    assert len(received['']) == 4
+
+    # Failed operations report nothing
+    try:
+        memfs.create('folder', 'Folder2', drive)
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathAlreadyExistsException
+    assert len(received['Drive1']) == 5
+
+
+def test_watch_batches():
+    """
+    Each batch of operations is delivered at once, with repeated writes coalesced
+    """
+    drive = memfs.create('drive', 'Drive1')
+    events = queue.Queue()
+    memfs.watch(drive, queue=events)
+    with memfs.batch() as b:
+        b.create('file', 'File1', 'Drive1')
+        b.write_to_file('Drive1\\File1', 'One')
+        b.create('file', 'File2', 'Drive1')
+        b.write_to_file('Drive1\\File2', 'Two')
+        b.write_to_file('Drive1\\File2', 'Three')
+    assert events.get_nowait() == [Event('created', 'Drive1\\File1', None), Event('created', 'Drive1\\File2', None)]
+
+    with memfs.open('Drive1\\File1', 'a') as stream:
+        stream.write(' more')
+    assert events.get_nowait() == [Event('modified', 'Drive1\\File1', None)]
+
+    # Nothing is delivered for a rolled back batch
+    try:
+        with memfs.batch() as b:
+            b.write_to_file('Drive1\\File1', 'Four')
+            b.create('file', 'File1', 'Drive1')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == PathAlreadyExistsException
+    memfs.write_to_file('Drive1\\File2', 'Five')
+    assert events.get_nowait() == [Event('modified', 'Drive1\\File2', None)]
+    assert events.empty()
+
+    try:
+        memfs.watch('Drive1')
+        assert True == False  # Should not get here
+    except Exception as e:
+        assert type(e) == IllegalFileSystemOperation